@@ -1,10 +1,38 @@
 # -*- coding: utf-8 -*-
+from qingping_sdk import models
+from qingping_sdk.aggregate import Bucket, BucketAggregator, Stats, aggregate_history
+from qingping_sdk.archive import ArchiveReader, HistoryArchive
+from qingping_sdk.cache import ResponseCache
 from qingping_sdk.client import Client
+from qingping_sdk.columns import HistoryColumns
 from qingping_sdk.connection import (
     Connection,
     Event,
+    FrameEncoder,
+    HistoryRecords,
+    TLVWriter,
     build_history_data,
+    decode_history_data,
+    encode_history_data,
+    frame_checksum,
     parse_history_data,
+    scan_tlv,
 )
+from qingping_sdk.dispatch import Dispatcher
+from qingping_sdk.loader import BatchLoader
+from qingping_sdk.pool import ClientPool
+from qingping_sdk.ratelimit import RateLimiter, TokenBucket
+from qingping_sdk.reconcile import DeviceOutcome, Policy, Reconciler, diff_alerts
+from qingping_sdk.retry import RetryPolicy
+from qingping_sdk.scheduler import Delta, PollScheduler
+from qingping_sdk.server import DeviceProtocol, Gateway
+from qingping_sdk.sync import (
+    CheckpointStore,
+    HistorySync,
+    MemoryCheckpointStore,
+    SQLiteCheckpointStore,
+)
+from qingping_sdk.token_store import FileTokenStore, MemoryTokenStore, TokenStore
+from qingping_sdk.webhook import PushRecord, WebhookReceiver, build_push, replay
 
 __version__ = "0.0.2"
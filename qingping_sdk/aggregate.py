@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
+"""
+import math
+from typing import AsyncGenerator, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from qingping_sdk.client import Client
+from qingping_sdk.columns import METRICS
+from qingping_sdk.connection import HistoryRecords
+from qingping_sdk.typing import DeviceData, HistoryDataResponse
+
+try:
+    import numpy as np
+except ImportError:  # numpy是可选依赖
+    np = None
+
+RECORD_METRICS = (
+    "temperature",
+    "humidity",
+    "pressure",
+    "battery",
+)  # HistoryRecords里的指标
+
+
+class Stats:
+    """一个桶里一个指标的统计量,大小固定"""
+
+    __slots__ = ("count", "min", "max", "sum", "last", "last_time")
+
+    def __init__(self):
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self.sum = 0.0
+        self.last = None  # type: Optional[float]
+        self.last_time = -1  # last对应的时间戳
+
+    def add(self, value: float, timestamp: int) -> None:
+        self.count += 1
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.sum += value
+        if timestamp >= self.last_time:
+            self.last = value
+            self.last_time = timestamp
+
+    def merge(
+        self,
+        count: int,
+        min_: float,
+        max_: float,
+        sum_: float,
+        last: float,
+        last_time: int,
+    ) -> None:
+        """合并一段已经聚合好的数据"""
+        self.count += count
+        self.min = min(self.min, min_)
+        self.max = max(self.max, max_)
+        self.sum += sum_
+        if last_time >= self.last_time:
+            self.last = last
+            self.last_time = last_time
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.sum / self.count if self.count else None
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "min": self.min,
+            "max": self.max,
+            "mean": self.mean,
+            "last": self.last,
+        }
+
+
+class Bucket:
+    __slots__ = ("start", "width", "metrics")
+
+    def __init__(self, start: int, width: int):
+        self.start = start  # 桶的开始时间戳 包含
+        self.width = width
+        self.metrics = {}  # type: Dict[str, Stats]  # 没有数据的指标不会出现
+
+    @property
+    def end(self) -> int:
+        """桶的结束时间戳 不包含"""
+        return self.start + self.width
+
+    def __getitem__(self, metric: str) -> Stats:
+        return self.metrics[metric]
+
+    def __contains__(self, metric: str) -> bool:
+        return metric in self.metrics
+
+    def to_dict(self) -> dict:
+        ret = {"start": self.start, "end": self.end}
+        for metric, stats in self.metrics.items():
+            ret[metric] = stats.to_dict()
+        return ret
+
+    def __repr__(self):
+        return f"Bucket({self.to_dict()!r})"
+
+
+class BucketAggregator:
+    def __init__(
+        self,
+        width: int,
+        metrics: Sequence[str] = METRICS,
+        retention: int = None,
+    ):
+        """
+        按固定宽度的时间桶一遍聚合历史数据,每个桶每个指标只保留count/min/max/sum/last
+        数据可以乱序和重复到达,已经输出过的桶收到新数据后会再次输出
+        :param width: 桶宽度 单位s 例如300 3600
+        :param metrics: 需要聚合的指标
+        :param retention: 已经关闭的桶保留多少秒用来接收迟到的数据,None表示一直保留
+        """
+        self.width = width
+        self.metrics = tuple(metrics)
+        self.retention = retention
+        self.buckets = {}  # type: Dict[int, Bucket]
+        self._dirty = set()  # 有新数据还没输出的桶
+        self.watermark = None  # type: Optional[int]  # 上一次emit的水位
+        self.dropped = 0  # 落在已经淘汰的桶里的数据
+
+    def _bucket(self, start: int) -> Optional[Bucket]:
+        bucket = self.buckets.get(start)
+        if bucket is None:
+            if (
+                self.retention is not None
+                and self.watermark is not None
+                and start + self.width <= self.watermark - self.retention
+            ):
+                self.dropped += 1
+                return None
+            bucket = self.buckets[start] = Bucket(start, self.width)
+        self._dirty.add(start)
+        return bucket
+
+    def add(self, timestamp: int, values: Dict[str, Optional[float]]) -> None:
+        """
+        :param timestamp: 单位s
+        :param values: 指标 -> 值,None和NaN按缺失处理
+        """
+        bucket = self._bucket(timestamp - timestamp % self.width)
+        if bucket is None:
+            return
+        for metric in self.metrics:
+            value = values.get(metric)
+            if value is None or value != value:
+                continue
+            stats = bucket.metrics.get(metric)
+            if stats is None:
+                stats = bucket.metrics[metric] = Stats()
+            stats.add(value, timestamp)
+
+    def add_rows(self, rows: Iterable[DeviceData]) -> None:
+        """get_history_data返回的一页数据"""
+        metrics = self.metrics
+        for row in rows:
+            values = {}
+            for metric in metrics:
+                detail = row.get(metric)
+                if detail:
+                    values[metric] = detail.get("value")
+            self.add(int(row["timestamp"]["value"]), values)
+
+    def add_response(self, resp: HistoryDataResponse) -> None:
+        self.add_rows(resp["data"])
+
+    def add_records(self, records: HistoryRecords) -> None:
+        """decode_history_data解码出的记录,numpy数组按桶分段整体聚合"""
+        metrics = [m for m in RECORD_METRICS if m in self.metrics]
+        if np is None or not isinstance(records.timestamp, np.ndarray):
+            for i, timestamp in enumerate(records.timestamp):
+                self.add(int(timestamp), {m: getattr(records, m)[i] for m in metrics})
+            return
+        if not len(records):
+            return
+        # 记录的时间戳是递增的,同一个桶的记录是连续的一段
+        keys = records.timestamp - records.timestamp % self.width
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(keys)) + 1))
+        index = np.arange(len(keys))
+        reduced = []
+        for metric in metrics:
+            values = np.asarray(getattr(records, metric), dtype=np.float64)
+            valid = ~np.isnan(values)
+            count = np.add.reduceat(valid.astype(np.int64), starts)
+            last = np.maximum.reduceat(np.where(valid, index, -1), starts)
+            reduced.append(
+                (
+                    metric,
+                    count,
+                    np.fmin.reduceat(values, starts),
+                    np.fmax.reduceat(values, starts),
+                    np.add.reduceat(np.where(valid, values, 0.0), starts),
+                    last,
+                    values,
+                )
+            )
+        for i, start in enumerate(keys[starts].tolist()):
+            bucket = self._bucket(start)
+            if bucket is None:
+                continue
+            for metric, count, min_, max_, sum_, last, values in reduced:
+                if not count[i]:
+                    continue
+                stats = bucket.metrics.get(metric)
+                if stats is None:
+                    stats = bucket.metrics[metric] = Stats()
+                stats.merge(
+                    int(count[i]),
+                    float(min_[i]),
+                    float(max_[i]),
+                    float(sum_[i]),
+                    float(values[last[i]]),
+                    int(records.timestamp[last[i]]),
+                )
+
+    def emit(self, watermark: int = None) -> List[Bucket]:
+        """
+        输出有新数据的桶
+        :param watermark: 只输出结束时间不晚于它的桶(已经关闭的桶),None表示全部输出
+        :return: 按时间排序,同一个桶更新后会再次输出同一个对象
+        """
+        if watermark is None:
+            ready = sorted(self._dirty)
+        else:
+            ready = sorted(s for s in self._dirty if s + self.width <= watermark)
+            if self.watermark is None or watermark > self.watermark:
+                self.watermark = watermark
+        self._dirty.difference_update(ready)
+        out = [self.buckets[start] for start in ready]
+        if self.retention is not None and self.watermark is not None:
+            horizon = self.watermark - self.retention
+            for start in [s for s in self.buckets if s + self.width <= horizon]:
+                if start not in self._dirty:
+                    del self.buckets[start]
+        return out
+
+    def series(
+        self, metric: str, field: str = "mean", start: int = None, end: int = None
+    ) -> Tuple[List[int], List[Optional[float]]]:
+        """
+        画图用的等间隔序列,没有数据的桶为None
+        :param metric:
+        :param field: count min max mean last
+        :param start: 默认第一个桶
+        :param end: 默认最后一个桶
+        :return: (桶开始时间, 值)
+        """
+        if not self.buckets:
+            return [], []
+        start = min(self.buckets) if start is None else start - start % self.width
+        end = max(self.buckets) if end is None else end
+        times = list(range(start, end + 1, self.width))
+        values = []
+        for t in times:
+            bucket = self.buckets.get(t)
+            stats = bucket.metrics.get(metric) if bucket is not None else None
+            values.append(getattr(stats, field) if stats is not None else None)
+        return times, values
+
+
+async def aggregate_history(
+    client: Client,
+    mac: str,
+    start_time: int,
+    end_time: int,
+    width: int,
+    metrics: Sequence[str] = METRICS,
+    concurrency: int = 4,
+) -> AsyncGenerator[Bucket, None]:
+    """
+    边分页拉取历史数据边聚合,桶一关闭就输出,不保留原始数据
+    :param client:
+    :param mac: 设备mac地址
+    :param start_time: 开始时间戳 单位s
+    :param end_time: 结束时间戳
+    :param width: 桶宽度 单位s
+    :param metrics: 需要聚合的指标
+    :param concurrency: 同时请求的页数
+    :return:
+    """
+    aggregator = BucketAggregator(width, metrics, retention=0)
+    current = None
+    async for row in client.iter_history_data(
+        mac, start_time, end_time, concurrency=concurrency
+    ):
+        timestamp = int(row["timestamp"]["value"])
+        start = timestamp - timestamp % width
+        if current is not None and start > current:
+            # 数据按时间顺序返回,到了新的桶之前的桶就不会再有数据
+            for bucket in aggregator.emit(start):
+                yield bucket
+        current = start
+        aggregator.add_rows((row,))
+    for bucket in aggregator.emit():
+        yield bucket
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
+"""
+import mmap
+import os
+import struct
+from bisect import bisect_left
+from heapq import merge
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# 和connection.parse_history_data相同的格式
+_HISTORY_HEADER = struct.Struct("<IH")  # 时间戳 存储间隔
+_HISTORY_RECORD = struct.Struct("<3BHB")  # 温湿度 气压 电量
+_INDEX_ENTRY = struct.Struct("<IHIQ")  # 起始时间戳 存储间隔 条数 在.dat中的偏移
+RECORD_SIZE = _HISTORY_RECORD.size
+
+Segment = Tuple[int, int, memoryview]  # 起始时间戳 存储间隔 连续的记录
+
+
+class ArchiveReader:
+    def __init__(self, data_path: str, index_path: str):
+        """
+        只读打开一个设备的归档,.dat用mmap映射,查询结果直接引用映射的内存
+        :param data_path:
+        :param index_path:
+        """
+        self._mmap = None  # type: Optional[mmap.mmap]
+        self._view = memoryview(b"")
+        size = os.path.getsize(data_path) if os.path.exists(data_path) else 0
+        if size:
+            with open(data_path, "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._view = memoryview(self._mmap)
+        entries = []
+        if os.path.exists(index_path):
+            with open(index_path, "rb") as f:
+                raw = f.read()
+            raw = raw[: len(raw) - len(raw) % _INDEX_ENTRY.size]
+            for start, internal, count, offset in _INDEX_ENTRY.iter_unpack(raw):
+                if offset + count * RECORD_SIZE > size:
+                    break  # 写.dat的时候崩溃了,后面的索引不可信
+                entries.append((start, internal, count, offset))
+        self.sorted = all(
+            a[0] + (a[2] - 1) * a[1] < b[0] for a, b in zip(entries, entries[1:])
+        )  # 乱序追加过的归档需要compact
+        if not self.sorted:
+            entries.sort()
+        self.entries = entries
+        self._ends = [
+            start + (count - 1) * internal for start, internal, count, _ in entries
+        ]  # 每段最后一条记录的时间戳,用来二分
+
+    def __len__(self) -> int:
+        return sum(entry[2] for entry in self.entries)
+
+    @property
+    def first(self) -> Optional[int]:
+        return self.entries[0][0] if self.entries else None
+
+    @property
+    def last(self) -> Optional[int]:
+        return max(self._ends) if self._ends else None
+
+    def range(self, start: int, end: int) -> List[Segment]:
+        """
+        取出[start, end]内的记录,不复制数据
+        :param start: 开始时间戳 单位s
+        :param end: 结束时间戳 单位s
+        :return: [(第一条的时间戳, 存储间隔, 记录)],拼上_HISTORY_HEADER就是parse_history_data的格式
+        """
+        result = []
+        if self.sorted:
+            i = bisect_left(self._ends, start)
+        else:
+            i = 0  # 段之间有重叠,只能逐段检查
+        entries = self.entries
+        view = self._view
+        while i < len(entries):
+            seg_start, internal, count, offset = entries[i]
+            i += 1
+            if seg_start > end:
+                if self.sorted:
+                    break
+                continue
+            if internal:
+                first = max(0, -(-(start - seg_start) // internal))
+                last = min(count, (end - seg_start) // internal + 1)
+            else:  # 只有一条记录的段
+                first, last = 0, int(seg_start >= start)
+            if first >= last:
+                continue
+            result.append(
+                (
+                    seg_start + first * internal,
+                    internal,
+                    view[offset + first * RECORD_SIZE : offset + last * RECORD_SIZE],
+                )
+            )
+        return result
+
+    def close(self):
+        """还有查询结果在使用时不能关闭,等它们被回收后映射会自动释放"""
+        self._view.release()
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+
+def _segment_records(
+    start: int, internal: int, count: int, offset: int
+) -> Iterator[Tuple[int, int]]:
+    """一段里每条记录的(时间戳, 在.dat中的偏移),偏移越小追加得越早"""
+    for i in range(count):
+        yield start + i * internal, offset + i * RECORD_SIZE
+
+
+class HistoryArchive:
+    def __init__(self, directory: str):
+        """
+        按设备存放历史数据的归档目录,每个设备两个文件:
+        {mac}.dat 依次追加的6字节原始记录
+        {mac}.idx 每段连续记录一个索引项(起始时间戳, 存储间隔, 条数, 偏移),相邻且间隔相同的段会合并
+        :param directory:
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._readers = {}  # type: Dict[str, ArchiveReader]
+        self._tails = {}  # type: Dict[str, Optional[tuple]]  # 索引文件的最后一项
+
+    def _paths(self, mac: str) -> Tuple[str, str]:
+        if not mac or os.path.basename(mac) != mac or mac.startswith("."):
+            raise ValueError(f"invalid mac {mac!r}")
+        base = os.path.join(self.directory, mac)
+        return base + ".dat", base + ".idx"
+
+    def reader(self, mac: str) -> ArchiveReader:
+        """打开设备的归档,追加或compact之后会重新打开"""
+        reader = self._readers.get(mac)
+        if reader is None:
+            reader = self._readers[mac] = ArchiveReader(*self._paths(mac))
+        return reader
+
+    def range(self, mac: str, start: int, end: int) -> List[Segment]:
+        return self.reader(mac).range(start, end)
+
+    def append(self, mac: str, payload: bytes) -> int:
+        """
+        追加一段parse_history_data格式的历史数据
+        :param mac:
+        :param payload: 4字节时间戳 2字节存储间隔 若干6字节记录
+        :return: 实际写入的条数,和已有数据重叠的部分会被跳过
+        """
+        view = memoryview(payload)
+        time, internal = _HISTORY_HEADER.unpack_from(view)
+        return self.append_records(mac, time, internal, view[_HISTORY_HEADER.size :])
+
+    def append_records(self, mac: str, time: int, internal: int, records: bytes) -> int:
+        """
+        :param mac:
+        :param time: 第一条记录的时间戳
+        :param internal: 存储间隔 单位s
+        :param records: 若干6字节记录
+        :return: 实际写入的条数
+        """
+        records = memoryview(records)
+        count = len(records) // RECORD_SIZE
+        records = records[: count * RECORD_SIZE]
+        data_path, index_path = self._paths(mac)
+        last = self._tail(mac, index_path)
+        runs = [(time, records)]
+        if last is not None and internal and internal == last[1]:
+            last_time = last[0] + (last[2] - 1) * last[1]
+            end_time = time + (count - 1) * internal
+            if (
+                time <= last_time
+                and end_time >= last[0]
+                and (last[0] - time) % internal == 0
+            ):
+                # 和最后一段重叠,只跳过落在[last[0], last_time]内的记录
+                head = max(0, (last[0] - time) // internal)  # 比最后一段还早的部分
+                rest = (last_time - time) // internal + 1  # 接在最后一段后面的部分
+                runs = []
+                if rest < count:
+                    runs.append((time + rest * internal, records[rest * RECORD_SIZE :]))
+                if head:
+                    # 单独成段,索引变成乱序,compact时再合并
+                    runs.append((time, records[: head * RECORD_SIZE]))
+        written = 0
+        for run_time, run in runs:
+            written += self._append_run(
+                mac, data_path, index_path, run_time, internal, run
+            )
+        if written:
+            self._drop_reader(mac)
+        return written
+
+    def _append_run(
+        self,
+        mac: str,
+        data_path: str,
+        index_path: str,
+        time: int,
+        internal: int,
+        records: memoryview,
+    ) -> int:
+        count = len(records) // RECORD_SIZE
+        if count <= 0:
+            return 0
+        last = self._tail(mac, index_path)
+        offset = os.path.getsize(data_path) if os.path.exists(data_path) else 0
+        with open(data_path, "ab") as f:
+            f.write(records)  # 先写数据再写索引,崩溃时最多丢掉这一段
+        if (
+            last is not None
+            and internal == last[1]
+            and time == last[0] + last[2] * internal
+            and offset == last[3] + last[2] * RECORD_SIZE
+        ):
+            # 和上一段首尾相接,直接改上一段的条数
+            entry = (last[0], internal, last[2] + count, last[3])
+            with open(index_path, "r+b") as f:
+                f.seek(-_INDEX_ENTRY.size, os.SEEK_END)
+                f.write(_INDEX_ENTRY.pack(*entry))
+        else:
+            entry = (time, internal, count, offset)
+            with open(index_path, "ab") as f:
+                f.write(_INDEX_ENTRY.pack(*entry))
+        self._tails[mac] = entry
+        return count
+
+    def _tail(self, mac: str, index_path: str) -> Optional[tuple]:
+        if mac not in self._tails:
+            entry = None
+            if os.path.exists(index_path):
+                with open(index_path, "r+b") as f:
+                    size = f.seek(0, os.SEEK_END)
+                    if size % _INDEX_ENTRY.size:
+                        size -= size % _INDEX_ENTRY.size
+                        f.truncate(size)  # 写索引的时候崩溃了
+                    if size:
+                        f.seek(size - _INDEX_ENTRY.size)
+                        entry = _INDEX_ENTRY.unpack(f.read(_INDEX_ENTRY.size))
+            self._tails[mac] = entry
+        return self._tails[mac]
+
+    def _drop_reader(self, mac: str):
+        reader = self._readers.pop(mac, None)
+        if reader is not None:
+            try:
+                reader.close()
+            except BufferError:
+                pass  # 外面还拿着查询结果,等它们被回收后映射会自动释放
+
+    def compact(self, mac: str, before: int = None) -> int:
+        """
+        按时间重写归档:去掉重复的时间戳,重新合并连续的段
+        各段已经按起始时间排序,逐条归并写出,不在内存里保留记录
+        :param mac:
+        :param before: 同时丢掉这个时间戳之前的记录
+        :return: 剩下的条数
+        """
+        reader = self.reader(mac)
+        view = reader._view
+        data_path, index_path = self._paths(mac)
+        entries = []
+        written = 0
+        previous = None  # 上一条写出的时间戳,重复的时间戳只保留先追加的那条
+        with open(data_path + ".tmp", "wb") as f:
+            for timestamp, pos in merge(
+                *(_segment_records(*entry) for entry in reader.entries)
+            ):
+                if timestamp == previous or (before is not None and timestamp < before):
+                    continue
+                previous = timestamp
+                written += 1
+                last = entries[-1] if entries else None
+                if last is not None and (
+                    (last[2] == 1 and timestamp - last[0] < 65536)
+                    or timestamp == last[0] + last[2] * last[1]
+                ):
+                    internal = timestamp - last[0] if last[2] == 1 else last[1]
+                    entries[-1] = (last[0], internal, last[2] + 1, last[3])
+                else:
+                    entries.append((timestamp, 0, 1, f.tell()))
+                f.write(view[pos : pos + RECORD_SIZE])
+        with open(index_path + ".tmp", "wb") as f:
+            for entry in entries:
+                f.write(_INDEX_ENTRY.pack(*entry))
+        del view
+        self._drop_reader(mac)  # 替换文件之前释放映射
+        self._tails[mac] = entries[-1] if entries else None
+        os.replace(data_path + ".tmp", data_path)
+        os.replace(index_path + ".tmp", index_path)
+        return written
+
+    def close(self):
+        for mac in list(self._readers):
+            self._drop_reader(mac)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Set, Tuple
+
+FRESH = "fresh"
+STALE = "stale"
+MISS = "miss"
+
+DEFAULT_TTL = {
+    "groups": 300,
+    "devices": 300,  # 只缓存设备信息,不含实时读数
+    "alert": 300,
+    "device_info": 3600,
+}  # 各接口的缓存时间(秒)
+
+
+class ResponseCache:
+    def __init__(
+        self, maxsize: int = 1024, ttl: Dict[str, float] = None, stale_ttl: float = 60
+    ):
+        """
+        TTL + LRU的响应缓存
+        命中时直接返回缓存的对象,不做复制,调用方不能修改返回值
+        :param maxsize: 最多缓存的响应数,超出后淘汰最久没用过的
+        :param ttl: 接口名 -> 缓存时间(秒) 接口名为 groups devices alert device_info
+        :param stale_ttl: 过期后还能继续返回旧值的时间(秒),期间在后台刷新
+        """
+        self.maxsize = maxsize
+        self.ttl = dict(DEFAULT_TTL)
+        self.ttl.update(ttl or {})
+        self.stale_ttl = stale_ttl
+        self._entries = OrderedDict()  # key -> (过期时间, 值, tags)
+        self._tags = {}  # type: Dict[str, Set[Hashable]]
+        self.generation = 0  # 每次失效+1,用来丢弃失效前发出的请求的结果
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Tuple[Hashable, ...]) -> Tuple[str, Any]:
+        """
+        :param key: 第一个元素是接口名
+        :return: (FRESH/STALE/MISS, 值)
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return MISS, None
+        expires_at, value, _ = entry
+        now = time.monotonic()
+        if now < expires_at:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return FRESH, value
+        if now < expires_at + self.stale_ttl:
+            self._entries.move_to_end(key)
+            self.stale_hits += 1
+            return STALE, value
+        self._discard(key)
+        self.misses += 1
+        return MISS, None
+
+    def set(
+        self,
+        key: Tuple[Hashable, ...],
+        value: Any,
+        tags: Iterable[str] = (),
+        generation: int = None,
+    ) -> None:
+        """
+        :param generation: 发请求前的self.generation,期间发生过失效则不写入
+        """
+        if generation is not None and generation != self.generation:
+            return
+        ttl = self.ttl.get(key[0])
+        if not ttl:
+            return
+        self._discard(key)
+        tags = tuple(tags)
+        self._entries[key] = (time.monotonic() + ttl, value, tags)
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(key)
+        while len(self._entries) > self.maxsize:
+            self._discard(next(iter(self._entries)))
+
+    def invalidate(self, *tags: str) -> None:
+        self.generation += 1
+        for tag in tags:
+            for key in self._tags.pop(tag, ()):
+                self._discard(key)
+
+    def clear(self) -> None:
+        self.generation += 1
+        self._entries.clear()
+        self._tags.clear()
+
+    def _discard(self, key: Tuple[Hashable, ...]) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
@@ -6,10 +6,28 @@ Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
 import asyncio
 import json
 import time
-from typing import List
+from collections import deque
+from functools import partial
+from typing import (
+    Any,
+    AsyncGenerator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Sequence,
+    Tuple,
+    Type,
+    Union,
+)
+from urllib.parse import urlsplit
 
 import aiohttp
 
+from qingping_sdk import models
+from qingping_sdk.cache import FRESH, STALE, ResponseCache
+from qingping_sdk.columns import METRICS, HistoryColumns
 from qingping_sdk.exceptions import (
     AuthException,
     ConflictException,
@@ -17,25 +35,80 @@ from qingping_sdk.exceptions import (
     NotFoundException,
     RequestException,
     ServerException,
+    UnauthorizedException,
 )
+from qingping_sdk.loader import BatchLoader
+from qingping_sdk.ratelimit import RateLimiter
+from qingping_sdk.retry import RetryPolicy
+from qingping_sdk.token_store import TokenStore
 from qingping_sdk.typing import (
     AlertConfig,
     Device,
+    DeviceData,
     DeviceInfoResponse,
     DeviceResponse,
+    Event,
     GetAccessTokenResponse,
     GetAlertResponse,
     GetGroupsResponse,
     HistoryDataResponse,
     HistoryEventResponse,
+    Profile,
+)
+from qingping_sdk.utils import (
+    JSONArrayStream,
+    create_auth,
+    is_json_content_type,
+    make_timestamp,
 )
-from qingping_sdk.utils import create_auth
 
 JSON_ENCODING = "utf-8"
 DEFAULT_JSON_DECODER = json.loads
 DEFAULT_JSON_ENCODER = json.dumps
 DEFAULT_ENDPOINT = "oauth.cleargrass.com"
 DEFAULT_API_ENDPOINT = "apis.cleargrass.com"
+MAX_PAGE_LIMIT = 200  # 历史数据/事件单次最多返回200条
+# 批量接口单次携带的mac数量上限
+# 开放平台文档没有写明macList的上限,这里是保守的取值,可以用Client的batch_size调整
+MAX_MAC_LIST = 100
+MIN_REFRESH_DELAY = 1.0  # 刷新token失败后至少等待的时间(秒)
+
+
+def _restamp(data: dict = None) -> dict:
+    """重试时替换掉过期的timestamp,服务端不接受重复或者超过20s的时间戳"""
+    if data is None or "timestamp" not in data:
+        return data
+    data = dict(data)
+    data["timestamp"] = make_timestamp()
+    return data
+
+
+def _devices_params(
+    group_id: int = None,
+    offset: int = None,
+    limit: int = None,
+    role: str = None,
+    timestamp: int = None,
+) -> dict:
+    params = {"timestamp": timestamp or make_timestamp()}
+    if group_id is not None:
+        params["group_id"] = group_id
+    if offset is not None:
+        params["offset"] = offset
+    if limit is not None:
+        params["limit"] = limit
+    if role is not None:
+        params["role"] = role
+    return params
+
+
+def _strip_device_data(resp: DeviceResponse) -> DeviceResponse:
+    """去掉设备列表里的实时读数,只缓存设备信息"""
+    if not isinstance(resp, dict):
+        return resp
+    return dict(
+        resp, devices=[{"info": device.get("info")} for device in resp["devices"]]
+    )
 
 
 class Client:
@@ -48,6 +121,17 @@ class Client:
         client_session=None,
         close_on_exit: bool = True,
         loop: asyncio.AbstractEventLoop = None,
+        retry_policy: RetryPolicy = None,
+        rate_limiter: RateLimiter = None,
+        refresh_margin: float = 60,
+        token_store: TokenStore = None,
+        cache: ResponseCache = None,
+        coalesce: bool = True,
+        use_models: bool = False,
+        max_concurrency: int = None,
+        lazy_token: bool = False,
+        batch_delay: float = 0.005,
+        batch_size: int = MAX_MAC_LIST,
         **kw,
     ):
         self.app_key = app_key
@@ -62,15 +146,38 @@ class Client:
         self.dumps = (
             self.kw.pop("dumps") if "dumps" in self.kw else DEFAULT_JSON_ENCODER
         )
+        self.loads_bytes = self.kw.pop(
+            "loads_bytes", True
+        )  # loads能否直接吃bytes, json/orjson都可以
         self._loop = loop or asyncio.get_running_loop()
         self.client_session = client_session or aiohttp.ClientSession(
             json_serialize=self.dumps
         )  # aiohttp的会话
         self._close_on_exit = close_on_exit
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.rate_limiter = rate_limiter  # 可以在多个Client之间共享
+
+        self.refresh_margin = refresh_margin  # 提前多少秒刷新token
+        self.token_store = token_store
+        self.cache = cache
+        self._revalidating = {}  # 正在后台刷新的缓存 key -> task
+        self.coalesce = coalesce  # 合并相同的并发GET请求
+        self._inflight = {}  # type: Dict[tuple, asyncio.Task]
+        self.batch_delay = batch_delay  # 批量合并时第一个请求最多等待的时间(秒)
+        self.batch_size = batch_size  # 批量合并时单次请求最多携带的mac数
+        self._loaders = {}  # type: Dict[tuple, BatchLoader]
+        self.use_models = use_models  # 返回qingping_sdk.models中的紧凑模型而不是dict
+        self._semaphore = (
+            asyncio.Semaphore(max_concurrency) if max_concurrency else None
+        )  # 同时在途的请求数上限,多个租户共用连接池时保证公平
+        self.lazy_token = lazy_token  # 不用async with,第一次请求时才获取token
 
         self._task = None
+        self._auth_task = None  # type: asyncio.Task
         self._ready = self._loop.create_future()
         self.access_token = None
+        self._token_expires_at = 0.0
+        self._token_lifetime = 0.0  # token的有效期(秒)
 
     async def _get_access_token(self) -> GetAccessTokenResponse:
         auth_str = create_auth(self.app_key, self.app_secret)
@@ -94,35 +201,185 @@ class Client:
 
     async def __aenter__(self):
         self._task = self._loop.create_task(self._refresh_token())
-        await self._ready
+        try:
+            await self._ready
+        except BaseException:
+            self._cancel_background()
+            if self._close_on_exit:
+                await self.aclose()
+            raise
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        self._task.cancel()
-        try:
-            await self._task
-        except asyncio.CancelledError:
-            pass
+        self._cancel_background()
+        if self._task is not None:
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
         if self._close_on_exit:
             await self.aclose()
         return False
 
+    def _cancel_background(self):
+        for task in list(self._revalidating.values()):
+            task.cancel()
+        for loader in self._loaders.values():
+            loader.close()
+        if self._task is not None:
+            self._task.cancel()
+
+    def _load_token(self) -> bool:
+        if self.token_store is None:
+            return False
+        token = self.token_store.load(self.app_key)
+        if not token or token["expires_at"] - self.refresh_margin <= time.time():
+            return False
+        self.access_token = token["access_token"]
+        self._token_expires_at = token["expires_at"]
+        # 不知道原始有效期,按剩余时间算
+        self._token_lifetime = token["expires_at"] - time.time()
+        return True
+
+    async def _fetch_token(self):
+        access_token_data = await self._get_access_token()
+        self.access_token = access_token_data["access_token"]
+        self._token_lifetime = access_token_data["expires_in"]
+        self._token_expires_at = time.time() + self._token_lifetime
+        if self.token_store is not None:
+            self.token_store.save(
+                self.app_key,
+                {
+                    "access_token": self.access_token,
+                    "expires_at": self._token_expires_at,
+                },
+            )
+
+    def _refresh_at(self) -> float:
+        """
+        该刷新token的时间,有效期比refresh_margin还短时改为在有效期过半时刷新,
+        否则刚拿到的token立刻就需要刷新
+        """
+        return self._token_expires_at - min(
+            self.refresh_margin, self._token_lifetime / 2
+        )
+
+    async def _ensure_token(self):
+        """
+        没有用async with启动后台刷新时,在发请求前按需获取token
+        快过期的token也会在这里换掉
+        """
+        if self.access_token is not None and self._refresh_at() > time.time():
+            return
+        if not self._load_token():
+            await self._reauthenticate()
+
+    async def _reauthenticate(self):
+        """重新获取token,同一时间只会有一个请求发往/oauth2/token"""
+        if self._auth_task is None or self._auth_task.done():
+            self._auth_task = self._loop.create_task(self._fetch_token())
+        await asyncio.shield(self._auth_task)
+
     async def _refresh_token(self):
+        try:
+            if not self._load_token():
+                await self._reauthenticate()
+        except Exception as e:
+            if not self._ready.done():
+                self._ready.set_exception(e)
+            return
+        if not self._ready.done():
+            self._ready.set_result(None)
+        attempt = 0
         while True:
-            access_token_data = await self._get_access_token()
-            self.access_token = access_token_data["access_token"]
-            if not self._ready.done() and not self._ready.cancelled():
-                self._ready.set_result(None)
-            await asyncio.sleep(access_token_data["expires_in"])
-        # def cb():
-        #     self._loop.create_task(self._refresh_token())
-        #
-        # self._handle = self._loop.call_later(access_token_data["expires_in"], cb)
+            # 在过期前refresh_margin秒刷新,401时的重新认证也会推迟这里的刷新
+            delay = self._refresh_at() - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            try:
+                await self._reauthenticate()
+                attempt = 0
+            except Exception:
+                attempt += 1
+                await asyncio.sleep(
+                    max(self.retry_policy.backoff(attempt), MIN_REFRESH_DELAY)
+                )
 
     async def send_request(
         self, method="GET", url: str = None, params: dict = None, json: dict = None
     ):
+        """
+        发送请求,遇到retry_policy.retry_on中的异常时按指数退避重试
+        每次重试都会重新生成timestamp字段,配置了rate_limiter时每次发送前都要先拿到令牌
+        401时重新获取token后透明地重试一次
+        开启coalesce时,参数相同(不算timestamp)的并发GET请求共用一个请求和同一个返回值对象,
+        为了不复制大的响应,返回值不做拷贝,调用方需要修改时自己先复制一份
+        """
         url = url or f"https://{self._api_endpoint}/v1/apis/devices"
+        if method != "GET" or not self.coalesce:
+            return await self._send_request(method, url, params, json)
+        key = (
+            method,
+            url,
+            tuple(
+                sorted((k, v) for k, v in (params or {}).items() if k != "timestamp")
+            ),
+        )
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._loop.create_task(self._send_request(method, url, params, json))
+            self._inflight[key] = task
+            task.add_done_callback(partial(self._forget_inflight, key))
+        # shield: 某个调用方被取消不影响其他等待同一个请求的调用方
+        return await asyncio.shield(task)
+
+    def _forget_inflight(self, key: tuple, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # 所有调用方都被取消时避免 exception was never retrieved
+
+    async def _send_request(
+        self, method: str, url: str, params: dict = None, json: dict = None
+    ):
+        path = urlsplit(url).path
+        attempt = 0
+        reauthenticated = False
+        while True:
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire(path)
+            if self.lazy_token and self._task is None:
+                await self._ensure_token()
+            token = self.access_token
+            try:
+                if self._semaphore is None:
+                    return await self._send_once(method, url, params, json)
+                async with self._semaphore:
+                    return await self._send_once(method, url, params, json)
+            except UnauthorizedException:
+                if reauthenticated:
+                    raise
+                reauthenticated = True
+                if self.access_token == token:  # 别的请求可能已经换过token了
+                    await self._reauthenticate()
+                params = _restamp(params)
+                json = _restamp(json)
+                continue
+            except self.retry_policy.retry_on:
+                attempt += 1
+                if (
+                    attempt >= self.retry_policy.max_attempts
+                    or method.upper() not in self.retry_policy.retry_methods
+                ):
+                    raise
+            await asyncio.sleep(self.retry_policy.backoff(attempt))
+            params = _restamp(params)
+            json = _restamp(json)
+
+    async def _send_once(
+        self, method: str, url: str, params: dict = None, json: dict = None
+    ):
         async with self.client_session.request(
             method,
             url,
@@ -131,22 +388,102 @@ class Client:
             headers={"Authorization": f"Bearer {self.access_token}"},
         ) as resp:
             if resp.status == 200:
-                try:
-                    return await resp.json(loads=self.loads)
-                except aiohttp.client_exceptions.ContentTypeError:
+                if not self.loads_bytes:
+                    try:
+                        return await resp.json(loads=self.loads)
+                    except aiohttp.client_exceptions.ContentTypeError:
+                        return await resp.text()
+                if not is_json_content_type(resp.content_type):
                     return await resp.text()
-            elif resp.status == 400:
-                raise RequestException(await resp.text())
-            elif resp.status in (401, 403):
-                raise AuthException(await resp.text())
-            elif resp.status == 404:
-                raise NotFoundException(await resp.text())
-            elif resp.status == 408:
-                raise ExpiredException(await resp.text())
-            elif resp.status == 409:
-                raise ConflictException(await resp.text())
-            elif resp.status in (500, 503):
-                raise ServerException(await resp.text())
+                body = await resp.read()
+                if not body.strip():
+                    return None
+                return self.loads(body)  # 直接交给loads,省掉一次bytes->str
+            await self._raise_for_status(resp)
+
+    @staticmethod
+    async def _raise_for_status(resp: aiohttp.ClientResponse):
+        if resp.status == 400:
+            raise RequestException(await resp.text())
+        elif resp.status == 401:
+            raise UnauthorizedException(await resp.text())
+        elif resp.status == 403:
+            raise AuthException(await resp.text())
+        elif resp.status == 404:
+            raise NotFoundException(await resp.text())
+        elif resp.status == 408:
+            raise ExpiredException(await resp.text())
+        elif resp.status == 409:
+            raise ConflictException(await resp.text())
+        elif resp.status in (500, 503):
+            raise ServerException(await resp.text())
+
+    def _decode(self, model: Type[models.Model], resp):
+        if self.use_models and isinstance(resp, dict):
+            return model(resp)
+        return resp
+
+    async def _cached(
+        self,
+        key: tuple,
+        tags: Iterable[str],
+        method: str,
+        url: str,
+        params: dict = None,
+        json: dict = None,
+        transform: Callable[[Any], Any] = None,
+    ):
+        """
+        带缓存的请求,没有配置cache时直接发送
+        缓存过期但还在stale_ttl内时直接返回旧值,并在后台刷新
+        命中时返回的是缓存里的同一个对象,调用方不能修改它
+        :param transform: 写入缓存之前对响应做的处理,例如只保留不常变的字段
+        """
+        if self.cache is None:
+            value = await self.send_request(method, url, params=params, json=json)
+            return transform(value) if transform is not None else value
+        state, value = self.cache.get(key)
+        if state == FRESH:
+            return value
+        if state == STALE:
+            if key not in self._revalidating:
+                self._revalidating[key] = self._loop.create_task(
+                    self._revalidate(key, tags, method, url, params, json, transform)
+                )
+            return value
+        generation = self.cache.generation
+        value = await self.send_request(method, url, params=params, json=json)
+        if transform is not None:
+            value = transform(value)
+        self.cache.set(key, value, tags, generation)
+        return value
+
+    async def _revalidate(
+        self,
+        key: tuple,
+        tags: Iterable[str],
+        method: str,
+        url: str,
+        params: dict = None,
+        json: dict = None,
+        transform: Callable[[Any], Any] = None,
+    ):
+        try:
+            generation = self.cache.generation
+            value = await self.send_request(
+                method, url, params=_restamp(params), json=_restamp(json)
+            )
+            if transform is not None:
+                value = transform(value)
+            self.cache.set(key, value, tags, generation)
+        except Exception:
+            pass  # 刷新失败时保留旧值,直到超过stale_ttl
+        finally:
+            self._revalidating.pop(key, None)
+
+    def _invalidate(self, *tags: str):
+        if self.cache is not None:
+            self.cache.invalidate(*tags)
 
     async def bind_device(
         self, device_token: str, product_id: int, timestamp: int = None
@@ -158,24 +495,35 @@ class Client:
         :param timestamp: 毫秒级时间戳(13位) 20s内有效,同一个请求不可重复
         :return:
         """
-        timestamp = timestamp or int(time.time() * 1000)
-        return await self.send_request(
-            "POST",
-            f"https://{self._api_endpoint}/v1/apis/devices",
-            json={
-                "device_token": device_token,
-                "product_id": product_id,
-                "timestamp": timestamp,
-            },
-        )
+        timestamp = timestamp or make_timestamp()
+        try:
+            return self._decode(
+                models.Device,
+                await self.send_request(
+                    "POST",
+                    f"https://{self._api_endpoint}/v1/apis/devices",
+                    json={
+                        "device_token": device_token,
+                        "product_id": product_id,
+                        "timestamp": timestamp,
+                    },
+                ),
+            )
+        finally:
+            self._invalidate("devices")
 
     async def delete_device(self, mac: List[str], timestamp: int = None):
-        timestamp = timestamp or int(time.time() * 1000)
-        return await self.send_request(
-            "DELETE",
-            f"https://{self._api_endpoint}/v1/apis/devices",
-            json={"mac": mac, "timestamp": timestamp},
-        )
+        timestamp = timestamp or make_timestamp()
+        try:
+            return await self.send_request(
+                "DELETE",
+                f"https://{self._api_endpoint}/v1/apis/devices",
+                json={"mac": mac, "timestamp": timestamp},
+            )
+        finally:
+            self._invalidate(
+                "devices", *(f"device:{m}" for m in mac), *(f"alert:{m}" for m in mac)
+            )
 
     async def get_devices(
         self,
@@ -191,21 +539,87 @@ class Client:
         :param offset:
         :param limit:
         :param role: 请求者角色（只有是代理商角色需要填写这个字段，代理商标识："agent"）
+        :return: 包含实时读数,不走缓存
+        """
+        return self._decode(
+            models.DeviceResponse,
+            await self.send_request(
+                "GET",
+                f"https://{self._api_endpoint}/v1/apis/devices",
+                params=_devices_params(group_id, offset, limit, role, timestamp),
+            ),
+        )
+
+    async def get_devices_info(
+        self,
+        group_id: int = None,
+        offset: int = None,
+        limit: int = None,
+        role: str = None,
+        timestamp: int = None,
+    ) -> DeviceResponse:
+        """
+        只有设备信息的设备列表,每个设备只保留info,没有data
+        配置了cache时会被缓存,适合只需要名称 分组 设置的场景
+        :param group_id:
+        :param offset:
+        :param limit:
+        :param role: 请求者角色（只有是代理商角色需要填写这个字段，代理商标识："agent"）
+        :param timestamp: 毫秒级时间戳(13位) 20s内有效,同一个请求不可重复
         :return:
         """
-        params = {"timestamp": timestamp or int(time.time() * 1000)}
-        if group_id is not None:
-            params["group_id"] = group_id
-        if offset is not None:
-            params["offset"] = offset
-        if limit is not None:
-            params["limit"] = limit
-        if role is not None:
-            params["role"] = role
-        return await self.send_request(
-            "GET", f"https://{self._api_endpoint}/v1/apis/devices", params=params
+        return self._decode(
+            models.DeviceResponse,
+            await self._cached(
+                ("devices", group_id, offset, limit, role),
+                ("devices",),
+                "GET",
+                f"https://{self._api_endpoint}/v1/apis/devices",
+                params=_devices_params(group_id, offset, limit, role, timestamp),
+                transform=_strip_device_data,
+            ),
         )
 
+    async def stream_devices(
+        self,
+        group_id: int = None,
+        offset: int = None,
+        limit: int = None,
+        role: str = None,
+        timestamp: int = None,
+        chunk_size: int = 65536,
+    ) -> AsyncGenerator[Device, None]:
+        """
+        流式的设备列表,响应体边下载边解析,逐个返回devices里的设备
+        不经过缓存和重试,适合代理商账号这种很大的列表
+        :param group_id:
+        :param offset:
+        :param limit:
+        :param role: 请求者角色（只有是代理商角色需要填写这个字段，代理商标识："agent"）
+        :param chunk_size: 每次从socket读取的字节数
+        :return:
+        """
+        params = _devices_params(group_id, offset, limit, role, timestamp)
+        url = f"https://{self._api_endpoint}/v1/apis/devices"
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire(urlsplit(url).path)
+        if self.lazy_token and self._task is None:
+            await self._ensure_token()
+        async with self.client_session.get(
+            url,
+            params=params,
+            headers={"Authorization": f"Bearer {self.access_token}"},
+        ) as resp:
+            if resp.status != 200:
+                await self._raise_for_status(resp)
+                raise RequestException(await resp.text())
+            stream = JSONArrayStream("devices")
+            async for chunk in resp.content.iter_chunked(chunk_size):
+                for item in stream.feed(chunk):
+                    if not self.loads_bytes:
+                        item = item.decode(JSON_ENCODING)
+                    yield self._decode(models.Device, self.loads(item))
+
     async def get_history_data(
         self,
         mac: str,
@@ -229,16 +643,19 @@ class Client:
             "mac": mac,
             "start_time": start_time,
             "end_time": end_time,
-            "timestamp": timestamp or int(time.time() * 1000),
+            "timestamp": timestamp or make_timestamp(),
         }
         if offset is not None:
             params["offset"] = offset
         if limit is not None:
             params["limit"] = limit
-        return await self.send_request(
-            "GET",
-            f"https://{self._api_endpoint}/v1/apis/devices/data",
-            params=params,
+        return self._decode(
+            models.HistoryDataResponse,
+            await self.send_request(
+                "GET",
+                f"https://{self._api_endpoint}/v1/apis/devices/data",
+                params=params,
+            ),
         )
 
     async def get_history_events(
@@ -264,16 +681,19 @@ class Client:
             "mac": mac,
             "start_time": start_time,
             "end_time": end_time,
-            "timestamp": timestamp or int(time.time() * 1000),
+            "timestamp": timestamp or make_timestamp(),
         }
         if offset is not None:
             params["offset"] = offset
         if limit is not None:
             params["limit"] = limit
-        return await self.send_request(
-            "GET",
-            f"https://{self._api_endpoint}/v1/apis/devices/events",
-            params=params,
+        return self._decode(
+            models.HistoryEventResponse,
+            await self.send_request(
+                "GET",
+                f"https://{self._api_endpoint}/v1/apis/devices/events",
+                params=params,
+            ),
         )
 
     async def change_settings(
@@ -291,38 +711,49 @@ class Client:
         :param timestamp: 毫秒级时间戳(13位) 20s内有效,同一个请求不可重复
         :return:
         """
-        return await self.send_request(
-            "PUT",
-            f"https://{self._api_endpoint}/v1/apis/devices/settings",
-            json={
-                "mac": mac,
-                "report_interval": report_interval,
-                "collect_interval": collect_interval,
-                "timestamp": timestamp or int(time.time() * 1000),
-            },
-        )
+        try:
+            return await self.send_request(
+                "PUT",
+                f"https://{self._api_endpoint}/v1/apis/devices/settings",
+                json={
+                    "mac": mac,
+                    "report_interval": report_interval,
+                    "collect_interval": collect_interval,
+                    "timestamp": timestamp or make_timestamp(),
+                },
+            )
+        finally:
+            self._invalidate("devices")
 
     async def add_alert(
         self, mac: str, alert_config: AlertConfig, timestamp: int = None
     ):
-        return await self.send_request(
-            "POST",
-            f"https://{self._api_endpoint}/v1/apis/devices/settings/alert",
-            json={
-                "mac": mac,
-                "alert_config": alert_config,
-                "timestamp": timestamp or int(time.time() * 1000),
-            },
-        )
+        try:
+            return await self.send_request(
+                "POST",
+                f"https://{self._api_endpoint}/v1/apis/devices/settings/alert",
+                json={
+                    "mac": mac,
+                    "alert_config": alert_config,
+                    "timestamp": timestamp or make_timestamp(),
+                },
+            )
+        finally:
+            self._invalidate(f"alert:{mac}")
 
     async def get_alert(self, mac: str, timestamp: int = None) -> GetAlertResponse:
-        return await self.send_request(
-            "GET",
-            f"https://{self._api_endpoint}/v1/apis/devices/settings/alert",
-            params={
-                "mac": mac,
-                "timestamp": timestamp or int(time.time() * 1000),
-            },
+        return self._decode(
+            models.GetAlertResponse,
+            await self._cached(
+                ("alert", mac),
+                (f"alert:{mac}",),
+                "GET",
+                f"https://{self._api_endpoint}/v1/apis/devices/settings/alert",
+                params={
+                    "mac": mac,
+                    "timestamp": timestamp or make_timestamp(),
+                },
+            ),
         )
 
     async def change_alert(
@@ -335,15 +766,18 @@ class Client:
         :param timestamp: 毫秒级时间戳(13位) 20s内有效,同一个请求不可重复
         :return:
         """
-        return await self.send_request(
-            "PUT",
-            f"https://{self._api_endpoint}/v1/apis/devices/settings/alert",
-            json={
-                "mac": mac,
-                "alert_config": alert_config,
-                "timestamp": timestamp or int(time.time() * 1000),
-            },
-        )
+        try:
+            return await self.send_request(
+                "PUT",
+                f"https://{self._api_endpoint}/v1/apis/devices/settings/alert",
+                json={
+                    "mac": mac,
+                    "alert_config": alert_config,
+                    "timestamp": timestamp or make_timestamp(),
+                },
+            )
+        finally:
+            self._invalidate(f"alert:{mac}")
 
     async def delete_alert(self, mac: str, config_id: List[int], timestamp: int = None):
         """
@@ -353,15 +787,18 @@ class Client:
         :param timestamp: 毫秒级时间戳(13位) 20s内有效,同一个请求不可重复
         :return:
         """
-        return await self.send_request(
-            "DELETE",
-            f"https://{self._api_endpoint}/v1/apis/devices/settings/alert",
-            json={
-                "mac": mac,
-                "config_id": config_id,
-                "timestamp": timestamp or int(time.time() * 1000),
-            },
-        )
+        try:
+            return await self.send_request(
+                "DELETE",
+                f"https://{self._api_endpoint}/v1/apis/devices/settings/alert",
+                json={
+                    "mac": mac,
+                    "config_id": config_id,
+                    "timestamp": timestamp or make_timestamp(),
+                },
+            )
+        finally:
+            self._invalidate(f"alert:{mac}")
 
     async def get_groups(self, timestamp: int = None) -> GetGroupsResponse:
         """
@@ -369,10 +806,15 @@ class Client:
         :param timestamp: 毫秒级时间戳(13位) 20s内有效,同一个请求不可重复
         :return:
         """
-        return await self.send_request(
-            "GET",
-            f"https://{self._api_endpoint}/v1/apis/groups",
-            params={"timestamp": timestamp or int(time.time() * 1000)},
+        return self._decode(
+            models.GetGroupsResponse,
+            await self._cached(
+                ("groups",),
+                ("groups",),
+                "GET",
+                f"https://{self._api_endpoint}/v1/apis/groups",
+                params={"timestamp": timestamp or make_timestamp()},
+            ),
         )
 
     async def get_device_info(
@@ -385,12 +827,371 @@ class Client:
         :param timestamp: 毫秒级时间戳(13位) 20s内有效,同一个请求不可重复
         :return:
         """
-        return await self.send_request(
-            "POST",
-            f"https://{self._api_endpoint}/v1/apis/devices/profile/query",
-            json={
-                "macList": mac_list,
-                "profile": profile,
-                "timestamp": timestamp or int(time.time() * 1000),
-            },
+        return self._decode(
+            models.DeviceInfoResponse,
+            await self._cached(
+                ("device_info", tuple(mac_list), tuple(profile)),
+                tuple(f"device:{mac}" for mac in mac_list),
+                "POST",
+                f"https://{self._api_endpoint}/v1/apis/devices/profile/query",
+                json={
+                    "macList": mac_list,
+                    "profile": profile,
+                    "timestamp": timestamp or make_timestamp(),
+                },
+            ),
+        )
+
+    async def _iter_pages(
+        self,
+        fetch: Callable[[int, int], Awaitable[dict]],
+        key: str,
+        limit: int = MAX_PAGE_LIMIT,
+        concurrency: int = 4,
+    ) -> AsyncGenerator[List[Any], None]:
+        """
+        按offset分页拉取,第一页拿到total后并发拉取剩下的页,按顺序逐页返回
+        同一时刻最多只有concurrency个页面在内存中
+        :param fetch: fetch(offset, limit) -> 单页响应
+        :param key: 响应中数据列表的字段名
+        :param limit: 每页条数
+        :param concurrency: 同时请求的页数
+        :return:
+        """
+        first = await fetch(0, limit)
+        yield first.get(key) or []
+        offsets = iter(range(limit, first.get("total", 0), limit))
+        pending = deque()  # type: deque
+        try:
+            for offset in offsets:
+                pending.append(self._loop.create_task(fetch(offset, limit)))
+                if len(pending) >= concurrency:
+                    break
+            while pending:
+                page = await pending.popleft()
+                offset = next(offsets, None)
+                if offset is not None:
+                    pending.append(self._loop.create_task(fetch(offset, limit)))
+                yield page.get(key) or []
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:  # 等取消真正完成,调用方提前退出后不留下还在跑的请求
+                await asyncio.wait(pending)
+
+    async def iter_history_data(
+        self,
+        mac: str,
+        start_time: int,
+        end_time: int,
+        limit: int = MAX_PAGE_LIMIT,
+        concurrency: int = 4,
+    ) -> AsyncGenerator[DeviceData, None]:
+        """
+        自动分页的设备历史数据,剩余页面并发拉取,按时间顺序逐条返回
+        :param mac: 设备mac地址
+        :param start_time: 开始时间戳 单位s
+        :param end_time: 结束时间戳
+        :param limit: 每页条数 不得超过200条
+        :param concurrency: 同时请求的页数
+        :return:
+        """
+
+        async def fetch(offset: int, limit: int) -> HistoryDataResponse:
+            return await self.get_history_data(
+                mac, start_time, end_time, offset=offset, limit=limit
+            )
+
+        pages = self._iter_pages(fetch, "data", limit, concurrency)
+        try:
+            async for page in pages:
+                for row in page:
+                    yield row
+        finally:
+            await pages.aclose()  # 提前退出时立刻取消预取的页面
+
+    async def get_history_columns(
+        self,
+        mac: str,
+        start_time: int,
+        end_time: int,
+        metrics: Sequence[str] = METRICS,
+        columns: HistoryColumns = None,
+        limit: int = MAX_PAGE_LIMIT,
+        concurrency: int = 4,
+    ) -> HistoryColumns:
+        """
+        自动分页拉取设备历史数据并按列存储,逐页追加,不保留中间的dict列表
+        :param mac: 设备mac地址
+        :param start_time: 开始时间戳 单位s
+        :param end_time: 结束时间戳
+        :param metrics: 需要保留的指标
+        :param columns: 追加到已有的HistoryColumns
+        :param limit: 每页条数 不得超过200条
+        :param concurrency: 同时请求的页数
+        :return:
+        """
+        if columns is None:
+            columns = HistoryColumns(metrics)
+
+        async def fetch(offset: int, limit: int) -> HistoryDataResponse:
+            return await self.get_history_data(
+                mac, start_time, end_time, offset=offset, limit=limit
+            )
+
+        pages = self._iter_pages(fetch, "data", limit, concurrency)
+        try:
+            async for page in pages:
+                columns.extend(page)
+        finally:
+            await pages.aclose()  # 出错时立刻取消预取的页面
+        return columns
+
+    async def iter_history_events(
+        self,
+        mac: str,
+        start_time: int,
+        end_time: int,
+        limit: int = MAX_PAGE_LIMIT,
+        concurrency: int = 4,
+    ) -> AsyncGenerator[Event, None]:
+        """
+        自动分页的设备历史事件,剩余页面并发拉取,按时间顺序逐条返回
+        :param mac: 设备mac地址
+        :param start_time: 开始时间戳 单位s
+        :param end_time: 结束时间戳
+        :param limit: 每页条数 不得超过200条
+        :param concurrency: 同时请求的页数
+        :return:
+        """
+
+        async def fetch(offset: int, limit: int) -> HistoryEventResponse:
+            return await self.get_history_events(
+                mac, start_time, end_time, offset=offset, limit=limit
+            )
+
+        pages = self._iter_pages(fetch, "events", limit, concurrency)
+        try:
+            async for page in pages:
+                for row in page:
+                    yield row
+        finally:
+            await pages.aclose()  # 提前退出时立刻取消预取的页面
+
+    async def iter_devices(
+        self,
+        group_id: int = None,
+        role: str = None,
+        limit: int = MAX_PAGE_LIMIT,
+        concurrency: int = 4,
+    ) -> AsyncGenerator[Device, None]:
+        """
+        自动分页的设备列表,剩余页面并发拉取,逐个返回
+        :param group_id:
+        :param role: 请求者角色（只有是代理商角色需要填写这个字段，代理商标识："agent"）
+        :param limit: 每页条数
+        :param concurrency: 同时请求的页数
+        :return:
+        """
+
+        async def fetch(offset: int, limit: int) -> DeviceResponse:
+            return await self.get_devices(
+                group_id, offset=offset, limit=limit, role=role
+            )
+
+        pages = self._iter_pages(fetch, "devices", limit, concurrency)
+        try:
+            async for page in pages:
+                for device in page:
+                    yield device
+        finally:
+            await pages.aclose()  # 提前退出时立刻取消预取的页面
+
+    async def _harvest(
+        self,
+        getter: Callable[..., Awaitable[dict]],
+        key: str,
+        macs: Iterable[str],
+        start_time: int,
+        end_time: int,
+        concurrency: int,
+        page_concurrency: int,
+        limit: int,
+    ) -> AsyncGenerator[Tuple[str, Union[List[Any], BaseException]], None]:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch_device(mac: str) -> List[Any]:
+            async def fetch(offset: int, limit: int) -> dict:
+                async with semaphore:
+                    return await getter(
+                        mac, start_time, end_time, offset=offset, limit=limit
+                    )
+
+            rows = []
+            async for page in self._iter_pages(fetch, key, limit, page_concurrency):
+                rows.extend(page)
+            return rows
+
+        macs = iter(macs)
+        running = {}  # task -> mac
+
+        def spawn() -> bool:
+            mac = next(macs, None)
+            if mac is None:
+                return False
+            running[self._loop.create_task(fetch_device(mac))] = mac
+            return True
+
+        while len(running) < concurrency and spawn():
+            pass
+        try:
+            while running:
+                done, _ = await asyncio.wait(
+                    running, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    mac = running.pop(task)
+                    spawn()
+                    if task.cancelled():  # 请求自己取消了,按失败返回
+                        yield mac, asyncio.CancelledError()
+                        continue
+                    exc = task.exception()
+                    yield mac, exc if exc is not None else task.result()
+        finally:
+            for task in running:
+                task.cancel()
+            if running:  # 等取消真正完成,调用方提前退出后不留下还在跑的请求
+                await asyncio.wait(running)
+
+    async def harvest_history_data(
+        self,
+        macs: Iterable[str],
+        start_time: int,
+        end_time: int,
+        concurrency: int = 16,
+        page_concurrency: int = 2,
+        limit: int = MAX_PAGE_LIMIT,
+    ) -> AsyncGenerator[Tuple[str, Union[List[DeviceData], BaseException]], None]:
+        """
+        并发拉取多个设备的历史数据,哪个设备先拉完就先返回哪个
+        单个设备失败不会中断整批,此时返回的是异常对象而不是数据列表
+        :param macs: 设备mac地址列表
+        :param start_time: 开始时间戳 单位s
+        :param end_time: 结束时间戳
+        :param concurrency: 全局同时进行的请求数上限
+        :param page_concurrency: 单个设备同时请求的页数上限
+        :param limit: 每页条数 不得超过200条
+        :return: (mac, 数据列表或异常)
+        """
+        harvest = self._harvest(
+            self.get_history_data,
+            "data",
+            macs,
+            start_time,
+            end_time,
+            concurrency,
+            page_concurrency,
+            limit,
+        )
+        try:
+            async for item in harvest:
+                yield item
+        finally:
+            await harvest.aclose()  # 提前退出时立刻取消还在进行的请求
+
+    async def harvest_history_events(
+        self,
+        macs: Iterable[str],
+        start_time: int,
+        end_time: int,
+        concurrency: int = 16,
+        page_concurrency: int = 2,
+        limit: int = MAX_PAGE_LIMIT,
+    ) -> AsyncGenerator[Tuple[str, Union[List[Event], BaseException]], None]:
+        """
+        并发拉取多个设备的历史事件,哪个设备先拉完就先返回哪个
+        单个设备失败不会中断整批,此时返回的是异常对象而不是事件列表
+        :param macs: 设备mac地址列表
+        :param start_time: 开始时间戳 单位s
+        :param end_time: 结束时间戳
+        :param concurrency: 全局同时进行的请求数上限
+        :param page_concurrency: 单个设备同时请求的页数上限
+        :param limit: 每页条数 不得超过200条
+        :return: (mac, 事件列表或异常)
+        """
+        harvest = self._harvest(
+            self.get_history_events,
+            "events",
+            macs,
+            start_time,
+            end_time,
+            concurrency,
+            page_concurrency,
+            limit,
+        )
+        try:
+            async for item in harvest:
+                yield item
+        finally:
+            await harvest.aclose()  # 提前退出时立刻取消还在进行的请求
+
+    def _loader(
+        self, key: tuple, batch_fn: Callable[[List[str]], Awaitable[dict]]
+    ) -> BatchLoader:
+        loader = self._loaders.get(key)
+        if loader is None:
+            loader = self._loaders[key] = BatchLoader(
+                batch_fn, self.batch_size, self.batch_delay, self._loop
+            )
+        return loader
+
+    async def _batch_device_info(self, profile: Tuple[str, ...], macs: List[str]):
+        resp = await self.get_device_info(macs, list(profile))
+        return {item["mac"]: item for item in resp["profiles"]}
+
+    async def _batch_delete_device(self, macs: List[str]):
+        return dict.fromkeys(macs, await self.delete_device(macs))
+
+    async def _batch_change_settings(
+        self, report_interval: int, collect_interval: int, macs: List[str]
+    ):
+        resp = await self.change_settings(macs, report_interval, collect_interval)
+        return dict.fromkeys(macs, resp)
+
+    async def load_device_info(self, mac: str, profile: List[str]) -> Profile:
+        """
+        获取单个设备的基本信息,短时间内的多次调用会按profile合并成一次get_device_info
+        :param mac: 设备 MAC
+        :param profile: 需要获取的设备基本信息字段列表 e.g. ["sn"]
+        :return: 找不到设备时返回None
+        """
+        profile = tuple(profile)
+        loader = self._loader(
+            ("device_info", profile), partial(self._batch_device_info, profile)
+        )
+        return await loader.load(mac)
+
+    async def batch_delete_device(self, mac: str):
+        """
+        删除单个设备,短时间内的多次调用会合并成一次delete_device
+        :param mac: 设备 MAC
+        :return: 所在批次的delete_device返回值
+        """
+        loader = self._loader(("delete_device",), self._batch_delete_device)
+        return await loader.load(mac)
+
+    async def batch_change_settings(
+        self, mac: str, report_interval: int, collect_interval: int
+    ):
+        """
+        修改单个设备配置,短时间内配置相同的多次调用会合并成一次change_settings
+        :param mac: 设备 MAC
+        :param report_interval: 上报周期(秒)最小为10s,且为采集周期的整数倍
+        :param collect_interval: 采集周期(秒)
+        :return: 所在批次的change_settings返回值
+        """
+        loader = self._loader(
+            ("change_settings", report_interval, collect_interval),
+            partial(self._batch_change_settings, report_interval, collect_interval),
         )
+        return await loader.load(mac)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
+"""
+from array import array
+from typing import Dict, Iterable, Sequence
+
+from qingping_sdk.typing import DeviceData, HistoryDataResponse
+
+try:
+    import numpy as np
+except ImportError:  # numpy是可选依赖
+    np = None
+
+METRICS = ("temperature", "humidity", "co2", "pm25", "tvoc", "pressure", "battery")
+NAN = float("nan")
+
+
+class HistoryColumns:
+    def __init__(self, metrics: Sequence[str] = METRICS, use_numpy: bool = None):
+        """
+        按列存储的历史数据,每个指标一列,缺失的值为NaN
+        分页拉取时逐页追加,不需要先攒出整个dict列表
+        :param metrics: 需要保留的指标
+        :param use_numpy: 列的类型,None表示装了numpy就用numpy,否则用array.array
+        """
+        if use_numpy is None:
+            use_numpy = np is not None
+        elif use_numpy and np is None:
+            raise ImportError("numpy is not installed")
+        self.metrics = tuple(metrics)
+        self.use_numpy = use_numpy
+        self._size = 0
+        if use_numpy:
+            self._timestamp = np.empty(0, dtype=np.int64)
+            self._columns = {m: np.empty(0, dtype=np.float64) for m in self.metrics}
+        else:
+            self._timestamp = array("q")
+            self._columns = {m: array("d") for m in self.metrics}
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def timestamp(self):
+        return self._timestamp[: self._size] if self.use_numpy else self._timestamp
+
+    def __getitem__(self, metric: str):
+        if metric == "timestamp":
+            return self.timestamp
+        column = self._columns[metric]
+        return column[: self._size] if self.use_numpy else column
+
+    def columns(self) -> Dict[str, Sequence]:
+        ret = {"timestamp": self.timestamp}
+        for metric in self.metrics:
+            ret[metric] = self[metric]
+        return ret
+
+    def extend(self, rows: Iterable[DeviceData]) -> None:
+        """追加一页数据"""
+        timestamp = array("q")
+        columns = [(m, array("d")) for m in self.metrics]
+        for row in rows:
+            timestamp.append(int(row["timestamp"]["value"]))
+            for metric, column in columns:
+                detail = row.get(metric)
+                value = detail.get("value") if detail else None
+                column.append(NAN if value is None else value)
+        if not self.use_numpy:
+            self._timestamp.extend(timestamp)
+            for metric, column in columns:
+                self._columns[metric].extend(column)
+            self._size += len(timestamp)
+            return
+        start = self._size
+        end = start + len(timestamp)
+        if end > len(self._timestamp):
+            self._grow(end)
+        self._timestamp[start:end] = np.frombuffer(timestamp, dtype=np.int64)
+        for metric, column in columns:
+            self._columns[metric][start:end] = np.frombuffer(column, dtype=np.float64)
+        self._size = end
+
+    def extend_response(self, resp: HistoryDataResponse) -> None:
+        self.extend(resp["data"])
+
+    def _grow(self, size: int) -> None:
+        capacity = max(size, 2 * len(self._timestamp), 256)
+        timestamp = np.empty(capacity, dtype=np.int64)
+        timestamp[: self._size] = self._timestamp[: self._size]
+        self._timestamp = timestamp
+        for metric, column in self._columns.items():
+            new = np.empty(capacity, dtype=np.float64)
+            new[: self._size] = column[: self._size]
+            self._columns[metric] = new
@@ -3,57 +3,159 @@
 Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
 """
 # https://qingping.feishu.cn/docs/doccnsQEUKIl4ySLumxSqYktH4d
+import struct
+from array import array
 from dataclasses import dataclass
-from enum import IntEnum
 from io import BytesIO
-from typing import Generator
+from typing import Any, Dict, Generator, List, Optional, Sequence, Tuple
 
-import crcmod
+try:
+    import numpy as np
+except ImportError:  # numpy是可选依赖
+    np = None
 
-crc16 = crcmod.mkCrcFun(0x13D65, 0xFFFF, True, 0xFFFF)
+SOP = b"CG"
+_FRAME_HEADER = struct.Struct("<2sBH")  # sop cmd length
+_CHECKSUM = struct.Struct("<H")
+
+
+def frame_checksum(data: bytes) -> int:
+    """帧校验和: sop到payload结尾所有字节之和的低16位"""
+    return sum(data) & 0xFFFF
+
+
+_TLV_HEADER = struct.Struct("<BH")  # key length
+
+
+def scan_tlv(payload: bytes) -> Dict[int, Tuple[int, int]]:
+    """
+    扫描一遍payload,建立 key -> (value偏移, value长度) 的索引
+    :param payload:
+    :return:
+    """
+    index = {}
+    view = memoryview(payload)
+    size = len(view)
+    pos = 0
+    while pos < size:
+        key, length = _TLV_HEADER.unpack_from(view, pos)
+        pos += _TLV_HEADER.size
+        if pos + length > size:
+            raise ValueError(f"truncated tlv field {key}")
+        index[key] = (pos, length)
+        pos += length
+    return index
+
+
+class TLVWriter:
+    __slots__ = ("_buf",)
+
+    def __init__(self):
+        """流式构造payload,直接写进一个bytearray"""
+        self._buf = bytearray()
+
+    def __len__(self) -> int:
+        return len(self._buf)
+
+    def write(self, key: int, value: bytes) -> "TLVWriter":
+        self._buf += _TLV_HEADER.pack(key, len(value))
+        self._buf += value
+        return self
+
+    def getbuffer(self) -> memoryview:
+        return memoryview(self._buf)
+
+    def getvalue(self) -> bytes:
+        return bytes(self._buf)
 
 
-@dataclass
 class Event:
-    sop: bytes  # b"CG"  2 bytes
-    cmd: int  # 1 bytes
-    length: int  # 2 bytes
-    payload: bytes  # len(payload) == length
-    checksum: int  # 2 bytes
+    __slots__ = ("sop", "cmd", "length", "_payload", "checksum", "_index")
+
+    def __init__(
+        self, sop: bytes, cmd: int, length: int, payload: bytes, checksum: int
+    ):
+        self.sop = sop  # b"CG"  2 bytes
+        self.cmd = cmd  # 1 bytes
+        self.length = length  # 2 bytes
+        self._payload = payload  # len(payload) == length
+        self.checksum = checksum  # 2 bytes
+        self._index = None  # type: Optional[Dict[int, Tuple[int, int]]]
+
+    def __repr__(self) -> str:
+        return (
+            f"Event(sop={self.sop!r}, cmd={self.cmd!r}, length={self.length!r}, "
+            f"payload={bytes(self._payload)!r}, checksum={self.checksum!r})"
+        )
+
+    def __eq__(self, other) -> bool:
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return (self.sop, self.cmd, self.length, self._payload, self.checksum) == (
+            other.sop,
+            other.cmd,
+            other.length,
+            other._payload,
+            other.checksum,
+        )
+
+    __hash__ = None
+
+    @property
+    def payload(self) -> bytes:
+        return self._payload
+
+    @payload.setter
+    def payload(self, value: bytes) -> None:
+        self._payload = value
+        self._index = None
+
+    @property
+    def index(self) -> Dict[int, Tuple[int, int]]:
+        """key -> (value在payload中的偏移, value长度),第一次访问时扫描一遍payload"""
+        if self._index is None:
+            self._index = scan_tlv(self._payload)
+        return self._index
+
+    def get(self, key: int, default=None) -> Optional[memoryview]:
+        """
+        取单个字段,不拷贝
+        :param key:
+        :param default: 没有这个字段时的返回值
+        :return: 指向payload的memoryview
+        """
+        item = self.index.get(key)
+        if item is None:
+            return default
+        offset, length = item
+        return memoryview(self._payload)[offset : offset + length]
 
     @property
     def keys(self) -> dict:
         """解析payload字段"""
-        ret = {}
-        reader = BytesIO(self.payload)
-        while True:
-            key = reader.read(1)[0]
-            length = int.from_bytes(reader.read(2), "little")
-            value = reader.read(length)
-            ret[key] = value
-            if reader.tell() == len(self.payload):
-                break
-        return ret
+        view = memoryview(self._payload)
+        return {
+            key: bytes(view[offset : offset + length])
+            for key, (offset, length) in self.index.items()
+        }
 
     @keys.setter
     def keys(self, value) -> None:
-        writer = BytesIO()
+        writer = TLVWriter()
         for key, v in value.items():
-            writer.write(key.to_bytes(1, "little"))
-            writer.write(len(v).to_bytes(2, "little"))
-            writer.write(v)
+            writer.write(key, v)
         self.payload = writer.getvalue()
         self.length = len(self.payload)
 
     def to_bytes(self) -> bytes:
-        writer = BytesIO()
-        writer.write(self.sop)
-        writer.write(self.cmd.to_bytes(1, "little"))
-        writer.write(self.length.to_bytes(2, "little"))
-        writer.write(self.payload)
-        # self.checksum = crc16(writer.getvalue())
-        writer.write(self.checksum.to_bytes(2, "little"))  # todo 自己计算checksum
-        return writer.getvalue()
+        """编码成完整的一帧,同时计算并更新checksum"""
+        end = _FRAME_HEADER.size + self.length
+        buf = bytearray(end + _CHECKSUM.size)
+        _FRAME_HEADER.pack_into(buf, 0, self.sop, self.cmd, self.length)
+        buf[_FRAME_HEADER.size : end] = self._payload
+        self.checksum = frame_checksum(memoryview(buf)[:end])
+        _CHECKSUM.pack_into(buf, end, self.checksum)
+        return bytes(buf)
 
 
 def parse_history_data(data: bytes):
@@ -76,43 +178,352 @@ def build_history_data(time: int, internal: int, history: list) -> bytes:
     return writer.getvalue()
 
 
-class _State(IntEnum):
-    read_first_5_bytes = 0
-    read_payload = 1
+_HISTORY_HEADER = struct.Struct("<IH")  # 时间戳 存储间隔
+_HISTORY_RECORD = struct.Struct("<3BHB")  # 温湿度 气压 电量
+if np is not None:
+    _HISTORY_DTYPE = np.dtype([("th", "u1", 3), ("pressure", "<u2"), ("battery", "u1")])
+
+
+@dataclass
+class HistoryRecords:
+    """
+    解码后的历史数据,每条记录6字节:
+    温湿度3字节(小端24位,高12位为温度*10+500,低12位为湿度*10) 气压2字节(0.01kPa) 电量1字节(%)
+    """
+
+    time: int  # 第一条记录的时间戳
+    internal: int  # 存储间隔 单位s
+    timestamp: Any  # 每条记录的时间戳 time + i * internal
+    temperature: Any  # 温度 ℃
+    humidity: Any  # 湿度 %
+    pressure: Any  # 气压 kPa
+    battery: Any  # 电量 %
+
+    def __len__(self) -> int:
+        return len(self.timestamp)
+
+
+def _want_numpy(use_numpy: Optional[bool]) -> bool:
+    if use_numpy is None:
+        return np is not None
+    if use_numpy and np is None:
+        raise ImportError(
+            "use_numpy=True requires numpy, pip install qingping_sdk[numpy]"
+        )
+    return use_numpy
+
+
+def _out_of_range(name: str, value) -> ValueError:
+    return ValueError(f"{name} {value} is out of range")
+
+
+def decode_history_data(data: bytes, use_numpy: bool = None) -> HistoryRecords:
+    """
+    parse_history_data的向量化版本,直接把记录解码成数值数组,不切片每条记录
+    :param data: 历史数据payload
+    :param use_numpy: None表示装了numpy就用numpy,否则返回array.array
+    :return:
+    """
+    view = memoryview(data)
+    time, internal = _HISTORY_HEADER.unpack_from(view)
+    count = (len(view) - _HISTORY_HEADER.size) // _HISTORY_RECORD.size
+    if _want_numpy(use_numpy):
+        records = np.frombuffer(
+            view, dtype=_HISTORY_DTYPE, count=count, offset=_HISTORY_HEADER.size
+        )
+        th = records["th"].astype(np.uint32)
+        th = th[:, 0] | (th[:, 1] << 8) | (th[:, 2] << 16)
+        return HistoryRecords(
+            time,
+            internal,
+            time + np.arange(count, dtype=np.int64) * internal,
+            ((th >> 12).astype(np.int32) - 500) / 10,
+            (th & 0xFFF) / 10,
+            records["pressure"] / 100,
+            records["battery"].astype(np.float64),
+        )
+    temperature = array("d")
+    humidity = array("d")
+    pressure = array("d")
+    battery = array("d")
+    end = _HISTORY_HEADER.size + count * _HISTORY_RECORD.size
+    for b0, b1, b2, p, b in _HISTORY_RECORD.iter_unpack(
+        view[_HISTORY_HEADER.size : end]
+    ):
+        th = b0 | (b1 << 8) | (b2 << 16)
+        temperature.append(((th >> 12) - 500) / 10)
+        humidity.append((th & 0xFFF) / 10)
+        pressure.append(p / 100)
+        battery.append(b)
+    return HistoryRecords(
+        time,
+        internal,
+        array("q", (time + i * internal for i in range(count))),
+        temperature,
+        humidity,
+        pressure,
+        battery,
+    )
+
+
+def encode_history_data(
+    time: int,
+    internal: int,
+    temperature: Sequence[float],
+    humidity: Sequence[float],
+    pressure: Sequence[float],
+    battery: Sequence[float],
+    use_numpy: bool = None,
+) -> bytes:
+    """
+    decode_history_data的逆操作,接受数值数组
+    温度只能在-50℃~359.5℃之间,湿度0~409.5,气压0~655.35kPa,电量0~255,超出时抛出ValueError
+    :param time: 第一条记录的时间戳
+    :param internal: 存储间隔 单位s
+    :param temperature: 温度 ℃
+    :param humidity: 湿度 %
+    :param pressure: 气压 kPa
+    :param battery: 电量 %
+    :param use_numpy: None表示装了numpy就用numpy
+    :return:
+    """
+    count = len(temperature)
+    if _want_numpy(use_numpy):
+        records = np.empty(count, dtype=_HISTORY_DTYPE)
+        columns = []
+        for name, values, scale, offset, high in (
+            ("temperature", temperature, 10, 500, 0xFFF),
+            ("humidity", humidity, 10, 0, 0xFFF),
+            ("pressure", pressure, 100, 0, 0xFFFF),
+            ("battery", battery, 1, 0, 0xFF),
+        ):
+            values = np.asarray(values, dtype=np.float64)
+            encoded = np.rint(values * scale) + offset
+            bad = ~((encoded >= 0) & (encoded <= high))  # NaN也算超出范围
+            if bad.any():
+                raise _out_of_range(name, values[bad.argmax()])
+            columns.append(encoded.astype(np.uint32))
+        th = columns[0] << 12 | columns[1]
+        records["th"][:, 0] = th & 0xFF
+        records["th"][:, 1] = (th >> 8) & 0xFF
+        records["th"][:, 2] = (th >> 16) & 0xFF
+        records["pressure"] = columns[2]
+        records["battery"] = columns[3]
+        return _HISTORY_HEADER.pack(time, internal) + records.tobytes()
+    buf = bytearray(_HISTORY_HEADER.size + count * _HISTORY_RECORD.size)
+    _HISTORY_HEADER.pack_into(buf, 0, time, internal)
+    offset = _HISTORY_HEADER.size
+    for t, h, p, b in zip(temperature, humidity, pressure, battery):
+        try:
+            encoded_t = round(t * 10) + 500
+            encoded_h = round(h * 10)
+            encoded_p = round(p * 100)
+            encoded_b = round(b)
+        except (ValueError, OverflowError):  # NaN inf
+            raise ValueError(f"invalid value in record {(t, h, p, b)}") from None
+        if not 0 <= encoded_t <= 0xFFF:
+            raise _out_of_range("temperature", t)
+        if not 0 <= encoded_h <= 0xFFF:
+            raise _out_of_range("humidity", h)
+        if not 0 <= encoded_p <= 0xFFFF:
+            raise _out_of_range("pressure", p)
+        if not 0 <= encoded_b <= 0xFF:
+            raise _out_of_range("battery", b)
+        th = encoded_t << 12 | encoded_h
+        _HISTORY_RECORD.pack_into(
+            buf,
+            offset,
+            th & 0xFF,
+            (th >> 8) & 0xFF,
+            th >> 16,
+            encoded_p,
+            encoded_b,
+        )
+        offset += _HISTORY_RECORD.size
+    return bytes(buf)
+
+
+class FrameEncoder:
+    def __init__(self, buffer_size: int = 4096):
+        """
+        批量编码,把多个帧连同checksum一起写进一块复用的缓冲区
+        返回的memoryview在下一次编码前有效,用完尽快release
+        :param buffer_size: 初始缓冲区大小
+        """
+        self._buf = bytearray(buffer_size)
+
+    def _reserve(self, size: int) -> bytearray:
+        try:
+            # 还有人持有上一次返回的memoryview时不能改变大小,这时换一块新的,免得覆盖掉别人还没发出去的数据
+            self._buf.append(0)
+        except BufferError:
+            self._buf = bytearray(max(size, len(self._buf)))
+        else:
+            del self._buf[-1]
+            if len(self._buf) < size:
+                self._buf = bytearray(max(size, 2 * len(self._buf)))
+        return self._buf
+
+    def _encode(self, events: Sequence[Event]) -> List[int]:
+        size = 0
+        for event in events:
+            size += _FRAME_HEADER.size + event.length + _CHECKSUM.size
+        buf = self._reserve(size)
+        view = memoryview(buf)
+        offsets = []
+        pos = 0
+        for event in events:
+            offsets.append(pos)
+            end = pos + _FRAME_HEADER.size + event.length
+            _FRAME_HEADER.pack_into(buf, pos, event.sop, event.cmd, event.length)
+            buf[pos + _FRAME_HEADER.size : end] = event.payload
+            event.checksum = frame_checksum(view[pos:end])
+            _CHECKSUM.pack_into(buf, end, event.checksum)
+            pos = end + _CHECKSUM.size
+        offsets.append(pos)
+        return offsets
+
+    def encode_many(self, events: Sequence[Event]) -> memoryview:
+        """
+        :return: 所有帧首尾相连的memoryview,可以直接transport.write
+        """
+        offsets = self._encode(events)
+        return memoryview(self._buf)[: offsets[-1]]
+
+    def encode_views(self, events: Sequence[Event]) -> List[memoryview]:
+        """
+        :return: 每个帧一个memoryview,可以直接transport.writelines
+        """
+        offsets = self._encode(events)
+        view = memoryview(self._buf)
+        return [view[offsets[i] : offsets[i + 1]] for i in range(len(events))]
+
+
+MAX_FRAME_SIZE = 0xFFFF  # 长度字段是16位
 
 
 class Connection:
-    def __init__(self):
-        self._buf = bytearray()  # type: bytearray
-        self._state = _State.read_first_5_bytes
-        self._tmp = None
+    def __init__(
+        self,
+        buffer_size: int = 4096,
+        copy_payload: bool = False,
+        verify_checksum: bool = False,
+        max_frame_size: int = MAX_FRAME_SIZE,
+    ):
+        """
+        sans-IO的帧解析器,内部是一块按读写偏移使用的缓冲区,只在空间不够时整理或扩容
+        :param buffer_size: 初始缓冲区大小
+        :param copy_payload: False时Event.payload是指向缓冲区的memoryview,
+            只在下一次feed_data/get_buffer之前有效,需要保存的话自行bytes(ev.payload)
+        :param verify_checksum: 校验每一帧的checksum,不对的帧会被丢弃并重新寻找帧头
+            checksum算法只用少量帧验证过,默认不开启,确认设备的所有cmd都符合后再打开
+        :param max_frame_size: payload长度上限,超过的认为长度字段损坏,直接重新寻找帧头
+            默认不限制(长度字段是16位),知道设备最大帧长时可以调小,
+            避免一个坏掉的长度让解析器一直等待最多64KiB的数据
+        """
+        self._buf = bytearray(buffer_size)
+        self._rpos = 0  # 未解析数据的开头
+        self._wpos = 0  # 未解析数据的结尾
+        self.copy_payload = copy_payload
+        self.verify_checksum = verify_checksum
+        self.max_frame_size = max_frame_size
+        self.checksum_errors = 0  # 校验失败的帧数
+        self.length_errors = 0  # 长度超过max_frame_size的帧数
+        self.discarded_bytes = 0  # 重新同步时丢掉的字节数
+        self._encoder = None  # type: Optional[FrameEncoder]
+
+    def _reserve(self, size: int) -> None:
+        """保证写指针后面至少还有size字节"""
+        if len(self._buf) - self._wpos >= size:
+            return
+        unread = self._wpos - self._rpos
+        if unread + size <= len(self._buf):
+            # 等长的切片赋值不会改变大小,已经导出的memoryview不受影响
+            self._buf[:unread] = self._buf[self._rpos : self._wpos]
+        else:
+            # 新开一块而不是原地resize,旧的memoryview还能继续用
+            buf = bytearray(max(2 * len(self._buf), unread + size))
+            buf[:unread] = self._buf[self._rpos : self._wpos]
+            self._buf = buf
+        self._rpos = 0
+        self._wpos = unread
+
+    def get_buffer(self, sizehint: int = -1) -> memoryview:
+        """
+        返回可以直接写入的空闲缓冲区,写完之后调用buffer_updated,
+        和asyncio.BufferedProtocol的接口一致,可以让socket直接读进来
+        :param sizehint: 期望的最小空间
+        :return:
+        """
+        self._reserve(max(sizehint, 1))
+        return memoryview(self._buf)[self._wpos :]
+
+    def buffer_updated(self, nbytes: int) -> Generator[Event, None, None]:
+        """
+        get_buffer返回的缓冲区写入了nbytes字节
+        :return: 解析出来的帧
+        """
+        self._wpos += nbytes
+        return self._parse()
 
     def feed_data(self, data: bytes) -> Generator[Event, None, None]:
-        self._buf.extend(data)
-        while True:
-            if self._state == _State.read_first_5_bytes:
-                if len(self._buf) < 5:
-                    break
-                sop: bytes = self._buf[:2]
-                cmd: int = self._buf[2]
-                length = int.from_bytes(self._buf[3:5], "little")
-                self._tmp = Event(sop, cmd, length, b"", 0)
-                del self._buf[:5]
-                self._state = _State.read_payload
-            elif self._state == _State.read_payload:
-                if len(self._buf) < self._tmp.length + 2:
-                    break
-                payload = self._buf[: self._tmp.length]
-                checksum = int.from_bytes(
-                    self._buf[self._tmp.length : self._tmp.length + 2], "little"
-                )
-                del self._buf[: self._tmp.length + 2]
-                self._state = _State.read_first_5_bytes
-                self._tmp.payload = payload
-                self._tmp.checksum = checksum
-                ev = self._tmp
-                self._tmp = None
-                yield ev
+        size = len(data)
+        self._reserve(size)
+        self._buf[self._wpos : self._wpos + size] = data
+        self._wpos += size
+        yield from self._parse()
+
+    def _parse(self) -> Generator[Event, None, None]:
+        while self._wpos - self._rpos >= _FRAME_HEADER.size:
+            buf = self._buf  # 循环里可能被重新feed_data,每次都重新取
+            sop, cmd, length = _FRAME_HEADER.unpack_from(buf, self._rpos)
+            if sop != SOP:
+                self._resync()
+                continue
+            if length > self.max_frame_size:
+                self.length_errors += 1
+                self._resync()
+                continue
+            start = self._rpos + _FRAME_HEADER.size
+            end = start + length
+            if self._wpos < end + _CHECKSUM.size:
+                break
+            (checksum,) = _CHECKSUM.unpack_from(buf, end)
+            if self.verify_checksum and checksum != frame_checksum(
+                memoryview(buf)[self._rpos : end]
+            ):
+                self.checksum_errors += 1
+                self._resync()
+                continue
+            if self.copy_payload:
+                payload = bytes(memoryview(buf)[start:end])
+            else:
+                payload = memoryview(buf)[start:end]
+            self._rpos = end + _CHECKSUM.size
+            yield Event(SOP, cmd, length, payload, checksum)
+        if self._rpos == self._wpos:
+            self._rpos = self._wpos = 0
+
+    def _resync(self) -> None:
+        """当前位置不是一个合法的帧,跳到下一个b"CG"处"""
+        pos = self._buf.find(SOP, self._rpos + 1, self._wpos)
+        if pos == -1:
+            # 最后一个字节可能是下一个帧头的前半部分
+            pos = self._wpos
+            if self._buf[self._wpos - 1] == SOP[0]:
+                pos -= 1
+        self.discarded_bytes += pos - self._rpos
+        self._rpos = pos
 
     def send(self, event: Event) -> bytes:
         return event.to_bytes()
+
+    def send_many(self, events: Sequence[Event]) -> memoryview:
+        """
+        批量编码多个帧,复用同一块缓冲区,返回值在下一次send_many之前有效
+        :param events:
+        :return:
+        """
+        if self._encoder is None:
+            self._encoder = FrameEncoder()
+        return self._encoder.encode_many(events)
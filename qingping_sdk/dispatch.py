@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
+"""
+import asyncio
+import inspect
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from qingping_sdk.connection import Event
+
+# handler(event, fields, context) fields只包含注册时声明的key
+Handler = Callable[[Event, Dict[int, Optional[bytes]], Any], Any]
+
+
+class _Route:
+    __slots__ = ("handler", "keys", "background", "is_async")
+
+    def __init__(self, handler: Handler, keys: Tuple[int, ...], background: bool):
+        self.handler = handler
+        self.keys = keys
+        self.background = background
+        self.is_async = inspect.iscoroutinefunction(handler)
+
+
+class Dispatcher:
+    def __init__(self, workers: int = 4, queue_size: int = 1024):
+        """
+        按cmd把帧分发给注册的handler
+        同步handler在dispatch里直接调用,异步handler和标记为background的handler
+        放进有界队列由固定数量的worker执行,队列满时丢弃并计数,不会阻塞读循环
+        :param workers: 后台worker数量
+        :param queue_size: 后台队列长度
+        """
+        self.workers = workers
+        self.queue_size = queue_size
+        self._routes = {}  # type: Dict[int, List[_Route]]
+        self._queue = None  # type: Optional[asyncio.Queue]
+        self._tasks = []  # type: List[asyncio.Task]
+        self.unhandled = 0  # 没有handler的帧数
+        self.dropped = 0  # 后台队列满丢掉的帧数
+        self.handler_errors = 0
+
+    def register(
+        self,
+        cmd: int,
+        handler: Handler,
+        keys: Iterable[int] = (),
+        background: bool = None,
+    ) -> None:
+        """
+        :param cmd: 帧的cmd
+        :param handler: handler(event, fields, context)
+        :param keys: handler需要的tlv字段,只有这些字段会被取出来放进fields,不存在的为None
+        :param background: 放到后台worker执行,默认异步handler为True,
+            同步handler为True时在线程池里执行
+        :return:
+        """
+        if background is None:
+            background = inspect.iscoroutinefunction(handler)
+        self._routes.setdefault(cmd, []).append(
+            _Route(handler, tuple(keys), background)
+        )
+
+    def on(self, cmd: int, keys: Iterable[int] = (), background: bool = None):
+        """register的装饰器版本"""
+
+        def deco(handler: Handler) -> Handler:
+            self.register(cmd, handler, keys, background)
+            return handler
+
+        return deco
+
+    def dispatch(self, event: Event, context: Any = None) -> bool:
+        """
+        :param event:
+        :param context: 原样传给handler,比如DeviceProtocol
+        :return: 是否有handler处理
+        """
+        routes = self._routes.get(event.cmd)
+        if not routes:
+            self.unhandled += 1
+            return False
+        detached = None
+        for route in routes:
+            if not route.background:
+                fields = {key: event.get(key) for key in route.keys}
+                try:
+                    route.handler(event, fields, context)
+                except Exception:
+                    self.handler_errors += 1
+                continue
+            if detached is None:
+                # 后台执行时接收缓冲区可能已经被覆盖,拷贝一份payload
+                detached = event
+                if isinstance(event.payload, memoryview):
+                    detached = Event(
+                        event.sop,
+                        event.cmd,
+                        event.length,
+                        bytes(event.payload),
+                        event.checksum,
+                    )
+            fields = {key: detached.get(key) for key in route.keys}
+            if self._queue is None:
+                self._start()
+            try:
+                self._queue.put_nowait((route, detached, fields, context))
+            except asyncio.QueueFull:
+                self.dropped += 1
+        return True
+
+    def __call__(self, protocol, event: Event) -> None:
+        """可以直接作为Gateway的handler"""
+        self.dispatch(event, protocol)
+
+    def _start(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(self.queue_size)
+        self._tasks = [loop.create_task(self._work()) for _ in range(self.workers)]
+
+    async def _work(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            route, event, fields, context = await self._queue.get()
+            try:
+                if route.is_async:
+                    await route.handler(event, fields, context)
+                else:
+                    await loop.run_in_executor(
+                        None, route.handler, event, fields, context
+                    )
+            except Exception:
+                self.handler_errors += 1
+            finally:
+                self._queue.task_done()
+
+    async def join(self) -> None:
+        """等待后台队列处理完"""
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
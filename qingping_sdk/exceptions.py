@@ -27,3 +27,7 @@ class ExpiredException(QingpingException):
 
 class ServerException(QingpingException):
     pass
+
+
+class UnauthorizedException(AuthException):
+    """401 token无效或已过期"""
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Set, Tuple
+
+
+class BatchLoader:
+    def __init__(
+        self,
+        batch_fn: Callable[[List[Hashable]], Awaitable[Dict[Hashable, Any]]],
+        max_batch_size: int = 100,
+        delay: float = 0.005,
+        loop: asyncio.AbstractEventLoop = None,
+    ):
+        """
+        DataLoader风格的批量请求,把一小段时间内的单个请求合并成一次批量请求
+        :param batch_fn: batch_fn(keys) -> {key: value} 缺少的key返回None
+        :param max_batch_size: 攒够这么多个key立即发送
+        :param delay: 第一个key进来后最多等待的时间(秒)
+        """
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.delay = delay
+        self._loop = loop or asyncio.get_running_loop()
+        self._queue = []  # type: List[Tuple[Hashable, asyncio.Future]]
+        self._handle = None  # type: asyncio.TimerHandle
+        self._tasks = set()  # type: Set[asyncio.Task]
+
+    async def load(self, key: Hashable) -> Any:
+        fut = self._loop.create_future()
+        self._queue.append((key, fut))
+        if len(self._queue) >= self.max_batch_size:
+            self._dispatch()
+        elif self._handle is None:
+            self._handle = self._loop.call_later(self.delay, self._dispatch)
+        return await fut
+
+    def _dispatch(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        batch, self._queue = self._queue, []
+        if batch:
+            task = self._loop.create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[Hashable, asyncio.Future]]):
+        keys = list(dict.fromkeys(key for key, _ in batch))  # 去重并保持顺序
+        try:
+            results = await self.batch_fn(keys)
+        except Exception as e:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        for key, fut in batch:
+            if not fut.done():
+                fut.set_result(results.get(key))
+
+    def close(self):
+        """取消还没发出去和正在进行的批量请求"""
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        for _, fut in self._queue:
+            fut.cancel()
+        self._queue = []
+        for task in self._tasks:
+            task.cancel()
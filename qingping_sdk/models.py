@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
+"""
+# 与typing.py中的TypedDict一一对应的紧凑模型,使用__slots__且不可修改
+# 嵌套字段在第一次访问时才解码,不认识的字段保存在extra里
+from typing import Any, Dict, Optional, Tuple, Type, TypeVar
+
+M = TypeVar("M", bound="Model")
+_MISSING = object()
+
+
+class Model:
+    __slots__ = ("_pending", "extra")
+    _nested = {}  # type: Dict[str, Type[Model]]  # 字段名 -> 模型
+    _lists = {}  # type: Dict[str, Type[Model]]  # 字段名 -> 列表元素的模型
+
+    def __init__(self, data: Dict[str, Any]):
+        fields = self._fields()
+        pending = None
+        known = 0
+        for name in fields:
+            value = data.get(name, _MISSING)
+            if value is _MISSING:
+                value = None
+            else:
+                known += 1
+            if value is not None and (name in self._nested or name in self._lists):
+                if pending is None:
+                    pending = {}
+                pending[name] = value  # 先保存原始数据,访问时再解码
+            else:
+                object.__setattr__(self, name, value)
+        extra = None
+        if len(data) > known:  # 不认识的字段,保持向前兼容
+            extra = {k: v for k, v in data.items() if k not in fields}
+        object.__setattr__(self, "_pending", pending)
+        object.__setattr__(self, "extra", extra)
+
+    @classmethod
+    def _fields(cls) -> Tuple[str, ...]:
+        return cls.__slots__
+
+    @classmethod
+    def from_dict(cls: Type[M], data: Optional[Dict[str, Any]]) -> Optional[M]:
+        return None if data is None else cls(data)
+
+    def __getattr__(self, name: str) -> Any:
+        # 只有slot还没有赋值时才会走到这里
+        pending = object.__getattribute__(self, "_pending")
+        if pending is None or name not in pending:
+            raise AttributeError(name)
+        raw = pending.pop(name)
+        if name in self._lists:
+            item_cls = self._lists[name]
+            value = tuple(item_cls(item) for item in raw)
+        else:
+            value = self._nested[name](raw)
+        object.__setattr__(self, name, value)
+        if not pending:
+            object.__setattr__(self, "_pending", None)
+        return value
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f"{type(self).__name__} is frozen")
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError(f"{type(self).__name__} is frozen")
+
+    # 兼容dict的读取方式,已有按dict访问的代码可以不改
+    def __getitem__(self, key: str) -> Any:
+        if key in self._fields():
+            return getattr(self, key)
+        if self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            value = self[key]
+        except KeyError:
+            return default
+        return default if value is None else value
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def to_dict(self) -> Dict[str, Any]:
+        ret = {}
+        pending = self._pending or {}
+        for name in self._fields():
+            if name in pending:
+                ret[name] = pending[name]
+                continue
+            value = getattr(self, name)
+            if value is None:
+                continue
+            if isinstance(value, Model):
+                value = value.to_dict()
+            elif isinstance(value, tuple):
+                value = [item.to_dict() for item in value]
+            ret[name] = value
+        if self.extra:
+            ret.update(self.extra)
+        return ret
+
+    def __eq__(self, other) -> bool:
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+
+    __hash__ = None
+
+    def __reduce__(self):
+        return type(self), (self.to_dict(),)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+class DeviceStatus(Model):
+    __slots__ = ("offline",)
+
+
+class DeviceProduct(Model):
+    __slots__ = ("id", "name", "en_name", "code", "noBleSetting")
+
+
+class DeviceSetting(Model):
+    __slots__ = ("report_interval", "collect_interval")
+
+
+class DeviceInfo(Model):
+    __slots__ = (
+        "name",
+        "mac",
+        "group_id",
+        "group_name",
+        "status",
+        "connection_type",
+        "version",
+        "created_at",
+        "product",
+        "setting",
+    )
+    _nested = {
+        "status": DeviceStatus,
+        "product": DeviceProduct,
+        "setting": DeviceSetting,
+    }
+
+
+class DataDetail(Model):
+    __slots__ = ("value", "level", "status")
+
+
+class DeviceData(Model):
+    __slots__ = (
+        "battery",
+        "signal",
+        "humidity",
+        "pressure",
+        "temperature",
+        "tvoc",
+        "co2",
+        "pm25",
+        "timestamp",
+    )
+    _nested = dict.fromkeys(__slots__, DataDetail)
+
+
+class Device(Model):
+    __slots__ = ("info", "data")
+    _nested = {"info": DeviceInfo, "data": DeviceData}
+
+
+class DeviceResponse(Model):
+    __slots__ = ("total", "devices")
+    _lists = {"devices": Device}
+
+
+class HistoryDataResponse(Model):
+    __slots__ = ("total", "data")
+    _lists = {"data": DeviceData}
+
+
+class AlertConfig(Model):
+    __slots__ = ("id", "metric_name", "operator", "threshold")
+
+
+class Event(Model):
+    __slots__ = ("data", "alert_config")
+    _nested = {"data": DeviceData, "alert_config": AlertConfig}
+
+
+class HistoryEventResponse(Model):
+    __slots__ = ("total", "events")
+    _lists = {"events": Event}
+
+
+class GetAlertResponse(Model):
+    __slots__ = ("mac", "alert_configs")
+    _lists = {"alert_configs": AlertConfig}
+
+
+class Group(Model):
+    __slots__ = ("id", "name")
+
+
+class GetGroupsResponse(Model):
+    __slots__ = ("total", "groups")
+    _lists = {"groups": Group}
+
+
+class Profile(Model):
+    __slots__ = ("mac", "ble_mac", "sn", "customization_sn")
+
+
+class DeviceInfoResponse(Model):
+    __slots__ = ("total", "profiles")
+    _lists = {"profiles": Profile}
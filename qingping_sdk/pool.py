@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+import aiohttp
+
+from qingping_sdk.cache import ResponseCache
+from qingping_sdk.client import DEFAULT_JSON_ENCODER, Client
+from qingping_sdk.token_store import MemoryTokenStore, TokenStore
+
+
+class ClientPool:
+    def __init__(
+        self,
+        max_tenants: int = 256,
+        idle_timeout: float = 600.0,
+        max_concurrency: int = 8,
+        limit: int = 100,
+        limit_per_host: int = 0,
+        keepalive_timeout: float = 30.0,
+        ttl_dns_cache: int = 300,
+        token_store: TokenStore = None,
+        cache_factory: Callable[[], ResponseCache] = None,
+        loop: asyncio.AbstractEventLoop = None,
+        **client_kw,
+    ):
+        """
+        多租户的Client池
+        所有租户共用一个TCPConnector和ClientSession,token在第一次请求时才获取,不跑后台刷新任务
+        超过max_tenants或者空闲超过idle_timeout的租户按LRU淘汰,token留在token_store里,再次使用时不用重新认证
+        :param max_tenants: 同时保留的Client数
+        :param idle_timeout: 空闲多少秒后淘汰 单位s
+        :param max_concurrency: 每个租户同时在途的请求数,防止大账号占满连接池
+        :param limit: 连接池总连接数
+        :param limit_per_host: 每个host的连接数 0表示不限制
+        :param keepalive_timeout: 空闲连接保持的时间 单位s
+        :param ttl_dns_cache: dns缓存时间 单位s
+        :param token_store: 默认保存在内存里
+        :param cache_factory: 为每个租户创建一个ResponseCache,例如ResponseCache或者functools.partial(ResponseCache, maxsize=256)
+            缓存的key里没有app_key,不能在租户之间共用,所以不接受client_kw里的cache
+        :param client_kw: 传给每个Client的其他参数,例如retry_policy, rate_limiter, loads
+        """
+        if "cache" in client_kw:
+            raise TypeError("cache would be shared by all tenants, use cache_factory")
+        self.max_tenants = max_tenants
+        self.idle_timeout = idle_timeout
+        self.max_concurrency = max_concurrency
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.ttl_dns_cache = ttl_dns_cache
+        self.token_store = token_store or MemoryTokenStore()
+        self.cache_factory = cache_factory
+        self._loop = loop or asyncio.get_running_loop()
+        self.client_kw = client_kw
+
+        self.connector = None  # type: Optional[aiohttp.TCPConnector]
+        self.client_session = None  # type: Optional[aiohttp.ClientSession]
+        self._secrets = {}  # type: Dict[str, str]
+        self._clients = OrderedDict()  # type: OrderedDict[str, Client]
+        self._last_used = {}  # type: Dict[str, float]
+        self.evicted = 0
+
+    def _session(self) -> aiohttp.ClientSession:
+        if self.client_session is None:
+            self.connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                use_dns_cache=True,
+                ttl_dns_cache=self.ttl_dns_cache,
+            )
+            self.client_session = aiohttp.ClientSession(
+                connector=self.connector,
+                json_serialize=self.client_kw.get("dumps", DEFAULT_JSON_ENCODER),
+            )
+        return self.client_session
+
+    def add(self, app_key: str, app_secret: str):
+        """
+        登记一个租户,不会立刻创建Client
+        :param app_key:
+        :param app_secret:
+        :return:
+        """
+        if self._secrets.get(app_key, app_secret) != app_secret:
+            self.discard(app_key)  # 换了密钥,旧的Client不能再用
+        self._secrets[app_key] = app_secret
+
+    def get(self, app_key: str, app_secret: str = None) -> Client:
+        """
+        取出租户的Client,没有就创建一个
+        :param app_key:
+        :param app_secret: 没有用add登记过时必须提供
+        :return:
+        """
+        if app_secret is not None:
+            self.add(app_key, app_secret)
+        now = time.monotonic()
+        self._evict_idle(now)
+        client = self._clients.get(app_key)
+        if client is None:
+            client = Client(
+                app_key,
+                self._secrets[app_key],
+                client_session=self._session(),
+                close_on_exit=False,
+                loop=self._loop,
+                token_store=self.token_store,
+                max_concurrency=self.max_concurrency,
+                lazy_token=True,
+                cache=self.cache_factory() if self.cache_factory else None,
+                **self.client_kw,
+            )
+            self._clients[app_key] = client
+            while len(self._clients) > self.max_tenants:
+                self._evict(next(iter(self._clients)))
+        else:
+            self._clients.move_to_end(app_key)
+        self._last_used[app_key] = now
+        return client
+
+    __getitem__ = get
+
+    def discard(self, app_key: str):
+        """
+        去掉租户的Client,已经发出的请求不受影响
+        :param app_key:
+        :return:
+        """
+        if app_key in self._clients:
+            self._evict(app_key)
+
+    def _evict(self, app_key: str) -> Client:
+        # 只去掉引用,已经发出的请求和还在攒批的batch_*调用照常完成
+        client = self._clients.pop(app_key)
+        del self._last_used[app_key]
+        self.evicted += 1
+        return client
+
+    def _evict_idle(self, now: float):
+        # _clients按最近使用排序,从最久没用的开始检查
+        deadline = now - self.idle_timeout
+        while self._clients:
+            app_key = next(iter(self._clients))
+            if self._last_used[app_key] > deadline:
+                break
+            self._evict(app_key)
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+    def __contains__(self, app_key: str) -> bool:
+        return app_key in self._clients
+
+    async def close(self):
+        for app_key in list(self._clients):
+            self._evict(app_key)._cancel_background()  # 连接池要关闭了
+        if self.client_session is not None:
+            await self.client_session.close()
+            self.client_session = None
+            self.connector = None
+
+    async def __aenter__(self):
+        self._session()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+        return False
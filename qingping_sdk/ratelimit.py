@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
+"""
+import asyncio
+import time
+from typing import Dict, Tuple
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = None):
+        """
+        令牌桶
+        :param rate: 每秒补充的令牌数
+        :param capacity: 桶容量,即允许的突发请求数,默认等于rate
+        """
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def reserve(self, tokens: float = 1) -> float:
+        """
+        预约令牌,令牌不足时记账(允许为负),返回调用方需要等待的秒数
+        预约是同步完成的,不需要锁,因此可以在多个Client之间共享
+        """
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+        self._tokens -= tokens
+        if self._tokens >= 0:
+            return 0.0
+        return -self._tokens / self.rate
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        rate: float,
+        burst: float = None,
+        endpoints: Dict[str, Tuple[float, float]] = None,
+    ):
+        """
+        全局令牌桶 + 可选的按接口令牌桶
+        :param rate: 全局每秒请求数
+        :param burst: 全局突发请求数
+        :param endpoints: 接口路径 -> (每秒请求数, 突发请求数) e.g. {"/v1/apis/devices/data": (5, 10)}
+        """
+        self.bucket = TokenBucket(rate, burst)
+        self.endpoints = {}  # type: Dict[str, TokenBucket]
+        for path, (endpoint_rate, endpoint_burst) in (endpoints or {}).items():
+            self.set_endpoint(path, endpoint_rate, endpoint_burst)
+        self.acquired = 0  # 总请求数
+        self.waited = 0.0  # 累计等待时间(秒)
+        self.max_wait = 0.0  # 单次最长等待时间(秒)
+
+    def set_endpoint(self, path: str, rate: float, burst: float = None) -> None:
+        self.endpoints[path] = TokenBucket(rate, burst)
+
+    async def acquire(self, endpoint: str = None) -> float:
+        """
+        等待直到允许发送一个请求
+        :param endpoint: 接口路径
+        :return: 本次等待的秒数
+        """
+        delay = self.bucket.reserve()
+        bucket = self.endpoints.get(endpoint)
+        if bucket is not None:
+            delay = max(delay, bucket.reserve())
+        self.acquired += 1
+        self.waited += delay
+        self.max_wait = max(self.max_wait, delay)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return delay
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
+"""
+import asyncio
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Awaitable, Dict, List, Optional, Tuple
+
+from qingping_sdk.client import Client
+from qingping_sdk.typing import AlertConfig, Device
+
+
+@dataclass
+class Policy:
+    """期望的设备状态,为None的部分不做修改"""
+
+    alerts: Optional[List[AlertConfig]] = None  # 按(metric_name, operator)和现有配置对应
+    report_interval: Optional[int] = None  # 上报周期(秒)
+    collect_interval: Optional[int] = None  # 采集周期(秒)
+
+    def __post_init__(self):
+        if (self.report_interval is None) != (self.collect_interval is None):
+            raise ValueError(
+                "report_interval and collect_interval must be set together"
+            )
+
+    @property
+    def settings(self) -> Optional[Tuple[int, int]]:
+        if self.report_interval is None:
+            return None
+        return self.report_interval, self.collect_interval
+
+
+@dataclass
+class AlertPlan:
+    add: List[AlertConfig]
+    change: List[AlertConfig]  # 带着现有配置的id
+    delete: List[int]  # 配置id
+
+    def __bool__(self) -> bool:
+        return bool(self.add or self.change or self.delete)
+
+
+@dataclass
+class DeviceOutcome:
+    """单个设备的执行结果,dry_run时是计划要做的修改"""
+
+    mac: str
+    added: int = 0
+    changed: int = 0
+    deleted: int = 0
+    settings_changed: bool = False
+    errors: List[BaseException] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+    @property
+    def unchanged(self) -> bool:
+        return not (self.added or self.changed or self.deleted or self.settings_changed)
+
+
+def _alert_key(config: AlertConfig) -> Tuple[str, str]:
+    return config["metric_name"], config["operator"]
+
+
+def diff_alerts(current: List[AlertConfig], desired: List[AlertConfig]) -> AlertPlan:
+    """
+    比较现有和期望的报警配置,同一个(metric_name, operator)只改阈值
+    :param current: get_alert返回的配置
+    :param desired: 期望的配置
+    :return: 最少的增删改
+    """
+    existing = {}  # type: Dict[Tuple[str, str], AlertConfig]
+    delete = []
+    for config in current:
+        key = _alert_key(config)
+        if key in existing:
+            delete.append(config["id"])  # 重复的配置只留一个
+        else:
+            existing[key] = config
+    add = []
+    change = []
+    seen = set()
+    for config in desired:
+        key = _alert_key(config)
+        if key in seen:
+            raise ValueError(f"duplicate alert config {key}")
+        seen.add(key)
+        old = existing.pop(key, None)
+        new = {
+            "metric_name": config["metric_name"],
+            "operator": config["operator"],
+            "threshold": config["threshold"],
+        }
+        if old is None:
+            add.append(new)
+        elif old["threshold"] != config["threshold"]:
+            new["id"] = old["id"]
+            change.append(new)
+    delete.extend(config["id"] for config in existing.values())
+    return AlertPlan(add, change, delete)
+
+
+def _device_settings(device: Device) -> Optional[Tuple[int, int]]:
+    setting = device["info"].get("setting")
+    if not setting:
+        return None
+    return setting.get("report_interval"), setting.get("collect_interval")
+
+
+class Reconciler:
+    def __init__(self, client: Client, concurrency: int = 8, dry_run: bool = False):
+        """
+        把设备的报警配置和上报配置调整到期望状态,只发出必要的请求
+        :param client:
+        :param concurrency: 同时在途的请求数
+        :param dry_run: 只比较不修改
+        """
+        self.client = client
+        self.concurrency = concurrency
+        self.dry_run = dry_run
+
+    async def reconcile(
+        self,
+        devices: Dict[str, Policy] = None,
+        groups: Dict[int, Policy] = None,
+        role: str = None,
+    ) -> Dict[str, DeviceOutcome]:
+        """
+        :param devices: mac -> 期望状态,优先于所在分组的
+        :param groups: 分组id -> 期望状态,应用到分组里的所有设备
+        :param role: 请求者角色（只有是代理商角色需要填写这个字段，代理商标识："agent"）
+        :return: mac -> 执行结果
+        """
+        targets = {}  # type: Dict[str, Policy]
+        current = {}  # type: Dict[str, Optional[Tuple[int, int]]]
+        for group_id, policy in (groups or {}).items():
+            async for device in self.client.iter_devices(group_id, role=role):
+                mac = device["info"]["mac"]
+                targets[mac] = policy
+                current[mac] = _device_settings(device)
+        targets.update(devices or {})
+        if any(
+            policy.settings is not None and mac not in current
+            for mac, policy in targets.items()
+        ):
+            async for device in self.client.iter_devices(role=role):
+                current.setdefault(device["info"]["mac"], _device_settings(device))
+
+        report = {mac: DeviceOutcome(mac) for mac in targets}
+        semaphore = asyncio.Semaphore(self.concurrency)
+        jobs = [
+            self._reconcile_alerts(mac, policy.alerts, report[mac], semaphore)
+            for mac, policy in targets.items()
+            if policy.alerts is not None
+        ]
+        pending = defaultdict(list)  # type: Dict[Tuple[int, int], List[str]]
+        for mac, policy in targets.items():
+            settings = policy.settings
+            if settings is not None and current.get(mac) != settings:
+                pending[settings].append(mac)
+        for (report_interval, collect_interval), macs in pending.items():
+            step = self.client.batch_size
+            for i in range(0, len(macs), step):
+                jobs.append(
+                    self._change_settings(
+                        macs[i : i + step],
+                        report_interval,
+                        collect_interval,
+                        report,
+                        semaphore,
+                    )
+                )
+        await asyncio.gather(*jobs)
+        return report
+
+    @staticmethod
+    async def _call(
+        semaphore: asyncio.Semaphore, coro: Awaitable, outcome: DeviceOutcome
+    ) -> bool:
+        async with semaphore:
+            try:
+                await coro
+                return True
+            except Exception as e:
+                outcome.errors.append(e)
+                return False
+
+    async def _reconcile_alerts(
+        self,
+        mac: str,
+        desired: List[AlertConfig],
+        outcome: DeviceOutcome,
+        semaphore: asyncio.Semaphore,
+    ):
+        async with semaphore:
+            try:
+                resp = await self.client.get_alert(mac)
+            except Exception as e:
+                outcome.errors.append(e)
+                return
+        try:
+            plan = diff_alerts(resp.get("alert_configs") or [], desired)
+        except ValueError as e:
+            outcome.errors.append(e)
+            return
+        if self.dry_run:
+            outcome.added = len(plan.add)
+            outcome.changed = len(plan.change)
+            outcome.deleted = len(plan.delete)
+            return
+        calls = [self.client.add_alert(mac, config) for config in plan.add]
+        calls.extend(self.client.change_alert(mac, config) for config in plan.change)
+        if plan.delete:
+            calls.append(self.client.delete_alert(mac, plan.delete))  # 一次删完
+        results = await asyncio.gather(
+            *(self._call(semaphore, call, outcome) for call in calls)
+        )
+        added = len(plan.add)
+        changed = added + len(plan.change)
+        outcome.added = sum(results[:added])
+        outcome.changed = sum(results[added:changed])
+        if plan.delete and results[-1]:
+            outcome.deleted = len(plan.delete)
+
+    async def _change_settings(
+        self,
+        macs: List[str],
+        report_interval: int,
+        collect_interval: int,
+        report: Dict[str, DeviceOutcome],
+        semaphore: asyncio.Semaphore,
+    ):
+        if not self.dry_run:
+            async with semaphore:
+                try:
+                    await self.client.change_settings(
+                        macs, report_interval, collect_interval
+                    )
+                except Exception as e:
+                    for mac in macs:
+                        report[mac].errors.append(e)
+                    return
+        for mac in macs:
+            report[mac].settings_changed = True
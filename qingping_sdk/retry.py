@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
+"""
+import random
+from dataclasses import dataclass
+from typing import FrozenSet, Tuple, Type
+
+from qingping_sdk.exceptions import ExpiredException, ServerException
+
+
+@dataclass
+class RetryPolicy:
+    max_attempts: int = 3  # 总尝试次数 1表示不重试
+    base_delay: float = 0.5  # 第一次重试前的等待(秒)
+    max_delay: float = 10.0  # 单次等待上限(秒)
+    jitter: bool = True  # full jitter,避免大量请求同时重试
+    retry_on: Tuple[Type[BaseException], ...] = (ServerException, ExpiredException)
+    # 只重试幂等的方法,POST失败时服务端可能已经执行过了
+    retry_methods: FrozenSet[str] = frozenset(("GET", "PUT", "DELETE"))
+
+    def backoff(self, attempt: int) -> float:
+        """
+        第attempt次重试前需要等待的时间
+        :param attempt: 从1开始
+        :return:
+        """
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        if self.jitter:
+            return random.uniform(0, delay)
+        return delay
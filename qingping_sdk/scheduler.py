@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
+"""
+import asyncio
+import heapq
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import AsyncGenerator, Dict, List, Optional, Tuple
+
+from qingping_sdk import models
+from qingping_sdk.client import MAX_PAGE_LIMIT, Client
+from qingping_sdk.typing import Device, DeviceData
+
+
+@dataclass
+class Delta:
+    mac: str
+    timestamp: int  # 这条数据的时间戳 单位s
+    changed: Dict[str, float]  # 和上一条相比变化了的指标 -> 新值
+
+
+class _DeviceState:
+    __slots__ = (
+        "mac",
+        "group_id",
+        "interval",
+        "timestamp",
+        "values",
+        "offline",
+        "misses",
+        "due",
+    )
+
+    def __init__(self, mac: str):
+        self.mac = mac
+        self.group_id = None
+        self.interval = 0
+        self.timestamp = None  # type: Optional[int]
+        self.values = {}  # type: Dict[str, float]
+        self.offline = False
+        self.misses = 0  # 连续几次到点了却没有新数据
+        self.due = 0.0
+
+
+def _as_dict(obj) -> dict:
+    if isinstance(obj, models.Model):
+        return obj.to_dict()
+    return obj or {}
+
+
+class PollScheduler:
+    def __init__(
+        self,
+        client: Client,
+        group_id: int = None,
+        role: str = None,
+        grace: float = 10.0,
+        batch_window: float = 5.0,
+        default_interval: int = 900,
+        max_backoff: float = 3600.0,
+        full_refresh: float = 3600.0,
+    ):
+        """
+        按每个设备的report_interval和最后一条数据的时间预测下一次上报,只在有新数据的时候去拉
+        同一时间到期的设备合并请求:同一分组里到期的设备够多时拉一次分组的设备列表,否则按设备拉历史数据
+        离线或者到点没有数据的设备按指数退避
+        :param client:
+        :param group_id: 只调度这个分组里的设备
+        :param role: 请求者角色（只有是代理商角色需要填写这个字段，代理商标识："agent"）
+        :param grace: 预计上报时间之后再等多少秒,留给设备上传和服务端入库 单位s
+        :param batch_window: 在这个时间内到期的设备合并成一批 单位s
+        :param default_interval: 没有report_interval的设备按这个周期 单位s
+        :param max_backoff: 退避的上限 单位s
+        :param full_refresh: 每隔多久拉一次完整的设备列表,发现新增设备和配置变化 单位s
+        """
+        self.client = client
+        self.group_id = group_id
+        self.role = role
+        self.grace = grace
+        self.batch_window = batch_window
+        self.default_interval = default_interval
+        self.max_backoff = max_backoff
+        self.full_refresh = full_refresh
+
+        self.states = {}  # type: Dict[str, _DeviceState]
+        self._heap = []  # type: List[Tuple[float, str]]
+        self.calls = 0  # 发出的列表/历史请求数
+        self.errors = 0
+
+    def _schedule(self, state: _DeviceState, now: float):
+        if state.misses or state.offline:
+            delay = min(state.interval * 2**state.misses, self.max_backoff)
+            state.due = now + delay
+        elif state.timestamp is None:
+            state.due = now + state.interval
+        else:
+            state.due = max(state.timestamp + state.interval + self.grace, now)
+        heapq.heappush(self._heap, (state.due, state.mac))
+
+    def _observe(self, state: _DeviceState, data: DeviceData) -> Optional[Delta]:
+        data = _as_dict(data)
+        timestamp = (data.get("timestamp") or {}).get("value")
+        if timestamp is None or (
+            state.timestamp is not None and timestamp <= state.timestamp
+        ):
+            return None
+        state.timestamp = int(timestamp)
+        state.misses = 0
+        changed = {}
+        for key, detail in data.items():
+            if key == "timestamp" or not isinstance(detail, dict):
+                continue
+            value = detail.get("value")
+            if state.values.get(key) != value:
+                changed[key] = state.values[key] = value
+        if not changed:
+            return None
+        return Delta(state.mac, state.timestamp, changed)
+
+    def _ingest(self, device: Device, now: float) -> Optional[Delta]:
+        info = _as_dict(device["info"])
+        mac = info["mac"]
+        state = self.states.get(mac)
+        if state is None:
+            state = self.states[mac] = _DeviceState(mac)
+        state.group_id = info.get("group_id")
+        state.interval = (info.get("setting") or {}).get(
+            "report_interval"
+        ) or self.default_interval
+        state.offline = bool((info.get("status") or {}).get("offline"))
+        timestamp = state.timestamp
+        delta = self._observe(state, device.get("data"))
+        # 正在拉取的设备(due为-1)由poll_once统一重新调度
+        if state.due != -1 and (state.timestamp != timestamp or state.due == 0.0):
+            self._schedule(state, now)
+        return delta
+
+    async def refresh(self, now: float = None) -> List[Delta]:
+        """
+        拉取完整的设备列表,更新所有设备的上报周期和状态
+        :param now:
+        :return: 有变化的数据
+        """
+        now = now or time.time()
+        deltas = []
+        seen = set()
+        async for device in self.client.iter_devices(self.group_id, role=self.role):
+            seen.add(device["info"]["mac"])
+            delta = self._ingest(device, now)
+            if delta is not None:
+                deltas.append(delta)
+        self.calls += -(-max(len(seen), 1) // MAX_PAGE_LIMIT)
+        for mac in list(self.states):
+            if mac not in seen:
+                del self.states[mac]  # 已经删除的设备,堆里的条目会被跳过
+        return deltas
+
+    def next_due(self) -> Optional[float]:
+        """最早到期的时间,没有设备时返回None"""
+        heap = self._heap
+        while heap:
+            due, mac = heap[0]
+            state = self.states.get(mac)
+            if state is not None and state.due == due:
+                return due
+            heapq.heappop(heap)  # 已经重新调度过的旧条目
+        return None
+
+    def _pop_due(self, now: float) -> List[_DeviceState]:
+        due = []
+        deadline = now + self.batch_window
+        while True:
+            when = self.next_due()
+            if when is None or when > deadline:
+                return due
+            state = self.states[heapq.heappop(self._heap)[1]]
+            state.due = -1  # 同一个设备的其他条目都会失效
+            due.append(state)
+
+    async def _poll_group(self, group_id: int, now: float) -> List[Delta]:
+        deltas = []
+        try:
+            async for device in self.client.iter_devices(group_id, role=self.role):
+                delta = self._ingest(device, now)
+                if delta is not None:
+                    deltas.append(delta)
+        except Exception:
+            self.errors += 1
+        return deltas
+
+    async def _poll_history(self, state: _DeviceState, now: float) -> List[Delta]:
+        deltas = []
+        start = (
+            state.timestamp + 1
+            if state.timestamp is not None
+            else int(now - 2 * state.interval)
+        )
+        try:
+            async for row in self.client.iter_history_data(state.mac, start, int(now)):
+                delta = self._observe(state, row)
+                if delta is not None:
+                    deltas.append(delta)
+        except Exception:
+            self.errors += 1
+        return deltas
+
+    async def poll_once(self, now: float = None) -> List[Delta]:
+        """
+        拉取所有已经到期(或者batch_window内就会到期)的设备
+        :param now:
+        :return: 有变化的数据
+        """
+        now = now or time.time()
+        due = self._pop_due(now)
+        if not due:
+            return []
+        timestamps = {state.mac: state.timestamp for state in due}
+        by_group = defaultdict(list)  # type: Dict[Optional[int], List[_DeviceState]]
+        for state in due:
+            by_group[state.group_id].append(state)
+        group_sizes = defaultdict(int)  # type: Dict[Optional[int], int]
+        for state in self.states.values():
+            group_sizes[state.group_id] += 1
+        jobs = []
+        for group_id, states in by_group.items():
+            pages = -(-group_sizes[group_id] // MAX_PAGE_LIMIT)
+            if group_id and pages <= len(states):
+                jobs.append(self._poll_group(group_id, now))
+                self.calls += pages
+            else:
+                jobs.extend(self._poll_history(state, now) for state in states)
+                self.calls += len(states)
+        deltas = []
+        for result in await asyncio.gather(*jobs):
+            deltas.extend(result)
+        for state in due:
+            if self.states.get(state.mac) is not state:
+                continue
+            if state.timestamp == timestamps[state.mac]:
+                state.misses += 1
+            self._schedule(state, now)
+        deltas.sort(key=lambda delta: delta.timestamp)
+        return deltas
+
+    async def run(self) -> AsyncGenerator[Delta, None]:
+        """
+        一直调度下去,逐条返回有变化的数据
+        :return:
+        """
+        for delta in await self.refresh():
+            yield delta
+        next_refresh = time.time() + self.full_refresh
+        while True:
+            now = time.time()
+            if now >= next_refresh:
+                for delta in await self.refresh(now):
+                    yield delta
+                next_refresh = now + self.full_refresh
+            for delta in await self.poll_once(now):
+                yield delta
+            due = self.next_due()
+            wake = next_refresh if due is None else min(due, next_refresh)
+            await asyncio.sleep(max(wake - time.time(), 0))
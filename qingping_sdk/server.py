@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
+"""
+import asyncio
+import inspect
+from collections import deque
+from typing import Any, Awaitable, Callable, Optional, Sequence, Set, Union
+
+from qingping_sdk.connection import MAX_FRAME_SIZE, Connection, Event
+
+Handler = Callable[["DeviceProtocol", Event], Union[None, Awaitable[Any]]]
+
+
+class DeviceProtocol(asyncio.BufferedProtocol):
+    def __init__(
+        self,
+        handler: Handler,
+        queue_size: int = 64,
+        buffer_size: int = 4096,
+        verify_checksum: bool = False,
+        gateway: "Gateway" = None,
+        max_frame_size: int = MAX_FRAME_SIZE,
+    ):
+        """
+        把socket上的数据直接读进Connection的缓冲区,解析出来的帧按顺序交给handler
+        待处理的帧超过queue_size时暂停读取,处理到一半以下再恢复
+        :param handler: handler(protocol, event) 可以是同步函数也可以是协程函数
+        :param queue_size: 每个连接最多缓存多少个待处理的帧
+        :param buffer_size: 接收缓冲区初始大小
+        :param verify_checksum: 是否校验checksum
+        :param gateway: 所属的Gateway
+        :param max_frame_size: payload长度上限,见Connection
+        """
+        self.handler = handler
+        self.queue_size = queue_size
+        self.gateway = gateway
+        self.connection = Connection(
+            buffer_size,
+            copy_payload=True,
+            verify_checksum=verify_checksum,
+            max_frame_size=max_frame_size,
+        )  # 帧要排队处理,不能引用接收缓冲区
+        self.transport = None  # type: Optional[asyncio.Transport]
+        self.handler_errors = 0
+        self._queue = deque()  # type: deque
+        self._worker = None  # type: Optional[asyncio.Task]
+        self._reading_paused = False
+        self._writing_paused = False
+        self._drain_waiter = None  # type: Optional[asyncio.Future]
+        self._closed = None  # type: Optional[asyncio.Future]
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        self.transport = transport
+        self._closed = asyncio.get_running_loop().create_future()
+        if self.gateway is not None:
+            self.gateway.connections.add(self)
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        if self.gateway is not None:
+            self.gateway.connections.discard(self)
+        if self._worker is not None:
+            self._worker.cancel()
+        self._queue.clear()
+        if self._drain_waiter is not None and not self._drain_waiter.done():
+            self._drain_waiter.set_exception(ConnectionResetError("connection lost"))
+        if not self._closed.done():
+            self._closed.set_result(None)
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        return self.connection.get_buffer(sizehint)
+
+    def buffer_updated(self, nbytes: int) -> None:
+        self._queue.extend(self.connection.buffer_updated(nbytes))
+        if not self._queue:
+            return
+        if len(self._queue) >= self.queue_size and not self._reading_paused:
+            self._reading_paused = True
+            self.transport.pause_reading()
+        if self._worker is None:
+            # 只在有帧要处理的时候才创建任务,空闲连接不占额外内存
+            self._worker = asyncio.get_running_loop().create_task(self._work())
+
+    async def _work(self) -> None:
+        try:
+            while self._queue:
+                event = self._queue.popleft()
+                try:
+                    ret = self.handler(self, event)
+                    if inspect.isawaitable(ret):
+                        await ret
+                except Exception:
+                    self.handler_errors += 1
+                if self._reading_paused and len(self._queue) <= self.queue_size // 2:
+                    self._reading_paused = False
+                    self.transport.resume_reading()
+        finally:
+            self._worker = None
+
+    def pause_writing(self) -> None:
+        self._writing_paused = True
+
+    def resume_writing(self) -> None:
+        self._writing_paused = False
+        if self._drain_waiter is not None and not self._drain_waiter.done():
+            self._drain_waiter.set_result(None)
+        self._drain_waiter = None
+
+    def send(self, event: Event) -> None:
+        self.transport.write(event.to_bytes())
+
+    def send_many(self, events: Sequence[Event]) -> None:
+        """多个帧编码进同一块缓冲区,一次写入"""
+        self.transport.write(self.connection.send_many(events))
+
+    async def drain(self) -> None:
+        """发送缓冲区超过高水位时等待对端读走"""
+        if not self._writing_paused:
+            return
+        if self._drain_waiter is None:
+            self._drain_waiter = asyncio.get_running_loop().create_future()
+        await asyncio.shield(self._drain_waiter)
+
+    def close(self) -> None:
+        if self.transport is not None:
+            self.transport.close()
+
+    async def wait_closed(self) -> None:
+        await self._closed
+
+
+class Gateway:
+    def __init__(
+        self,
+        handler: Handler,
+        queue_size: int = 64,
+        buffer_size: int = 4096,
+        verify_checksum: bool = False,
+        max_frame_size: int = MAX_FRAME_SIZE,
+    ):
+        """
+        设备接入网关,每个设备tcp连接一个DeviceProtocol
+        :param handler: handler(protocol, event) 可以是同步函数也可以是协程函数
+        :param queue_size: 每个连接最多缓存多少个待处理的帧
+        :param buffer_size: 每个连接接收缓冲区初始大小
+        :param verify_checksum: 是否校验checksum
+        :param max_frame_size: payload长度上限,见Connection
+        """
+        self.handler = handler
+        self.queue_size = queue_size
+        self.buffer_size = buffer_size
+        self.verify_checksum = verify_checksum
+        self.max_frame_size = max_frame_size
+        self.connections = set()  # type: Set[DeviceProtocol]
+        self.server = None  # type: Optional[asyncio.AbstractServer]
+
+    def _protocol_factory(self) -> DeviceProtocol:
+        return DeviceProtocol(
+            self.handler,
+            self.queue_size,
+            self.buffer_size,
+            self.verify_checksum,
+            self,
+            self.max_frame_size,
+        )
+
+    async def start(self, host: str = None, port: int = 0, **kw) -> None:
+        """
+        :param host:
+        :param port: 0表示随机端口,可以通过self.port获取
+        :param kw: 传给loop.create_server
+        :return:
+        """
+        self.server = await asyncio.get_running_loop().create_server(
+            self._protocol_factory, host, port, **kw
+        )
+
+    @property
+    def port(self) -> int:
+        return self.server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self) -> None:
+        await self.server.serve_forever()
+
+    async def close(self) -> None:
+        if self.server is not None:
+            self.server.close()
+        for protocol in list(self.connections):
+            protocol.close()
+        if self.server is not None:
+            await self.server.wait_closed()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+        return False
+
+
+async def connect(
+    host: str, port: int, handler: Handler, queue_size: int = 64, **kw
+) -> DeviceProtocol:
+    """
+    以设备的身份连接网关,可以用来在本地模拟设备
+    :param host:
+    :param port:
+    :param handler: 处理网关下发的帧
+    :param queue_size:
+    :param kw: 传给loop.create_connection
+    :return:
+    """
+    _, protocol = await asyncio.get_running_loop().create_connection(
+        lambda: DeviceProtocol(handler, queue_size), host, port, **kw
+    )
+    return protocol
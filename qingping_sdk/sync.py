@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
+"""
+import sqlite3
+import time
+from collections import deque
+from typing import Any, AsyncGenerator, Dict, List, Optional, Tuple
+
+from qingping_sdk.client import MAX_PAGE_LIMIT, Client
+
+DATA = "data"  # get_history_data
+EVENTS = "events"  # get_history_events
+
+
+class CheckpointStore:
+    """每个设备每种数据流最后一次同步到的时间戳(秒)"""
+
+    def get(self, mac: str, stream: str) -> Optional[int]:
+        raise NotImplementedError
+
+    def set(self, mac: str, stream: str, timestamp: int) -> None:
+        raise NotImplementedError
+
+
+class MemoryCheckpointStore(CheckpointStore):
+    def __init__(self):
+        self._data = {}  # type: Dict[Tuple[str, str], int]
+
+    def get(self, mac: str, stream: str) -> Optional[int]:
+        return self._data.get((mac, stream))
+
+    def set(self, mac: str, stream: str, timestamp: int) -> None:
+        self._data[(mac, stream)] = timestamp
+
+
+class SQLiteCheckpointStore(CheckpointStore):
+    def __init__(self, path: str):
+        self._db = sqlite3.connect(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoints ("
+            "mac TEXT NOT NULL, stream TEXT NOT NULL, timestamp INTEGER NOT NULL, "
+            "PRIMARY KEY (mac, stream))"
+        )
+        self._db.commit()
+
+    def get(self, mac: str, stream: str) -> Optional[int]:
+        row = self._db.execute(
+            "SELECT timestamp FROM checkpoints WHERE mac = ? AND stream = ?",
+            (mac, stream),
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, mac: str, stream: str, timestamp: int) -> None:
+        self._db.execute(
+            "INSERT INTO checkpoints (mac, stream, timestamp) VALUES (?, ?, ?) "
+            "ON CONFLICT (mac, stream) DO UPDATE SET timestamp = excluded.timestamp",
+            (mac, stream, timestamp),
+        )
+        self._db.commit()
+
+    def close(self) -> None:
+        self._db.close()
+
+
+def row_timestamp(stream: str, row: dict) -> int:
+    """历史数据/事件的时间戳(秒)"""
+    data = row if stream == DATA else row["data"]
+    return int(data["timestamp"]["value"])
+
+
+class SyncBatch:
+    def __init__(
+        self,
+        sync: "HistorySync",
+        mac: str,
+        stream: str,
+        rows: List[Any],
+        timestamp: int,
+        pending: deque,
+    ):
+        self._sync = sync
+        self._pending = pending  # 同一次iter_batches产生的还没有推进检查点的批
+        self.mac = mac
+        self.stream = stream
+        self.rows = rows
+        self.timestamp = timestamp  # 本批最后一条的时间戳
+        self.acked = False
+
+    def ack(self) -> None:
+        """
+        确认本批已经处理完,可以乱序确认
+        检查点只前移到连续确认的最后一批,前面还有没确认的批时先不动
+        """
+        if not self.acked:
+            self.acked = True
+            self._sync._ack(self)
+
+
+class HistorySync:
+    def __init__(
+        self,
+        client: Client,
+        store: CheckpointStore,
+        initial_window: int = 86400,
+        batch_size: int = MAX_PAGE_LIMIT,
+        concurrency: int = 4,
+    ):
+        """
+        增量同步历史数据/事件
+        :param client:
+        :param store: 检查点存储
+        :param initial_window: 没有检查点时往前同步多少秒
+        :param batch_size: 每批大约多少条,同一秒的数据不会被拆到两批
+        :param concurrency: 同时请求的页数
+        """
+        self.client = client
+        self.store = store
+        self.initial_window = initial_window
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+
+    async def iter_batches(
+        self, mac: str, stream: str = DATA, end_time: int = None
+    ) -> AsyncGenerator[SyncBatch, None]:
+        """
+        只拉取检查点之后的新数据,丢弃边界上重复的数据
+        检查点只在调用SyncBatch.ack之后才会前移
+        :param mac: 设备mac地址
+        :param stream: DATA 或 EVENTS
+        :param end_time: 结束时间戳 单位s 默认当前时间
+        :return:
+        """
+        end_time = end_time or int(time.time())
+        checkpoint = self.store.get(mac, stream)
+        if checkpoint is None:
+            start_time = end_time - self.initial_window
+        else:
+            start_time = checkpoint
+        if stream == DATA:
+            rows = self.client.iter_history_data(
+                mac, start_time, end_time, concurrency=self.concurrency
+            )
+        elif stream == EVENTS:
+            rows = self.client.iter_history_events(
+                mac, start_time, end_time, concurrency=self.concurrency
+            )
+        else:
+            raise ValueError(f"unknown stream {stream!r}")
+
+        pending = deque()  # type: deque
+        batch = []
+        last = None
+        async for row in rows:
+            ts = row_timestamp(stream, row)
+            if checkpoint is not None and ts <= checkpoint:
+                continue  # 上次已经同步过
+            if len(batch) >= self.batch_size and ts != last:
+                yield self._batch(mac, stream, batch, last, pending)
+                batch = []
+            batch.append(row)
+            last = ts
+        if batch:
+            yield self._batch(mac, stream, batch, last, pending)
+
+    def _batch(
+        self, mac: str, stream: str, rows: List[Any], timestamp: int, pending: deque
+    ) -> SyncBatch:
+        batch = SyncBatch(self, mac, stream, rows, timestamp, pending)
+        pending.append(batch)
+        return batch
+
+    def _ack(self, batch: SyncBatch) -> None:
+        pending = batch._pending
+        timestamp = None
+        while pending and pending[0].acked:
+            timestamp = pending.popleft().timestamp
+        if timestamp is None:
+            return  # 前面还有没确认的批
+        checkpoint = self.store.get(batch.mac, batch.stream)
+        if checkpoint is None or timestamp > checkpoint:
+            self.store.set(batch.mac, batch.stream, timestamp)
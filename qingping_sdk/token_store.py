@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
+"""
+import json
+import os
+from typing import Dict, Optional, TypedDict
+
+DEFAULT_TOKEN_PATH = os.path.join(
+    os.path.expanduser("~"), ".qingping_sdk", "tokens.json"
+)
+
+
+class StoredToken(TypedDict):
+    access_token: str
+    expires_at: float  # 过期时间 unix时间戳 单位s
+
+
+class TokenStore:
+    """access_token持久化接口,按app_key区分不同账号"""
+
+    def load(self, app_key: str) -> Optional[StoredToken]:
+        raise NotImplementedError
+
+    def save(self, app_key: str, token: StoredToken) -> None:
+        raise NotImplementedError
+
+
+class MemoryTokenStore(TokenStore):
+    """保存在进程内存里,ClientPool淘汰掉的租户再次使用时不用重新认证"""
+
+    def __init__(self):
+        self._data = {}  # type: Dict[str, StoredToken]
+
+    def load(self, app_key: str) -> Optional[StoredToken]:
+        return self._data.get(app_key)
+
+    def save(self, app_key: str, token: StoredToken) -> None:
+        self._data[app_key] = token
+
+
+class FileTokenStore(TokenStore):
+    def __init__(self, path: str = None):
+        """
+        保存在本地json文件里,短命的worker和命令行可以复用还没过期的token
+        :param path: 文件路径 默认 ~/.qingping_sdk/tokens.json
+        """
+        self.path = path or DEFAULT_TOKEN_PATH
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def load(self, app_key: str) -> Optional[StoredToken]:
+        return self._read().get(app_key)
+
+    def save(self, app_key: str, token: StoredToken) -> None:
+        data = self._read()
+        data[app_key] = token
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with open(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)  # 原子替换,其他进程不会读到写了一半的文件
@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-from typing import List, Optional, TypedDict
+from typing import List, Optional, TypedDict, Union
 
 
 # {'access_token': 'xxx',
@@ -122,3 +122,19 @@ class Profile(TypedDict):
 class DeviceInfoResponse(TypedDict):
     total: int  # 总条数
     profiles: List[Profile]  # 数据正文
+
+
+class PushSignature(TypedDict):
+    signature: str  # hmac-sha256(app_secret, timestamp + token) 的十六进制
+    timestamp: int  # 推送时间 单位s
+    token: str  # 随机串
+
+
+class PushPayload(TypedDict):
+    info: DeviceInfo  # 设备信息
+    data: List[Union[DeviceData, Event]]  # 数据推送是DeviceData,事件推送带alert_config
+
+
+class PushMessage(TypedDict):
+    signature: Optional[PushSignature]
+    payload: PushPayload
@@ -2,8 +2,149 @@
 """
 Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
 """
+import re
+import threading
+import time
 from base64 import b64encode
+from typing import List
+
+_timestamp_lock = threading.Lock()
+_last_timestamp = 0
+
+_JSON_CONTENT_TYPE = re.compile(r"^application/(?:[\w.+-]+?\+)?json")
+_STRUCTURAL = re.compile(rb'["{}\[\],:]')
+_STRING_SPECIAL = re.compile(rb'["\\]')
 
 
 def create_auth(app_key: str, app_secret: str) -> str:
     return b64encode(app_key.encode() + b":" + app_secret.encode()).decode()
+
+
+def make_timestamp() -> int:
+    """
+    毫秒级时间戳(13位),进程内严格递增
+    同一毫秒内的并发请求也会拿到不同的值,避免被服务端当作重复请求
+    """
+    global _last_timestamp
+    with _timestamp_lock:
+        now = int(time.time() * 1000)
+        if now <= _last_timestamp:
+            now = _last_timestamp + 1
+        _last_timestamp = now
+        return now
+
+
+def is_json_content_type(content_type: str) -> bool:
+    """和aiohttp的resp.json一致的content-type判断"""
+    return _JSON_CONTENT_TYPE.match(content_type) is not None
+
+
+class JSONArrayStream:
+    """
+    增量扫描json文本,取出顶层对象里某个数组字段的每个元素的原始bytes
+    只找结构字符,不做完整解析;已经吐出的部分会被丢弃,内存占用只和单个元素大小有关
+    """
+
+    __slots__ = (
+        "_key",
+        "_buf",
+        "_pos",
+        "_depth",
+        "_in_string",
+        "_string_start",
+        "_last_string",
+        "_expect_array",
+        "_in_array",
+        "_item_start",
+        "done",
+    )
+
+    def __init__(self, key: str):
+        """
+        :param key: 顶层对象里数组字段的名字,例如"devices"
+        """
+        self._key = key.encode()
+        self._buf = bytearray()
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._string_start = 0
+        self._last_string = None
+        self._expect_array = False
+        self._in_array = False
+        self._item_start = 0
+        self.done = False
+
+    def feed(self, data: bytes) -> List[bytes]:
+        """
+        喂入一块数据
+        :param data:
+        :return: 这块数据里凑齐的数组元素
+        """
+        buf = self._buf
+        buf += data
+        items = []
+        pos = self._pos
+        while True:
+            if self._in_string:
+                m = _STRING_SPECIAL.search(buf, pos)
+                if m is None:
+                    pos = len(buf)
+                    break
+                pos = m.start()
+                if buf[pos] == 0x5C:  # \
+                    if pos + 1 >= len(buf):
+                        break  # 转义的字符还没到
+                    pos += 2
+                    continue
+                self._in_string = False
+                if self._depth == 1:
+                    self._last_string = bytes(buf[self._string_start : pos])
+                pos += 1
+                continue
+            m = _STRUCTURAL.search(buf, pos)
+            if m is None:
+                pos = len(buf)
+                break
+            pos = m.start()
+            c = buf[pos]
+            if c == 0x22:  # "
+                self._in_string = True
+                self._string_start = pos + 1
+                self._expect_array = False
+            elif c == 0x3A:  # :
+                if self._depth == 1:
+                    self._expect_array = self._last_string == self._key
+            elif c == 0x7B or c == 0x5B:  # { [
+                if c == 0x5B and self._expect_array and self._depth == 1:
+                    self._in_array = True
+                    self._item_start = pos + 1
+                self._expect_array = False
+                self._depth += 1
+            elif c == 0x7D or c == 0x5D:  # } ]
+                if self._in_array and self._depth == 2:
+                    item = bytes(buf[self._item_start : pos].strip())
+                    if item:
+                        items.append(item)
+                    self._in_array = False
+                    self.done = True
+                self._depth -= 1
+            else:  # ,
+                if self._in_array and self._depth == 2:
+                    items.append(bytes(buf[self._item_start : pos].strip()))
+                    self._item_start = pos + 1
+                self._expect_array = False
+            pos += 1
+        # 丢掉已经处理完的部分
+        keep = pos
+        if self._in_array:
+            keep = min(keep, self._item_start)
+        if self._in_string:
+            keep = min(keep, self._string_start)
+        if keep:
+            del buf[:keep]
+            pos -= keep
+            self._item_start -= keep
+            self._string_start -= keep
+        self._pos = pos
+        return items
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""
+Copyright (c) 2008-2024 synodriver <diguohuangjiajinweijun@gmail.com>
+"""
+import asyncio
+import hashlib
+import hmac
+import inspect
+import json
+import secrets
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Iterable, List, Optional, Union
+
+import aiohttp
+from aiohttp import web
+
+from qingping_sdk import models
+from qingping_sdk.typing import DeviceData, DeviceInfo, Event, PushMessage
+
+DEFAULT_PATH = "/qingping/push"
+
+
+@dataclass
+class PushRecord:
+    mac: str
+    info: DeviceInfo
+    data: List[DeviceData] = field(default_factory=list)
+    events: List[Event] = field(default_factory=list)  # 带alert_config的是事件推送
+
+
+Sink = Callable[[List[PushRecord]], Union[None, Awaitable[Any]]]
+
+
+def sign(app_secret: str, timestamp: int, token: str) -> str:
+    """推送签名 hmac-sha256(app_secret, timestamp + token)"""
+    return hmac.new(
+        app_secret.encode(), f"{timestamp}{token}".encode(), hashlib.sha256
+    ).hexdigest()
+
+
+def verify_signature(
+    app_secret: str, message: PushMessage, max_age: float = None
+) -> bool:
+    """
+    校验推送的签名
+    :param app_secret:
+    :param message:
+    :param max_age: 推送时间和本机时间最多差多少秒,防止重放 None表示不检查
+    :return:
+    """
+    signature = message.get("signature")
+    if not isinstance(signature, dict):
+        return False
+    try:
+        timestamp = int(signature["timestamp"])
+        expected = sign(app_secret, timestamp, signature["token"])
+        ok = hmac.compare_digest(expected, str(signature["signature"]))
+    except (KeyError, TypeError, ValueError):
+        return False
+    return ok and (max_age is None or abs(time.time() - timestamp) <= max_age)
+
+
+def decode_push(message: PushMessage, use_models: bool = False) -> PushRecord:
+    """
+    把推送拆成数据和事件
+    :param message:
+    :param use_models: 返回qingping_sdk.models中的紧凑模型而不是dict
+    :return:
+    """
+    payload = message["payload"]
+    info = payload.get("info") or {}
+    items = payload.get("data") or []
+    if isinstance(items, dict):
+        items = [items]
+    record = PushRecord(info.get("mac"), info)
+    for item in items:
+        if "alert_config" in item:
+            record.events.append(models.Event(item) if use_models else item)
+        else:
+            record.data.append(models.DeviceData(item) if use_models else item)
+    if use_models:
+        record.info = models.DeviceInfo(info)
+    return record
+
+
+class WebhookReceiver:
+    def __init__(
+        self,
+        sink: Sink,
+        app_secret: str = None,
+        queue_size: int = 10000,
+        batch_size: int = 100,
+        batch_interval: float = 1.0,
+        max_age: float = 300,
+        use_models: bool = False,
+        path: str = DEFAULT_PATH,
+        loads: Callable[[bytes], Any] = json.loads,
+    ):
+        """
+        接收青萍的数据推送,先放进有界队列,再按条数或者时间窗口批量交给sink
+        队列满了直接返回503,由推送方稍后重试,不会无限占用内存
+        :param sink: sink(records) 可以是同步函数也可以是协程函数
+        :param app_secret: 设置了就校验签名
+        :param queue_size: 队列里最多有多少条推送
+        :param batch_size: 每批最多多少条
+        :param batch_interval: 第一条到达后最多等多久凑满一批 单位s
+        :param max_age: 签名时间戳允许的误差 单位s
+        :param use_models: 返回qingping_sdk.models中的紧凑模型而不是dict
+        :param path: 接收推送的路径
+        :param loads: 可以直接吃bytes的json解码函数
+        """
+        self.sink = sink
+        self.app_secret = app_secret
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.max_age = max_age
+        self.use_models = use_models
+        self.path = path
+        self.loads = loads
+
+        self.received = 0
+        self.shed = 0  # 队列满了被拒绝的推送
+        self.rejected = 0  # 格式或者签名不对的推送
+        self.batches = 0
+        self.sink_errors = 0
+        self._queue = deque()  # type: deque
+        self._wakeup = None  # type: Optional[asyncio.Event]
+        self._worker = None  # type: Optional[asyncio.Task]
+        self._first_at = 0.0  # 队列从空变成非空的时间,凑批窗口从这里开始
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        app.on_startup.append(self._on_startup)
+        app.on_cleanup.append(self._on_cleanup)
+        return app
+
+    async def _on_startup(self, app: web.Application) -> None:
+        self.start()
+
+    async def _on_cleanup(self, app: web.Application) -> None:
+        await self.close()
+
+    def start(self) -> None:
+        self._wakeup = asyncio.Event()
+        self._worker = asyncio.get_running_loop().create_task(self._work())
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self._worker is None:  # 没有start或者已经close,没有人消费队列
+            return web.Response(
+                status=503, text="not started", headers={"Retry-After": "1"}
+            )
+        try:
+            message = self.loads(await request.read())
+            if self.app_secret is not None and not verify_signature(
+                self.app_secret, message, self.max_age
+            ):
+                self.rejected += 1
+                return web.Response(status=401, text="bad signature")
+            record = decode_push(message, self.use_models)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            self.rejected += 1
+            return web.Response(status=400, text="bad payload")
+        if len(self._queue) >= self.queue_size:
+            self.shed += 1
+            return web.Response(status=503, text="busy", headers={"Retry-After": "1"})
+        self.received += 1
+        if not self._queue:
+            self._first_at = asyncio.get_running_loop().time()
+            self._wakeup.set()
+        self._queue.append(record)
+        if len(self._queue) >= self.batch_size:
+            self._wakeup.set()
+        return web.Response(text="ok")
+
+    async def _work(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            # 每个窗口只发一批,sink处理期间到达的推送开始新的窗口,不会被立刻拆成小批
+            while len(self._queue) < self.batch_size:
+                remaining = self._first_at + self.batch_interval - loop.time()
+                if remaining <= 0:
+                    break
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            await self._send(self._take(self.batch_size))
+
+    def _take(self, count: int) -> list:
+        queue = self._queue
+        batch = [queue.popleft() for _ in range(min(count, len(queue)))]
+        if queue:  # 没发完的从现在开始新的窗口
+            self._first_at = asyncio.get_running_loop().time()
+        return batch
+
+    async def _send(self, batch: list) -> None:
+        self.batches += 1
+        try:
+            ret = self.sink(batch)
+            if inspect.isawaitable(ret):
+                await ret
+        except Exception:
+            self.sink_errors += 1
+
+    async def flush(self) -> None:
+        """把调用时队列里已有的推送交给sink,期间新到的留给后面的窗口"""
+        pending = len(self._queue)
+        while pending > 0 and self._queue:
+            batch = self._take(min(self.batch_size, pending))
+            pending -= len(batch)
+            await self._send(batch)
+
+    async def close(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        await self.flush()
+
+
+def build_push(
+    info: DeviceInfo, data: List[Union[DeviceData, Event]], app_secret: str = None
+) -> PushMessage:
+    """
+    构造一条推送,配合replay在本地测试
+    :param info: 设备信息,至少要有mac
+    :param data:
+    :param app_secret: 设置了就带上签名
+    :return:
+    """
+    message = {"payload": {"info": info, "data": data}}
+    if app_secret is not None:
+        timestamp = int(time.time())
+        token = secrets.token_hex(16)
+        message["signature"] = {
+            "signature": sign(app_secret, timestamp, token),
+            "timestamp": timestamp,
+            "token": token,
+        }
+    return message
+
+
+async def replay(
+    url: str,
+    messages: Iterable[PushMessage],
+    client_session: aiohttp.ClientSession = None,
+    concurrency: int = 1,
+) -> List[int]:
+    """
+    把推送依次发给接收端,可以用录下来的推送或者历史数据在本地压测
+    :param url: 接收端地址
+    :param messages:
+    :param client_session:
+    :param concurrency: 同时在途的请求数
+    :return: 每条推送的http状态码
+    """
+    session = client_session or aiohttp.ClientSession()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def post(message: PushMessage) -> int:
+        async with semaphore:
+            async with session.post(url, json=message) as resp:
+                await resp.read()
+                return resp.status
+
+    try:
+        return await asyncio.gather(*(post(message) for message in messages))
+    finally:
+        if client_session is None:
+            await session.close()
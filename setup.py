@@ -40,7 +40,8 @@ def main():
         author_email="diguohuangjiajinweijun@gmail.com",
         maintainer="v-vinson",
         python_requires=">=3.8",
-        install_requires=["aiohttp", "crcmod-plus"],
+        install_requires=["aiohttp"],
+        extras_require={"numpy": ["numpy"]},
         license="GPLv3",
         classifiers=[
             "Development Status :: 3 - Alpha",
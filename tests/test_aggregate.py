@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+from qingping_sdk import Client
+from qingping_sdk.aggregate import BucketAggregator, aggregate_history, np
+from qingping_sdk.connection import decode_history_data, encode_history_data
+
+NAN = float("nan")
+
+
+def row(timestamp, **values):
+    ret = {"timestamp": {"value": timestamp}}
+    for metric, value in values.items():
+        ret[metric] = {"value": value}
+    return ret
+
+
+class TestBucketAggregator(TestCase):
+    def test_rows(self):
+        aggregator = BucketAggregator(300)
+        aggregator.add_rows(
+            [
+                row(0, temperature=20, humidity=50),
+                row(60, temperature=22),
+                row(120, temperature=21, humidity=None),
+                row(900, temperature=25, co2=800),  # 中间空了两个桶
+            ]
+        )
+        buckets = aggregator.emit(600)
+        self.assertEqual([b.start for b in buckets], [0])
+        first = buckets[0]
+        self.assertEqual(
+            first["temperature"].to_dict(),
+            {"count": 3, "min": 20, "max": 22, "mean": 21, "last": 21},
+        )
+        self.assertEqual(first["humidity"].count, 1)
+        self.assertNotIn("co2", first)
+        self.assertEqual(aggregator.emit(600), [])
+        # 迟到的数据更新已经输出过的桶
+        aggregator.add(30, {"temperature": 30})
+        self.assertEqual(aggregator.emit(600)[0]["temperature"].max, 30)
+        self.assertEqual(aggregator.emit()[0].start, 900)
+        self.assertEqual(
+            aggregator.series("temperature", "max"),
+            ([0, 300, 600, 900], [30, None, None, 25]),
+        )
+
+    def test_retention(self):
+        aggregator = BucketAggregator(60, retention=60)
+        aggregator.add(0, {"temperature": 1})
+        aggregator.add(200, {"temperature": 1})
+        aggregator.emit(180)
+        self.assertEqual(sorted(aggregator.buckets), [180])
+        aggregator.add(10, {"temperature": 2})
+        self.assertEqual(aggregator.dropped, 1)
+        aggregator.add(130, {"temperature": 2})  # 还在保留期内
+        self.assertEqual(aggregator.dropped, 1)
+
+    def test_records(self):
+        temperature = [20.0, 21.0, 22.0, 23.0, 24.0, 25.0]
+        payload = encode_history_data(
+            600, 120, temperature, [50] * 6, [101.3] * 6, [90] * 6
+        )
+        results = []
+        for use_numpy in (False, True) if np is not None else (False,):
+            records = decode_history_data(payload, use_numpy=use_numpy)
+            records.temperature[2] = NAN
+            aggregator = BucketAggregator(300, metrics=("temperature", "battery"))
+            aggregator.add_records(records)
+            results.append([b.to_dict() for b in aggregator.emit()])
+        self.assertEqual(results[0], results[-1])
+        self.assertEqual([b["start"] for b in results[0]], [600, 900, 1200])
+        self.assertEqual(results[0][0]["temperature"]["count"], 2)
+        self.assertEqual(results[0][0]["battery"]["count"], 3)
+        self.assertEqual(results[0][0]["temperature"]["last"], 21.0)
+        self.assertAlmostEqual(results[0][1]["temperature"]["mean"], 23.5)
+
+
+class TestAggregateHistory(IsolatedAsyncioTestCase):
+    async def test_stream(self):
+        client = Client("key", "secret")
+        rows = [row(t, temperature=t / 60) for t in range(0, 3600, 60)]
+
+        async def send_once(method, url, params=None, json=None):
+            offset, limit = params.get("offset", 0), params.get("limit", 200)
+            return {"total": len(rows), "data": rows[offset : offset + limit]}
+
+        client._send_once = send_once
+        buckets = [b async for b in aggregate_history(client, "m", 0, 3600, 900)]
+        self.assertEqual([b.start for b in buckets], [0, 900, 1800, 2700])
+        self.assertEqual([b["temperature"].count for b in buckets], [15] * 4)
+        self.assertEqual(buckets[-1]["temperature"].last, 59)
+        await client.aclose()
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from qingping_sdk.archive import HistoryArchive
+from qingping_sdk.connection import (
+    build_history_data,
+    decode_history_data,
+    encode_history_data,
+)
+
+
+def records(start: int, count: int):
+    return [
+        bytes([i % 256, 0x40, 0x2A, 0x10, 0x27, 90])
+        for i in range(start, start + count)
+    ]
+
+
+class TestHistoryArchive(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.archive = HistoryArchive(self.directory)
+
+    def tearDown(self):
+        self.archive.close()
+        shutil.rmtree(self.directory)
+
+    def test_append_merge(self):
+        self.assertEqual(
+            self.archive.append("m", build_history_data(1000, 60, records(0, 10))), 10
+        )
+        # 和最后一条重叠,重叠部分跳过,剩下的接在同一段后面
+        self.assertEqual(
+            self.archive.append("m", build_history_data(1540, 60, records(9, 11))), 10
+        )
+        self.assertEqual(
+            self.archive.append("m", build_history_data(1000, 60, records(0, 5))), 0
+        )
+        self.assertEqual(
+            self.archive.append("m", build_history_data(5000, 60, records(20, 5))), 5
+        )
+        reader = self.archive.reader("m")
+        self.assertEqual(reader.entries, [(1000, 60, 20, 0), (5000, 60, 5, 120)])
+        self.assertEqual(os.path.getsize(os.path.join(self.directory, "m.idx")), 36)
+        self.assertEqual(len(reader), 25)
+        self.assertEqual((reader.first, reader.last), (1000, 5240))
+        self.archive.append("m", build_history_data(5300, 60, records(25, 1)))
+        self.assertIsNone(reader._mmap)  # 追加后旧的映射被关闭
+        self.assertEqual(self.archive.reader("m").last, 5300)
+
+    def test_append_before_tail(self):
+        self.archive.append("m", build_history_data(1493, 30, records(0, 2)))
+        # 前两条比已有的段还早,不能和重叠部分一起跳过
+        self.assertEqual(
+            self.archive.append("m", build_history_data(1433, 30, records(10, 4))), 2
+        )
+        # 两边都超出,只和最后写入的1433那段比较,1493 1523重复写入,compact时保留先写的
+        self.assertEqual(
+            self.archive.append("m", build_history_data(1373, 30, records(20, 8))), 6
+        )
+        reader = self.archive.reader("m")
+        self.assertFalse(reader.sorted)
+        self.assertEqual(self.archive.compact("m"), 8)
+        segments = self.archive.range("m", 0, 10**9)
+        self.assertEqual([(t, i, len(v) // 6) for t, i, v in segments], [(1373, 30, 8)])
+        self.assertEqual(
+            [bytes(segments[0][2][i * 6 : i * 6 + 6])[0] for i in range(8)],
+            [20, 21, 10, 11, 0, 1, 26, 27],
+        )
+
+    def test_range(self):
+        self.archive.append("m", build_history_data(1000, 60, records(0, 20)))
+        self.archive.append("m", build_history_data(5000, 60, records(20, 5)))
+        segments = self.archive.range("m", 1090, 5060)
+        self.assertEqual(
+            [(t, i, len(v) // 6) for t, i, v in segments],
+            [(1120, 60, 18), (5000, 60, 2)],
+        )
+        self.assertIsInstance(segments[0][2], memoryview)
+        self.assertEqual(bytes(segments[0][2][:6]), records(2, 1)[0])
+        self.assertEqual(self.archive.range("m", 2500, 4000), [])
+        self.assertEqual(self.archive.range("other", 0, 10**9), [])
+        # 拼上头部就能交给decode_history_data
+        t, internal, view = segments[1]
+        decoded = decode_history_data(
+            t.to_bytes(4, "little") + internal.to_bytes(2, "little") + view
+        )
+        self.assertEqual(list(decoded.timestamp), [5000, 5060])
+
+    def test_reopen_and_compact(self):
+        payload = encode_history_data(
+            1000, 60, [20.5, 21.0, 21.5], [50, 51, 52], [101.3] * 3, [90] * 3
+        )
+        self.archive.append("m", build_history_data(2000, 60, records(0, 3)))
+        self.archive.append("m", payload)  # 乱序
+        self.archive.append("m", build_history_data(2060, 30, records(5, 2)))
+        self.archive.close()
+        archive = HistoryArchive(self.directory)
+        reader = archive.reader("m")
+        self.assertFalse(reader.sorted)
+        # 2060有两条,compact之前都会返回
+        self.assertEqual(sum(len(v) for _, _, v in reader.range(1000, 2060)) // 6, 6)
+        held = reader.range(2000, 2000)[0][2]  # 还拿着查询结果时也能compact
+        self.assertEqual(archive.compact("m", before=1060), 6)
+        self.assertEqual(bytes(held), records(0, 1)[0])
+        reader = archive.reader("m")
+        self.assertTrue(reader.sorted)
+        self.assertEqual(
+            reader.entries, [(1060, 60, 2, 0), (2000, 60, 2, 12), (2090, 30, 2, 24)]
+        )
+        self.assertEqual(bytes(reader.range(1060, 1060)[0][2]), payload[12:18])
+        archive.close()
+
+    def test_invalid_mac(self):
+        with self.assertRaises(ValueError):
+            self.archive.reader("../x")
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
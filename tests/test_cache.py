@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+from qingping_sdk import Client
+from qingping_sdk.cache import FRESH, MISS, STALE, ResponseCache
+
+
+class TestResponseCache(TestCase):
+    def test_lru(self):
+        cache = ResponseCache(maxsize=2)
+        cache.set(("alert", "a"), 1)
+        cache.set(("alert", "b"), 2)
+        cache.get(("alert", "a"))
+        cache.set(("alert", "c"), 3)
+        self.assertEqual(cache.get(("alert", "a")), (FRESH, 1))
+        self.assertEqual(cache.get(("alert", "b")), (MISS, None))
+        self.assertEqual(len(cache), 2)
+
+    def test_stale(self):
+        cache = ResponseCache(ttl={"alert": 1e-9}, stale_ttl=3600)
+        cache.set(("alert", "a"), 1)
+        self.assertEqual(cache.get(("alert", "a")), (STALE, 1))
+        cache.stale_ttl = 0
+        self.assertEqual(cache.get(("alert", "a")), (MISS, None))
+
+    def test_invalidate(self):
+        cache = ResponseCache()
+        cache.set(("alert", "a"), 1, ["alert:a"])
+        cache.set(("device_info", ("a", "b"), ("sn",)), 2, ["device:a", "device:b"])
+        generation = cache.generation
+        cache.invalidate("device:b")
+        self.assertEqual(cache.get(("alert", "a")), (FRESH, 1))
+        self.assertEqual(cache.get(("device_info", ("a", "b"), ("sn",)))[0], MISS)
+        cache.set(("groups",), 3, generation=generation)
+        self.assertEqual(cache.get(("groups",))[0], MISS)
+
+
+class TestClientCache(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.cache = ResponseCache()
+        self.client = Client("key", "secret", cache=self.cache)
+        self.sent = []
+
+        async def send_once(method, url, params=None, json=None):
+            self.sent.append((method, url))
+            return {"n": len(self.sent)}
+
+        self.client._send_once = send_once
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+
+    async def test_invalidate_on_write(self):
+        self.assertEqual(await self.client.get_alert("a"), {"n": 1})
+        self.assertEqual(await self.client.get_alert("a"), {"n": 1})
+        await self.client.delete_alert("a", [1])
+        self.assertEqual(await self.client.get_alert("a"), {"n": 3})
+
+    async def test_stale_while_revalidate(self):
+        self.cache.ttl["groups"] = 1e-9
+        self.cache.stale_ttl = 3600
+        self.assertEqual(await self.client.get_groups(), {"n": 1})
+        self.assertEqual(await self.client.get_groups(), {"n": 1})
+        # 后台刷新经过合并请求时多了一层task,sleep(0)不能保证它已经完成,直接等待刷新任务
+        await asyncio.gather(*self.client._revalidating.values())
+        self.assertEqual(len(self.sent), 2)
+        self.assertEqual(self.cache.get(("groups",)), (STALE, {"n": 2}))
+
+    async def test_devices(self):
+        async def send_once(method, url, params=None, json=None):
+            self.sent.append((method, url))
+            return {
+                "total": 1,
+                "devices": [{"info": {"mac": "a"}, "data": {"n": len(self.sent)}}],
+            }
+
+        self.client._send_once = send_once
+        # 实时读数不缓存
+        self.assertEqual(
+            (await self.client.get_devices())["devices"][0]["data"]["n"], 1
+        )
+        self.assertEqual(
+            (await self.client.get_devices())["devices"][0]["data"]["n"], 2
+        )
+        info = await self.client.get_devices_info()
+        self.assertEqual(info, {"total": 1, "devices": [{"info": {"mac": "a"}}]})
+        # 命中时返回缓存里的同一个对象
+        self.assertIs(await self.client.get_devices_info(), info)
+        self.assertEqual(len(self.sent), 3)
+
+
+class TestCoalesce(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.client = Client("key", "secret")
+        self.sent = []
+
+        async def send_once(method, url, params=None, json=None):
+            self.sent.append(params)
+            await asyncio.sleep(0.01)
+            return {"n": len(self.sent)}
+
+        self.client._send_once = send_once
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+
+    async def test_coalesce(self):
+        ret = await asyncio.gather(
+            *[self.client.get_alert("a") for _ in range(10)],
+            self.client.get_alert("b"),
+        )
+        self.assertEqual(len(self.sent), 2)
+        self.assertEqual(ret[:10], [{"n": 2}] * 10)
+        # 合并的调用方拿到的是同一个对象
+        self.assertTrue(all(item is ret[0] for item in ret[:10]))
+        self.assertEqual(await self.client.get_alert("a"), {"n": 3})
+
+    async def test_cancel_one_caller(self):
+        first = asyncio.ensure_future(self.client.get_groups())
+        second = asyncio.ensure_future(self.client.get_groups())
+        await asyncio.sleep(0)
+        first.cancel()
+        self.assertEqual(await second, {"n": 1})
+        self.assertEqual(len(self.sent), 1)
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+import math
+from unittest import TestCase, skipIf
+
+from qingping_sdk.columns import HistoryColumns, np
+
+PAGES = [
+    [
+        {
+            "timestamp": {"value": 1000 + i},
+            "temperature": {"value": 20.5 + i},
+            "humidity": {"value": 50},
+            "co2": {"value": 400} if i % 2 else None,
+        }
+        for i in range(start, start + 200)
+    ]
+    for start in range(0, 1000, 200)
+]
+
+
+class TestHistoryColumns(TestCase):
+    def check(self, columns: HistoryColumns):
+        for page in PAGES:
+            columns.extend(page)
+        self.assertEqual(len(columns), 1000)
+        self.assertEqual(list(columns.timestamp[:3]), [1000, 1001, 1002])
+        self.assertEqual(columns["temperature"][999], 1019.5)
+        self.assertTrue(math.isnan(columns["co2"][0]))
+        self.assertEqual(columns["co2"][1], 400)
+        self.assertTrue(all(math.isnan(v) for v in columns["pm25"]))
+        self.assertEqual(len(columns.columns()["battery"]), 1000)
+
+    def test_array(self):
+        self.check(HistoryColumns(use_numpy=False))
+
+    @skipIf(np is None, "numpy is not installed")
+    def test_numpy(self):
+        columns = HistoryColumns(use_numpy=True)
+        self.check(columns)
+        self.assertEqual(columns["humidity"].dtype, np.float64)
+        self.assertEqual(int(np.isnan(columns["co2"]).sum()), 500)
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
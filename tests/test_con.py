@@ -1,7 +1,16 @@
 # -*- coding: utf-8 -*-
 from unittest import TestCase
+from unittest.mock import patch
 
-from qingping_sdk import Connection, Event, build_history_data, parse_history_data
+from qingping_sdk import (
+    Connection,
+    Event,
+    build_history_data,
+    decode_history_data,
+    encode_history_data,
+    parse_history_data,
+)
+from qingping_sdk.connection import FrameEncoder, TLVWriter, np
 
 data = bytes.fromhex(
     "43 47 31 1F 01 01 10 00 A9 F4 9F 95 FF 08 B48B 9C AB 35 8F D3 49 46 E5 02 10 00 45 30 33 30 31 35 44 37 34 39 44 45 36 32 36 35 03 F6 00 B6 88 77 5C 05 00 9A C2 2F 66 27 4E 9A C2 2F 67 27 4E 9A C2 2F 66 27 4E 9A C2 2F 66 27 4E 9A C2 2F 66 27 4E 9A C2 2F 65 27 4E 9A C2 2F 66 27 4E 9A C2 2F 66 27 4E 9A C2 2F 66 27 4E 9A C2 2F 65 27 4E 9A C2 2F 65 27 4E 9A C2 2F 66 27 4E 9A C2 2F 65 27 4E 9A C2 2F 66 27 4E 9A C2 2F 66 27 4E 9A C2 2F 66 27 4E 9A C2 2F 66 27 4E 9A C2 2F 65 27 4E 9A C2 2F 65 27 4E 9A C2 2F 65 27 4E 9A C2 2F 66 27 4E 9A C2 2F 65 27 4E 9A C2 2F 65 27 4E 9A C2 2F 65 27 4E 9A C2 2F 65 27 4E 9A C2 2F 65 27 4E 9A C2 2F 65 27 4E 9A C2 2F 65 27 4E 9A C2 2F 66 27 4E 9A C2 2F 65 27 4E 9A C2 2F 66 27 4E 9A C2 2F 65 27 4E 9A C2 2F 65 27 4E 9A C2 2F 65 27 4E 9A C2 2F 65 27 4E 9A C2 2F 65 27 4E 9A C2 2F 65 27 4E 9A C2 2F 65 27 4E 9A C2 2F 66 27 4E 9A C2 2F 66 27 4E D3 70".strip()
@@ -23,3 +32,136 @@ class TestCon(TestCase):
             self.assertEqual(build_history_data(*his), ev.keys[3])
 
             self.assertEqual(ev.to_bytes(), data)
+
+    def test_lazy_keys(self):
+        ev = next(self.con.feed_data(data))
+        self.assertFalse(hasattr(ev, "__dict__"))
+        self.assertEqual(sorted(ev.index), [1, 2, 3])
+        self.assertIsInstance(ev.get(3), memoryview)
+        self.assertEqual(ev.get(3), ev.keys[3])
+        self.assertIsNone(ev.get(4))
+        ev.payload = TLVWriter().write(1, b"\x01").write(4, b"abc").getvalue()
+        self.assertEqual(ev.keys, {1: b"\x01", 4: b"abc"})
+
+    def test_checksum(self):
+        ev = next(Connection(copy_payload=True).feed_data(data))
+        ev.checksum = 0
+        self.assertEqual(ev.to_bytes(), data)
+        self.assertEqual(ev.checksum, int.from_bytes(data[-2:], "little"))
+
+        broken = bytearray(data)
+        broken[20] ^= 0xFF
+        stream = b"xxC" + bytes(broken) + b"GC" + data + data[:-1] + b"\x00" + data
+        con = Connection(verify_checksum=True)
+        events = list(con.feed_data(stream))
+        self.assertEqual([ev.to_bytes() for ev in events], [data, data])
+        self.assertEqual(con.checksum_errors, 2)
+        self.assertEqual(con.discarded_bytes, 5 + 2 * len(data))
+
+        # 默认不校验
+        self.assertEqual(len(list(self.con.feed_data(bytes(broken) + data))), 2)
+
+    def test_bad_length(self):
+        # 长度字段的高字节坏成0xFF,不能一直等这一帧的数据
+        broken = bytearray(data)
+        broken[4] = 0xFF
+        con = Connection(verify_checksum=True, max_frame_size=4096)
+        events = list(con.feed_data(bytes(broken) + data * 20))
+        self.assertEqual(len(events), 20)
+        self.assertEqual(con.length_errors, 1)
+        self.assertEqual(con.checksum_errors, 0)
+
+        # 默认不限制长度,几百条记录的历史数据帧不会被丢弃
+        big = Event(b"CG", 0x41, 0, b"", 0)
+        big.keys = {3: build_history_data(0, 60, [b"\x00" * 6] * 700)}
+        frame = big.to_bytes()
+        self.assertGreater(len(frame), 4096)
+        events = list(self.con.feed_data(frame))
+        self.assertEqual([ev.to_bytes() for ev in events], [frame])
+        self.assertEqual(self.con.discarded_bytes, 0)
+
+    def test_send_many(self):
+        ev = next(Connection(copy_payload=True).feed_data(data))
+        other = Event(b"CG", 0x32, 0, b"", 0)
+        other.keys = {1: b"\x00"}
+        frames = self.con.send_many([ev, other, ev])
+        self.assertEqual(bytes(frames), data + other.to_bytes() + data)
+        frames.release()
+
+        encoder = FrameEncoder(buffer_size=8)
+        views = encoder.encode_views([ev, other])
+        self.assertEqual([bytes(v) for v in views], [data, other.to_bytes()])
+        encoder.encode_many([other] * 10)  # 上一次的结果还被持有,不能覆盖
+        self.assertEqual([bytes(v) for v in views], [data, other.to_bytes()])
+
+    def test_feed_split(self):
+        con = Connection(buffer_size=16, copy_payload=True)
+        events = []
+        for i in range(0, len(data) * 3, 7):
+            events.extend(con.feed_data((data * 3)[i : i + 7]))
+        self.assertEqual(len(events), 3)
+        for ev in events:
+            self.assertEqual(ev.to_bytes(), data)
+
+    def test_buffer_updated(self):
+        con = Connection(buffer_size=8)
+        stream = data * 5
+        events = []
+        pos = 0
+        while pos < len(stream):
+            buf = con.get_buffer(100)
+            size = min(len(buf), len(stream) - pos, 100)
+            buf[:size] = stream[pos : pos + size]
+            pos += size
+            for ev in con.buffer_updated(size):
+                self.assertIsInstance(ev.payload, memoryview)
+                events.append(ev.to_bytes())
+        self.assertEqual(events, [data] * 5)
+
+    def test_decode_history(self):
+        ev = next(self.con.feed_data(data))
+        payload = ev.keys[3]
+        time, internal, history = parse_history_data(payload)
+        for use_numpy in (False, True) if np is not None else (False,):
+            records = decode_history_data(payload, use_numpy)
+            self.assertEqual(len(records), len(history))
+            self.assertEqual(records.timestamp[1], time + internal)
+            self.assertEqual(records.temperature[0], 26.4)
+            self.assertEqual(records.humidity[0], 66.6)
+            self.assertEqual(records.pressure[0], 100.86)
+            self.assertEqual(records.battery[0], 78)
+            self.assertEqual(
+                encode_history_data(
+                    records.time,
+                    records.internal,
+                    records.temperature,
+                    records.humidity,
+                    records.pressure,
+                    records.battery,
+                ),
+                payload,
+            )
+
+    def test_encode_history(self):
+        temperature = [-50.0, -12.3, 0.0, 26.4, 359.5]
+        humidity = [0.0, 33.3, 50.0, 66.6, 100.0]
+        pressure = [0.0, 90.5, 100.86, 101.3, 655.35]
+        battery = [0, 1, 50, 78, 100]
+        args = (1000, 60, temperature, humidity, pressure, battery)
+        payload = encode_history_data(*args, use_numpy=False)
+        if np is not None:
+            self.assertEqual(encode_history_data(*args, use_numpy=True), payload)
+        records = decode_history_data(payload, use_numpy=False)
+        self.assertEqual(list(records.temperature), temperature)
+        self.assertEqual(list(records.pressure), pressure)
+        for use_numpy in (False, True) if np is not None else (False,):
+            for bad in ([-50.1], [360.0], [float("nan")]):
+                with self.assertRaises(ValueError):
+                    encode_history_data(0, 60, bad, [0], [0], [0], use_numpy)
+            with self.assertRaises(ValueError):
+                encode_history_data(0, 60, [0], [0], [0], [256], use_numpy)
+        with patch("qingping_sdk.connection.np", None):
+            with self.assertRaises(ImportError):
+                decode_history_data(payload, use_numpy=True)
+            with self.assertRaises(ImportError):
+                encode_history_data(*args, use_numpy=True)
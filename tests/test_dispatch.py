@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+
+from qingping_sdk import Connection, Event
+from qingping_sdk.dispatch import Dispatcher
+
+
+def make_frame(cmd: int, fields: dict) -> bytes:
+    ev = Event(b"CG", cmd, 0, b"", 0)
+    ev.keys = fields
+    return ev.to_bytes()
+
+
+class TestDispatcher(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.dispatcher = Dispatcher(workers=2, queue_size=2)
+
+    async def asyncTearDown(self):
+        await self.dispatcher.close()
+
+    async def test_dispatch(self):
+        seen = []
+        slow = []
+        release = asyncio.Event()
+
+        @self.dispatcher.on(0x31, keys=[1, 9])
+        def on_data(event, fields, context):
+            seen.append((context, bytes(fields[1]), fields[9]))
+
+        @self.dispatcher.on(0x32, keys=[2])
+        async def on_slow(event, fields, context):
+            await release.wait()
+            slow.append(fields[2])
+
+        con = Connection()
+        stream = (
+            make_frame(0x31, {1: b"a", 2: b"b"})
+            + make_frame(0x33, {1: b"c"})
+            + make_frame(0x32, {2: b"d"}) * 5
+        )
+        for ev in con.feed_data(stream):
+            self.dispatcher.dispatch(ev, "ctx")
+        self.assertEqual(seen, [("ctx", b"a", None)])
+        self.assertEqual(self.dispatcher.unhandled, 1)
+        # 队列只能放2个,其余的被丢弃
+        self.assertEqual(self.dispatcher.dropped, 3)
+        release.set()
+        await self.dispatcher.join()
+        self.assertEqual(slow, [b"d"] * 2)
+
+    async def test_background_sync(self):
+        ret = []
+        self.dispatcher.register(
+            0x31, lambda ev, fields, ctx: ret.append(fields[1]), [1], background=True
+        )
+        self.dispatcher.dispatch(
+            next(Connection().feed_data(make_frame(0x31, {1: b"x"})))
+        )
+        await self.dispatcher.join()
+        self.assertEqual(ret, [b"x"])
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
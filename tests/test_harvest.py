@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+
+from qingping_sdk import Client
+from qingping_sdk.exceptions import ServerException
+
+
+class TestHarvest(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.client = Client("key", "secret")
+        self.running = 0
+        self.max_running = 0
+        self.cancelled = []
+
+        async def get_history_data(mac, start_time, end_time, offset=0, limit=200):
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            try:
+                await asyncio.sleep(0.01 if mac != "slow" else 10)
+                if mac == "bad":
+                    raise ServerException("503")
+                if mac == "cancel":
+                    raise asyncio.CancelledError
+                return {"total": 1, "data": [mac]}
+            except asyncio.CancelledError:
+                self.cancelled.append(mac)
+                raise
+            finally:
+                self.running -= 1
+
+        self.client.get_history_data = get_history_data
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+
+    async def test_concurrency(self):
+        macs = [str(i) for i in range(10)]
+        results = dict(
+            [item async for item in self.client.harvest_history_data(macs, 0, 1, 3)]
+        )
+        self.assertEqual(results, {mac: [mac] for mac in macs})
+        self.assertEqual(self.max_running, 3)
+
+    async def test_failure(self):
+        macs = ["a", "bad", "cancel", "b"]
+        results = dict(
+            [item async for item in self.client.harvest_history_data(macs, 0, 1)]
+        )
+        self.assertEqual(results["a"], ["a"])
+        self.assertEqual(results["b"], ["b"])
+        self.assertIsInstance(results["bad"], ServerException)
+        self.assertIsInstance(results["cancel"], asyncio.CancelledError)
+
+    async def test_early_stop(self):
+        harvest = self.client.harvest_history_data(["a", "slow", "slow"], 0, 1, 3)
+        async for mac, rows in harvest:
+            self.assertEqual(mac, "a")
+            break
+        await harvest.aclose()
+        self.assertEqual(self.cancelled, ["slow", "slow"])
+        self.assertEqual(self.running, 0)
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
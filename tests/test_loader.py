@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+
+from qingping_sdk import Client
+from qingping_sdk.loader import BatchLoader
+
+
+class TestBatchLoader(IsolatedAsyncioTestCase):
+    async def test_batch(self):
+        batches = []
+
+        async def batch_fn(keys):
+            batches.append(keys)
+            return {key: key * 2 for key in keys if key != 3}
+
+        loader = BatchLoader(batch_fn, max_batch_size=4)
+        ret = await asyncio.gather(*[loader.load(i) for i in [1, 2, 1, 3, 4, 5]])
+        self.assertEqual(ret, [2, 4, 2, None, 8, 10])
+        self.assertEqual(batches, [[1, 2, 3], [4, 5]])
+
+    async def test_error(self):
+        async def batch_fn(keys):
+            raise ValueError(keys)
+
+        loader = BatchLoader(batch_fn)
+        ret = await asyncio.gather(
+            loader.load(1), loader.load(2), return_exceptions=True
+        )
+        self.assertIsInstance(ret[0], ValueError)
+        self.assertIs(ret[0], ret[1])
+
+    async def test_device_info(self):
+        client = Client("key", "secret")
+        sent = []
+
+        async def send_once(method, url, params=None, json=None):
+            sent.append(json)
+            return {
+                "total": len(json["macList"]),
+                "profiles": [
+                    {"mac": mac, "sn": mac.lower()} for mac in json["macList"]
+                ],
+            }
+
+        client._send_once = send_once
+        ret = await asyncio.gather(
+            client.load_device_info("A", ["sn"]),
+            client.load_device_info("B", ["sn"]),
+            client.load_device_info("C", ["sn", "customization.sn"]),
+        )
+        self.assertEqual([item["sn"] for item in ret], ["a", "b", "c"])
+        self.assertEqual(sorted(len(item["macList"]) for item in sent), [1, 2])
+        await client.aclose()
+
+    async def test_client_params(self):
+        client = Client("key", "secret", batch_delay=0, batch_size=2)
+        sent = []
+
+        async def send_once(method, url, params=None, json=None):
+            sent.append(json["mac"])
+            return {}
+
+        client._send_once = send_once
+        await asyncio.gather(*(client.batch_delete_device(m) for m in "abcde"))
+        self.assertEqual(sent, [["a", "b"], ["c", "d"], ["e"]])
+        await client.aclose()
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
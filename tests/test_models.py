@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import pickle
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+from qingping_sdk import Client, models
+
+DEVICES = {
+    "total": 1,
+    "devices": [
+        {
+            "info": {
+                "name": "room",
+                "mac": "582D34000000",
+                "status": {"offline": False},
+                "product": {"id": 1201, "name": "青萍空气检测仪"},
+                "setting": {"report_interval": 600, "collect_interval": 60},
+                "new_field": 1,
+            },
+            "data": {
+                "timestamp": {"value": 1700000000},
+                "temperature": {"value": 20.5, "level": 0},
+                "co2": {"value": 500, "status": 1},
+            },
+        }
+    ],
+}
+
+
+class TestModels(TestCase):
+    def test_decode(self):
+        resp = models.DeviceResponse(DEVICES)
+        self.assertEqual(resp._pending.keys(), {"devices"})
+        device = resp.devices[0]
+        self.assertIsNone(resp._pending)
+        self.assertEqual(device.info.setting.report_interval, 600)
+        self.assertFalse(device.info.status.offline)
+        self.assertEqual(device.data.temperature.value, 20.5)
+        self.assertIsNone(device.data.pm25)
+        self.assertEqual(device.info.extra, {"new_field": 1})
+        # 兼容dict的读取方式
+        self.assertEqual(resp["devices"][0]["data"]["co2"]["value"], 500)
+        self.assertEqual(device.data.get("pm25", {}), {})
+        self.assertEqual(resp.to_dict(), DEVICES)
+        self.assertEqual(pickle.loads(pickle.dumps(resp)), resp)
+        self.assertFalse(hasattr(device.data.temperature, "__dict__"))
+        with self.assertRaises(AttributeError):
+            device.info.name = "x"
+
+
+class TestClientModels(IsolatedAsyncioTestCase):
+    async def test_use_models(self):
+        client = Client("key", "secret", use_models=True)
+
+        async def send_once(method, url, params=None, json=None):
+            if url.endswith("/devices"):
+                return DEVICES
+            offset = params.get("offset", 0)
+            return {
+                "total": 300,
+                "data": [
+                    {"timestamp": {"value": i}} for i in range(offset, offset + 150)
+                ],
+            }
+
+        client._send_once = send_once
+        resp = await client.get_devices()
+        self.assertIsInstance(resp, models.DeviceResponse)
+        rows = [row async for row in client.iter_history_data("mac", 0, 1, limit=150)]
+        self.assertIsInstance(rows[0], models.DeviceData)
+        self.assertEqual([row.timestamp.value for row in rows], list(range(300)))
+        await client.aclose()
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+
+from qingping_sdk import Client
+
+
+class TestPages(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.client = Client("key", "secret")
+        self.total = 10
+        self.rows = list(range(10))
+        self.requests = []
+        self.running = 0
+        self.max_running = 0
+        self.cancelled = []
+        # 后面的页先返回,检查结果仍然按顺序
+        self.delay = lambda offset: 0.001 * (20 - offset)
+
+        async def send_once(method, url, params=None, json=None):
+            offset, limit = params["offset"], params["limit"]
+            self.requests.append(offset)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            try:
+                await asyncio.sleep(self.delay(offset))
+            except asyncio.CancelledError:
+                self.cancelled.append(offset)
+                raise
+            finally:
+                self.running -= 1
+            key = "devices" if url.endswith("/devices") else "data"
+            page = self.rows[offset : offset + limit]
+            if key == "data":
+                page = [{"timestamp": {"value": row}} for row in page]
+            return {"total": self.total, key: page}
+
+        self.client._send_once = send_once
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+
+    async def test_order(self):
+        rows = [
+            row["timestamp"]["value"]
+            async for row in self.client.iter_history_data("m", 0, 1, 2, 3)
+        ]
+        self.assertEqual(rows, self.rows)
+        self.assertEqual(self.requests, [0, 2, 4, 6, 8])
+        self.assertEqual(self.max_running, 3)
+        devices = [d async for d in self.client.iter_devices(limit=3, concurrency=10)]
+        self.assertEqual(devices, self.rows)
+
+    async def test_events(self):
+        async def get_history_events(mac, start_time, end_time, offset, limit):
+            return {"total": 3, "events": list(range(offset, min(offset + limit, 3)))}
+
+        self.client.get_history_events = get_history_events
+        events = [e async for e in self.client.iter_history_events("m", 0, 1, 1)]
+        self.assertEqual(events, [0, 1, 2])
+
+    async def test_total_changes(self):
+        # 只按第一页的total分页,之后变少的页面返回空,变多的部分不会拉取
+        pages = self.client.iter_devices(limit=4, concurrency=1)
+        self.assertEqual(await pages.__anext__(), 0)
+        self.rows = self.rows[:6]
+        self.total = 100
+        self.assertEqual([d async for d in pages], [1, 2, 3, 4, 5])
+        self.assertEqual(self.requests, [0, 4, 8])
+
+    async def test_early_stop(self):
+        # 合并的GET请求被shield保护,调用方取消时请求本身不会取消
+        self.client.coalesce = False
+        self.delay = lambda offset: 0 if offset < 2 else 10
+        pages = self.client.iter_devices(limit=1, concurrency=4)
+        async for device in pages:
+            if device == 1:
+                break
+        await pages.aclose()
+        self.assertEqual(self.requests, [0, 1, 2, 3, 4])  # 第6页取消时还没开始
+        self.assertEqual(sorted(self.cancelled), [2, 3, 4])
+        self.assertEqual(self.running, 0)
+
+    async def test_columns_error(self):
+        self.client.coalesce = False
+        self.delay = lambda offset: 0 if offset < 2 else 10
+        send_once = self.client._send_once
+
+        async def broken_page(method, url, params=None, json=None):
+            resp = await send_once(method, url, params, json)
+            if params["offset"] == 1:
+                resp["data"] = [{}]  # 没有timestamp,columns.extend会出错
+            return resp
+
+        self.client._send_once = broken_page
+        with self.assertRaises(KeyError):
+            await self.client.get_history_columns("m", 0, 1, limit=1, concurrency=4)
+        # 出错时预取的页面立刻被取消,不用等生成器被回收
+        self.assertEqual(sorted(self.cancelled), [2, 3, 4])
+        self.assertEqual(self.running, 0)
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+
+from qingping_sdk import ClientPool, ResponseCache
+
+
+class TestClientPool(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.pool = ClientPool(max_tenants=2, max_concurrency=2)
+        self.fetched = []
+        self.running = 0
+        self.max_running = 0
+
+    async def asyncTearDown(self):
+        await self.pool.close()
+
+    def get(self, app_key: str):
+        client = self.pool.get(app_key, "secret")
+
+        async def get_access_token():
+            self.fetched.append(app_key)
+            return {"access_token": f"token-{app_key}", "expires_in": 7200}
+
+        async def send_once(method, url, params=None, json=None):
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            await asyncio.sleep(0.01)
+            self.running -= 1
+            return {"token": client.access_token}
+
+        client._get_access_token = get_access_token
+        client._send_once = send_once
+        return client
+
+    async def test_shared_session(self):
+        a = self.get("a")
+        b = self.get("b")
+        self.assertIs(a.client_session, b.client_session)
+        self.assertIs(self.pool.connector, a.client_session.connector)
+        self.assertIs(self.pool.get("a"), a)
+
+    async def test_lazy_token(self):
+        client = self.get("a")
+        self.assertIsNone(client.access_token)
+        results = await asyncio.gather(*(client.get_alert(str(i)) for i in range(3)))
+        self.assertEqual(results, [{"token": "token-a"}] * 3)
+        self.assertEqual(self.fetched, ["a"])
+
+    async def test_fairness(self):
+        client = self.get("a")
+        await asyncio.gather(*(client.get_alert(str(i)) for i in range(6)))
+        self.assertEqual(self.max_running, 2)
+
+    async def test_lru(self):
+        await self.get("a").get_groups()
+        self.get("b")
+        self.pool.get("a")
+        self.get("c")
+        self.assertEqual(list(self.pool._clients), ["a", "c"])
+        self.assertEqual(self.pool.evicted, 1)
+        # 淘汰后token还在token_store里,不用重新认证
+        self.pool.discard("a")
+        await self.get("a").get_groups()
+        self.assertEqual(self.fetched, ["a"])
+
+    async def test_evict_in_flight(self):
+        self.pool.max_tenants = 1
+        a = self.get("a")
+
+        async def get_device_info(mac_list, profile):
+            await asyncio.sleep(0.01)
+            return {"profiles": [{"mac": mac, "sn": mac.lower()} for mac in mac_list]}
+
+        a.get_device_info = get_device_info
+        load = asyncio.ensure_future(a.load_device_info("A", ["sn"]))
+        groups = asyncio.ensure_future(a.get_groups())
+        await asyncio.sleep(0)
+        self.get("b")  # 淘汰a
+        self.assertNotIn("a", self.pool)
+        self.assertEqual(await load, {"mac": "A", "sn": "a"})
+        self.assertEqual(await groups, {"token": "token-a"})
+
+    async def test_idle(self):
+        self.pool.idle_timeout = 0
+        self.get("a")
+        self.get("b")
+        self.assertEqual(list(self.pool._clients), ["b"])
+
+    async def test_cache_per_tenant(self):
+        with self.assertRaises(TypeError):
+            ClientPool(cache=ResponseCache())
+        self.pool.cache_factory = ResponseCache
+        a = self.get("a")
+        b = self.get("b")
+        self.assertIsNot(a.cache, b.cache)
+        self.assertEqual(await a.get_groups(), {"token": "token-a"})
+        self.assertEqual(await b.get_groups(), {"token": "token-b"})
+        self.assertEqual(await a.get_groups(), {"token": "token-a"})
+        self.assertEqual((a.cache.hits, b.cache.hits), (1, 0))
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+from types import SimpleNamespace
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import patch
+
+from qingping_sdk import Client
+from qingping_sdk.ratelimit import RateLimiter, TokenBucket
+
+
+class FakeClock:
+    """替换ratelimit模块里的time和asyncio,sleep只推进时间"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    async def sleep(self, delay: float):
+        self.sleeps.append(delay)
+        self.now += delay
+
+
+class TestRateLimit(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = patch.multiple(
+            "qingping_sdk.ratelimit",
+            time=self.clock,
+            asyncio=SimpleNamespace(sleep=self.clock.sleep),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_bucket(self):
+        bucket = TokenBucket(2, 4)
+        self.assertEqual([bucket.reserve() for _ in range(6)], [0, 0, 0, 0, 0.5, 1])
+        self.clock.now = 1.0  # 补充2个,还清欠下的2个
+        self.assertEqual(bucket.reserve(), 0.5)
+        self.clock.now = 100.0  # 最多补到capacity
+        self.assertEqual([bucket.reserve() for _ in range(5)], [0, 0, 0, 0, 0.5])
+        self.assertEqual(TokenBucket(3).capacity, 3)
+
+    async def test_endpoints(self):
+        limiter = RateLimiter(10, 10, endpoints={"/a": (1, 1)})
+        limiter.set_endpoint("/b", 2, 1)
+        self.assertEqual(await limiter.acquire("/a"), 0)
+        self.assertEqual(await limiter.acquire("/a"), 1)  # 受/a的桶限制
+        self.assertEqual(await limiter.acquire("/b"), 0)
+        self.assertEqual(await limiter.acquire("/b"), 0.5)
+        self.assertEqual(await limiter.acquire("/c"), 0)  # 只受全局桶限制
+        self.assertEqual(self.clock.sleeps, [1, 0.5])
+        self.assertEqual(limiter.acquired, 5)
+        self.assertEqual(limiter.waited, 1.5)
+        self.assertEqual(limiter.max_wait, 1)
+
+    async def test_client(self):
+        limiter = RateLimiter(1, 2, endpoints={"/v1/apis/groups": (0.25, 1)})
+        client = Client("key", "secret", rate_limiter=limiter)
+        sent = []
+
+        async def send_once(method, url, params=None, json=None):
+            sent.append(self.clock.now)
+            return {}
+
+        client._send_once = send_once
+        for _ in range(3):
+            await client.get_alert("a")
+        self.assertEqual(sent, [0, 0, 1])
+        await client.get_groups()  # 全局桶在t=2才有令牌
+        await client.get_groups()  # groups的桶每4秒一个
+        self.assertEqual(sent, [0, 0, 1, 2, 5])
+        self.assertEqual(limiter.acquired, 5)
+        self.assertEqual(limiter.max_wait, 3)
+        await client.aclose()
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
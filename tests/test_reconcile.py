@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+from qingping_sdk import Client
+from qingping_sdk.exceptions import ServerException
+from qingping_sdk.reconcile import Policy, Reconciler, diff_alerts
+
+TEMP_HIGH = {"metric_name": "temperature", "operator": "gt", "threshold": 30}
+HUM_LOW = {"metric_name": "humidity", "operator": "lt", "threshold": 20}
+
+
+class TestDiff(TestCase):
+    def test_diff(self):
+        current = [
+            dict(TEMP_HIGH, id=1),
+            dict(TEMP_HIGH, id=2),
+            dict(HUM_LOW, id=3, threshold=25),
+            {"id": 4, "metric_name": "pm25", "operator": "gt", "threshold": 75},
+        ]
+        plan = diff_alerts(
+            current,
+            [
+                TEMP_HIGH,
+                HUM_LOW,
+                {"metric_name": "co2", "operator": "gt", "threshold": 1000},
+            ],
+        )
+        self.assertEqual(
+            plan.add, [{"metric_name": "co2", "operator": "gt", "threshold": 1000}]
+        )
+        self.assertEqual(plan.change, [dict(HUM_LOW, id=3)])
+        self.assertEqual(plan.delete, [2, 4])
+        self.assertFalse(diff_alerts([dict(TEMP_HIGH, id=1)], [TEMP_HIGH]))
+        with self.assertRaises(ValueError):
+            diff_alerts([], [TEMP_HIGH, TEMP_HIGH])
+
+    def test_policy(self):
+        with self.assertRaises(ValueError):
+            Policy(report_interval=60)
+
+
+class TestReconciler(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.client = Client("key", "secret")
+        self.calls = []
+        self.alerts = {
+            f"m{i}": [dict(TEMP_HIGH, id=i)] for i in range(250)
+        }  # type: dict
+        self.devices = [
+            {
+                "info": {
+                    "mac": f"m{i}",
+                    "group_id": i % 2,
+                    "setting": {
+                        "report_interval": 600 if i < 10 else 900,
+                        "collect_interval": 60,
+                    },
+                }
+            }
+            for i in range(250)
+        ]
+
+        async def send_once(method, url, params=None, json=None):
+            path = url.split("/v1/apis/")[1]
+            if method == "GET" and path == "devices":
+                rows = [
+                    d
+                    for d in self.devices
+                    if params.get("group_id") is None
+                    or d["info"]["group_id"] == params["group_id"]
+                ]
+                offset, limit = params.get("offset", 0), params.get("limit", 200)
+                return {"total": len(rows), "devices": rows[offset : offset + limit]}
+            if method == "GET":
+                return {
+                    "mac": params["mac"],
+                    "alert_configs": self.alerts[params["mac"]],
+                }
+            self.calls.append((method, path, json))
+            if json.get("mac") == "m4":
+                raise ServerException("boom")
+
+        self.client._send_once = send_once
+        self.client.retry_policy.max_attempts = 1
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+
+    async def test_group_rollout(self):
+        policy = Policy([TEMP_HIGH, HUM_LOW], report_interval=600, collect_interval=60)
+        report = await Reconciler(self.client, concurrency=4).reconcile(
+            devices={"m1": Policy([TEMP_HIGH])}, groups={0: policy}
+        )
+        self.assertEqual(len(report), 126)
+        adds = [c for c in self.calls if c[0] == "POST"]
+        self.assertEqual(len(adds), 125)
+        settings = [c[2]["mac"] for c in self.calls if c[1] == "devices/settings"]
+        # m0,m2..m8 已经是600秒,剩下的120个分成两批
+        self.assertEqual(sorted(len(macs) for macs in settings), [20, 100])
+        self.assertTrue(report["m0"].ok and report["m0"].added == 1)
+        self.assertFalse(report["m0"].settings_changed)
+        self.assertTrue(report["m10"].settings_changed)
+        self.assertTrue(report["m1"].unchanged)
+        self.assertFalse(report["m4"].ok)
+        self.assertEqual(report["m4"].added, 0)
+
+    async def test_dry_run(self):
+        report = await Reconciler(self.client, dry_run=True).reconcile(
+            devices={
+                "m5": Policy([], 900, 60),
+                "m20": Policy(report_interval=900, collect_interval=60),
+            }
+        )
+        self.assertEqual(self.calls, [])
+        self.assertEqual(report["m5"].deleted, 1)
+        self.assertTrue(report["m5"].settings_changed)
+        self.assertTrue(report["m20"].unchanged)
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import os
+import tempfile
+import time
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+from qingping_sdk import Client
+from qingping_sdk.exceptions import (
+    RequestException,
+    ServerException,
+    UnauthorizedException,
+)
+from qingping_sdk.retry import RetryPolicy
+from qingping_sdk.token_store import FileTokenStore
+from qingping_sdk.utils import make_timestamp
+
+
+class TestTimestamp(TestCase):
+    def test_strictly_increasing(self):
+        stamps = [make_timestamp() for _ in range(10000)]
+        self.assertEqual(len(set(stamps)), len(stamps))
+        self.assertEqual(stamps, sorted(stamps))
+
+    def test_backoff(self):
+        policy = RetryPolicy(base_delay=1, max_delay=5, jitter=False)
+        self.assertEqual([policy.backoff(i) for i in range(1, 6)], [1, 2, 4, 5, 5])
+        policy = RetryPolicy(base_delay=1, max_delay=5)
+        for i in range(1, 6):
+            self.assertLessEqual(policy.backoff(i), 5)
+
+
+class TestRetry(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.client = Client(
+            "key", "secret", retry_policy=RetryPolicy(base_delay=0, jitter=False)
+        )
+        self.sent = []
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+
+    async def test_retry_restamp(self):
+        async def send_once(method, url, params=None, json=None):
+            self.sent.append(params["timestamp"])
+            if len(self.sent) < 3:
+                raise ServerException("503")
+            return {"total": 0}
+
+        self.client._send_once = send_once
+        self.assertEqual(await self.client.get_groups(), {"total": 0})
+        self.assertEqual(len(set(self.sent)), 3)
+
+    async def test_give_up(self):
+        async def send_once(method, url, params=None, json=None):
+            self.sent.append(params)
+            raise ServerException("503")
+
+        self.client._send_once = send_once
+        with self.assertRaises(ServerException):
+            await self.client.get_groups()
+        self.assertEqual(len(self.sent), 3)
+
+    async def test_post_not_retried(self):
+        async def send_once(method, url, params=None, json=None):
+            self.sent.append(json)
+            raise ServerException("503")
+
+        self.client._send_once = send_once
+        with self.assertRaises(ServerException):
+            await self.client.bind_device("token", 1)
+        self.assertEqual(len(self.sent), 1)
+        self.client.retry_policy.retry_methods = frozenset(("POST",))
+        with self.assertRaises(ServerException):
+            await self.client.bind_device("token", 1)
+        self.assertEqual(len(self.sent), 4)
+
+    async def test_no_retry(self):
+        async def send_once(method, url, params=None, json=None):
+            self.sent.append(params)
+            raise RequestException("400")
+
+        self.client._send_once = send_once
+        with self.assertRaises(RequestException):
+            await self.client.get_groups()
+        self.assertEqual(len(self.sent), 1)
+
+    async def test_reauth_single_flight(self):
+        fetched = []
+
+        async def get_access_token():
+            fetched.append(None)
+            await asyncio.sleep(0.01)
+            return {"access_token": f"token{len(fetched)}", "expires_in": 7200}
+
+        async def send_once(method, url, params=None, json=None):
+            if self.client.access_token == "token0":
+                await asyncio.sleep(0.01)
+                raise UnauthorizedException("401")
+            return self.client.access_token
+
+        self.client.access_token = "token0"
+        self.client._get_access_token = get_access_token
+        self.client._send_once = send_once
+        ret = await asyncio.gather(*[self.client.get_groups() for _ in range(10)])
+        self.assertEqual(ret, ["token1"] * 10)
+        self.assertEqual(len(fetched), 1)
+
+    async def test_token_store(self):
+        with tempfile.TemporaryDirectory() as d:
+            store = FileTokenStore(os.path.join(d, "tokens.json"))
+            store.save(
+                "key", {"access_token": "cached", "expires_at": time.time() + 3600}
+            )
+            client = Client("key", "secret", token_store=store)
+
+            async def get_access_token():
+                raise AssertionError("should use the cached token")
+
+            client._get_access_token = get_access_token
+            async with client:
+                self.assertEqual(client.access_token, "cached")
+
+    async def test_short_lifetime(self):
+        fetched = []
+
+        async def get_access_token():
+            fetched.append(None)
+            if len(fetched) > 2:
+                raise ServerException("503")
+            return {"access_token": "token", "expires_in": 0.2}
+
+        client = Client("key", "secret", refresh_margin=60)
+        client._get_access_token = get_access_token
+        async with client:
+            # 有效期比refresh_margin短时在过半时刷新,失败后至少等MIN_REFRESH_DELAY
+            await asyncio.sleep(0.5)
+            self.assertEqual(len(fetched), 3)
+
+    async def test_enter_failure_closes_session(self):
+        async def get_access_token():
+            raise ServerException("503")
+
+        client = Client("key", "secret")
+        client._get_access_token = get_access_token
+        with self.assertRaises(ServerException):
+            async with client:
+                pass
+        self.assertTrue(client.client_session.closed)
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
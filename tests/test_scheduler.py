@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+from unittest import IsolatedAsyncioTestCase
+
+from qingping_sdk import Client
+from qingping_sdk.scheduler import PollScheduler
+
+
+def device(mac, group_id, interval, timestamp, temperature, offline=False):
+    return {
+        "info": {
+            "mac": mac,
+            "group_id": group_id,
+            "status": {"offline": offline},
+            "setting": {"report_interval": interval, "collect_interval": 60},
+        },
+        "data": {
+            "timestamp": {"value": timestamp},
+            "temperature": {"value": temperature},
+            "humidity": {"value": 50},
+        },
+    }
+
+
+class TestPollScheduler(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.client = Client("key", "secret")
+        self.devices = {
+            "a": device("a", 1, 60, 1000, 20),
+            "b": device("b", 1, 60, 1000, 20),
+            "c": device("c", 1, 900, 1000, 20),
+            "d": device("d", 1, 60, 900, 20, offline=True),
+            "e": device("e", None, 60, 1000, 20),
+        }
+        self.history = {"e": []}
+        self.requests = []
+
+        async def send_once(method, url, params=None, json=None):
+            path = url.split("/v1/apis/")[1]
+            self.requests.append((path, params.get("group_id") or params.get("mac")))
+            if path == "devices":
+                rows = [
+                    d
+                    for d in self.devices.values()
+                    if params.get("group_id") is None
+                    or d["info"]["group_id"] == params["group_id"]
+                ]
+                return {"total": len(rows), "devices": rows}
+            rows = [
+                row
+                for row in self.history[params["mac"]]
+                if params["start_time"]
+                <= row["timestamp"]["value"]
+                <= params["end_time"]
+            ]
+            return {"total": len(rows), "data": rows}
+
+        self.client._send_once = send_once
+        self.scheduler = PollScheduler(self.client, grace=10, batch_window=5)
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+
+    async def test_schedule(self):
+        deltas = await self.scheduler.refresh(now=1000)
+        self.assertEqual(len(deltas), 5)
+        self.assertEqual(self.scheduler.next_due(), 1060)  # d离线,1000+60
+        self.assertEqual(await self.scheduler.poll_once(now=1030), [])
+        self.requests.clear()
+
+        self.devices["a"] = device("a", 1, 60, 1060, 21)
+        self.devices["b"] = device("b", 1, 60, 1060, 20)
+        self.history["e"] = [
+            device("e", None, 60, 1030, 20)["data"],
+            device("e", None, 60, 1060, 22)["data"],
+        ]
+        deltas = await self.scheduler.poll_once(now=1070)
+        # a/b/d同组合并成一次列表请求,e没有分组走历史数据
+        self.assertEqual(sorted(self.requests), [("devices", 1), ("devices/data", "e")])
+        self.assertEqual(
+            [(d.mac, d.timestamp, d.changed) for d in deltas],
+            [("a", 1060, {"temperature": 21}), ("e", 1060, {"temperature": 22})],
+        )
+        states = self.scheduler.states
+        self.assertEqual(states["a"].due, 1130)
+        self.assertEqual(states["c"].due, 1910)
+        self.assertEqual(states["d"].misses, 1)
+        self.assertEqual(states["d"].due, 1070 + 120)
+
+        # 到点了没有新数据,指数退避
+        self.requests.clear()
+        await self.scheduler.poll_once(now=1130)
+        self.assertEqual(states["e"].misses, 1)
+        self.assertEqual(states["e"].due, 1130 + 120)
+
+    async def test_removed(self):
+        await self.scheduler.refresh(now=1000)
+        del self.devices["e"]
+        await self.scheduler.refresh(now=1001)
+        self.assertNotIn("e", self.scheduler.states)
+        self.assertEqual(self.scheduler.next_due(), 1060)
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+
+from qingping_sdk import Event
+from qingping_sdk.server import Gateway, connect
+
+
+def make_event(cmd: int, value: bytes) -> Event:
+    ev = Event(b"CG", cmd, 0, b"", 0)
+    ev.keys = {1: value}
+    return ev
+
+
+class TestGateway(IsolatedAsyncioTestCase):
+    async def test_echo(self):
+        def on_server_event(protocol, event):
+            protocol.send(make_event(event.cmd + 1, event.keys[1]))
+
+        replies = []
+        done = asyncio.Event()
+
+        def on_device_event(protocol, event):
+            replies.append((event.cmd, event.keys[1]))
+            if len(replies) == 100 * 10:
+                done.set()
+
+        async with Gateway(on_server_event) as gateway:
+            await gateway.start("127.0.0.1")
+            devices = await asyncio.gather(
+                *[
+                    connect("127.0.0.1", gateway.port, on_device_event)
+                    for _ in range(100)
+                ]
+            )
+            for i, device in enumerate(devices):
+                device.transport.write(
+                    b"".join(make_event(0x31, b"%d" % i).to_bytes() for _ in range(10))
+                )
+            await asyncio.wait_for(done.wait(), 5)
+            self.assertEqual(len(gateway.connections), 100)
+            self.assertEqual(sorted(set(replies))[0], (0x32, b"0"))
+            for device in devices:
+                device.close()
+                await device.wait_closed()
+
+    async def test_backpressure(self):
+        release = asyncio.Event()
+        handled = []
+
+        async def slow_handler(protocol, event):
+            await release.wait()
+            handled.append(event)
+
+        async with Gateway(slow_handler, queue_size=4, max_frame_size=1024) as gateway:
+            await gateway.start("127.0.0.1")
+            device = await connect("127.0.0.1", gateway.port, lambda p, e: None)
+            device.transport.write(make_event(0x31, b"x" * 100).to_bytes() * 50)
+            for _ in range(100):
+                await asyncio.sleep(0.01)
+                if gateway.connections:
+                    (protocol,) = gateway.connections
+                    if protocol._reading_paused:
+                        break
+            self.assertTrue(protocol._reading_paused)
+            self.assertEqual(protocol.connection.max_frame_size, 1024)
+            self.assertLessEqual(len(protocol._queue), 50)
+            release.set()
+            for _ in range(100):
+                await asyncio.sleep(0.01)
+                if len(handled) == 50:
+                    break
+            self.assertEqual(len(handled), 50)
+            self.assertFalse(protocol._reading_paused)
+            device.close()
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+import json
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+from qingping_sdk import Client, models
+from qingping_sdk.exceptions import AuthException
+from qingping_sdk.utils import JSONArrayStream
+
+DOC = {
+    "total": 3,
+    "name": "devices",
+    "other": {"devices": [0]},
+    "devices": [
+        {"info": {"mac": 'A"]\\', "name": "{,}"}, "data": {"pm25": {"value": 1}}},
+        {"info": {"mac": "B"}},
+        {"info": {"mac": "C"}},
+    ],
+    "tail": [1, 2],
+}
+
+
+class FakeContent:
+    def __init__(self, body: bytes):
+        self.body = body
+
+    async def iter_chunked(self, n):
+        for i in range(0, len(self.body), 7):  # 故意切得很碎
+            yield self.body[i : i + 7]
+
+
+class FakeResponse:
+    def __init__(self, status: int, body: bytes, content_type="application/json"):
+        self.status = status
+        self.body = body
+        self.content_type = content_type
+        self.content = FakeContent(body)
+
+    async def read(self):
+        return self.body
+
+    async def text(self):
+        return self.body.decode()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class FakeSession:
+    def __init__(self, response: FakeResponse):
+        self.response = response
+        self.closed = False
+
+    def get(self, url, **kw):
+        return self.response
+
+    def request(self, method, url, **kw):
+        return self.response
+
+    async def close(self):
+        self.closed = True
+
+
+class TestJSONArrayStream(TestCase):
+    def test_split_anywhere(self):
+        raw = json.dumps(DOC).encode()
+        for i in range(len(raw)):
+            stream = JSONArrayStream("devices")
+            items = stream.feed(raw[:i]) + stream.feed(raw[i:])
+            self.assertEqual([json.loads(x) for x in items], DOC["devices"])
+            self.assertTrue(stream.done)
+
+    def test_bytewise(self):
+        stream = JSONArrayStream("devices")
+        items = []
+        for b in b'{"devices": [1, "a\\\\", [], {}], "x": 1}':
+            items += stream.feed(bytes([b]))
+        self.assertEqual(items, [b"1", b'"a\\\\"', b"[]", b"{}"])
+        self.assertEqual(len(stream._buf), 0)
+
+    def test_empty(self):
+        stream = JSONArrayStream("devices")
+        self.assertEqual(stream.feed(b'{"total": 0, "devices": []}'), [])
+        self.assertTrue(stream.done)
+
+
+class TestClientDecode(IsolatedAsyncioTestCase):
+    async def test_bytes_loads(self):
+        seen = []
+
+        def loads(data):
+            seen.append(type(data))
+            return json.loads(data)
+
+        body = json.dumps(DOC).encode()
+        client = Client(
+            "key",
+            "secret",
+            client_session=FakeSession(FakeResponse(200, body)),
+            loads=loads,
+        )
+        self.assertEqual(await client._send_once("GET", "https://x"), DOC)
+        self.assertEqual(seen, [bytes])
+        client.client_session.response = FakeResponse(200, b"  ")
+        self.assertIsNone(await client._send_once("GET", "https://x"))
+        client.client_session.response = FakeResponse(200, b"ok", "text/plain")
+        self.assertEqual(await client._send_once("GET", "https://x"), "ok")
+        await client.aclose()
+
+    async def test_stream_devices(self):
+        body = json.dumps(DOC).encode()
+        client = Client(
+            "key",
+            "secret",
+            client_session=FakeSession(FakeResponse(200, body)),
+            use_models=True,
+        )
+        devices = [d async for d in client.stream_devices(role="agent")]
+        self.assertEqual([d.info.mac for d in devices], ['A"]\\', "B", "C"])
+        self.assertIsInstance(devices[0], models.Device)
+        self.assertEqual(devices[0]["data"]["pm25"]["value"], 1)
+        await client.aclose()
+
+    async def test_stream_error(self):
+        client = Client(
+            "key", "secret", client_session=FakeSession(FakeResponse(403, b"denied"))
+        )
+        with self.assertRaises(AuthException):
+            async for _ in client.stream_devices():
+                pass
+        await client.aclose()
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+from qingping_sdk.sync import (
+    EVENTS,
+    HistorySync,
+    MemoryCheckpointStore,
+    SQLiteCheckpointStore,
+)
+
+
+class FakeClient:
+    def __init__(self, timestamps):
+        self.timestamps = timestamps
+        self.calls = []
+
+    async def iter_history_data(self, mac, start_time, end_time, concurrency=4):
+        self.calls.append((start_time, end_time))
+        for ts in self.timestamps:
+            if start_time <= ts <= end_time:
+                yield {"timestamp": {"value": ts}}
+
+    async def iter_history_events(self, mac, start_time, end_time, concurrency=4):
+        async for row in self.iter_history_data(mac, start_time, end_time):
+            yield {"data": row}
+
+
+class TestSQLiteCheckpointStore(TestCase):
+    def test_store(self):
+        with tempfile.TemporaryDirectory() as d:
+            store = SQLiteCheckpointStore(os.path.join(d, "checkpoints.db"))
+            self.assertIsNone(store.get("a", "data"))
+            store.set("a", "data", 1)
+            store.set("a", "data", 2)
+            store.set("a", "events", 3)
+            self.assertEqual(store.get("a", "data"), 2)
+            self.assertEqual(store.get("a", "events"), 3)
+            store.close()
+
+
+class TestHistorySync(IsolatedAsyncioTestCase):
+    async def test_incremental(self):
+        client = FakeClient([100, 160, 160, 160, 220, 280])
+        sync = HistorySync(client, MemoryCheckpointStore(), batch_size=2)
+        batches = [batch async for batch in sync.iter_batches("a", end_time=300)]
+        self.assertEqual([len(batch.rows) for batch in batches], [4, 2])
+        batches[0].ack()
+
+        batches = [batch async for batch in sync.iter_batches("a", end_time=300)]
+        self.assertEqual(client.calls[-1], (160, 300))
+        self.assertEqual(
+            [row["timestamp"]["value"] for row in batches[0].rows], [220, 280]
+        )
+        batches[0].ack()
+        batches = [batch async for batch in sync.iter_batches("a", end_time=300)]
+        self.assertEqual(batches, [])
+
+    async def test_out_of_order_ack(self):
+        client = FakeClient([100, 160, 220, 280])
+        sync = HistorySync(client, MemoryCheckpointStore(), batch_size=1)
+        batches = [batch async for batch in sync.iter_batches("a", end_time=300)]
+        self.assertEqual([batch.timestamp for batch in batches], [100, 160, 220, 280])
+        batches[2].ack()
+        batches[1].ack()
+        self.assertIsNone(sync.store.get("a", "data"))  # 第一批还没确认
+        batches[0].ack()
+        self.assertEqual(sync.store.get("a", "data"), 220)
+        batches[3].ack()
+        self.assertEqual(sync.store.get("a", "data"), 280)
+
+    async def test_events(self):
+        client = FakeClient([100, 200])
+        sync = HistorySync(client, MemoryCheckpointStore())
+        sync.store.set("a", EVENTS, 100)
+        batches = [b async for b in sync.iter_batches("a", EVENTS, end_time=300)]
+        self.assertEqual(batches[0].rows, [{"data": {"timestamp": {"value": 200}}}])
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()
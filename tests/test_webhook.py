@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from qingping_sdk import models
+from qingping_sdk.webhook import (
+    WebhookReceiver,
+    build_push,
+    decode_push,
+    replay,
+    verify_signature,
+)
+
+INFO = {"mac": "582D3400A1B2", "name": "office"}
+DATA = {"timestamp": {"value": 1700000000}, "temperature": {"value": 23.5}}
+EVENT = {
+    "data": DATA,
+    "alert_config": {"metric_name": "temperature", "operator": "gt", "threshold": 20},
+}
+
+
+class TestPush(TestCase):
+    def test_signature(self):
+        message = build_push(INFO, [DATA], "secret")
+        self.assertTrue(verify_signature("secret", message, 60))
+        self.assertFalse(verify_signature("other", message, 60))
+        message["signature"]["timestamp"] -= 3600
+        self.assertFalse(verify_signature("secret", message, 60))
+        self.assertFalse(verify_signature("secret", build_push(INFO, [DATA])))
+
+    def test_decode(self):
+        record = decode_push(build_push(INFO, [DATA, EVENT]))
+        self.assertEqual(record.mac, INFO["mac"])
+        self.assertEqual(record.data, [DATA])
+        self.assertEqual(record.events, [EVENT])
+        record = decode_push(build_push(INFO, [EVENT]), use_models=True)
+        self.assertIsInstance(record.events[0], models.Event)
+        self.assertEqual(record.events[0].alert_config.threshold, 20)
+
+
+class TestWebhookReceiver(IsolatedAsyncioTestCase):
+    async def start(self, sink, **kw):
+        self.receiver = WebhookReceiver(sink, **kw)
+        self.server = TestServer(self.receiver.app())
+        await self.server.start_server()
+        return str(self.server.make_url(self.receiver.path))
+
+    async def asyncTearDown(self):
+        await self.server.close()
+
+    async def test_batches(self):
+        batches = []
+        url = await self.start(
+            batches.append, app_secret="secret", batch_size=4, batch_interval=0.2
+        )
+        messages = [
+            build_push(dict(INFO, mac=str(i)), [DATA], "secret") for i in range(10)
+        ]
+        messages.append(build_push(INFO, [DATA], "wrong"))
+        messages.append(dict(build_push(INFO, [DATA], "secret"), payload=[]))
+        statuses = await replay(url, messages)
+        self.assertEqual(statuses, [200] * 10 + [401, 400])
+        await asyncio.sleep(0.3)
+        self.assertEqual([len(batch) for batch in batches], [4, 4, 2])
+        self.assertEqual(
+            [r.mac for batch in batches for r in batch], [str(i) for i in range(10)]
+        )
+        self.assertEqual(self.receiver.rejected, 2)
+
+    async def test_shed(self):
+        release = asyncio.Event()
+        seen = []
+
+        async def sink(batch):
+            seen.extend(batch)
+            await release.wait()
+
+        url = await self.start(sink, queue_size=2, batch_size=1, batch_interval=0)
+        messages = [build_push(INFO, [DATA]) for _ in range(6)]
+        statuses = await replay(url, messages)
+        # 第一条被sink拿走卡住,队列里再放两条,其余被拒绝
+        self.assertEqual(statuses.count(503), self.receiver.shed)
+        self.assertGreater(self.receiver.shed, 0)
+        release.set()
+        await asyncio.sleep(0.05)
+        self.assertEqual(len(seen), statuses.count(200))
+
+    async def test_slow_sink(self):
+        batches = []
+
+        async def sink(batch):
+            batches.append(len(batch))
+            await asyncio.sleep(0.05)
+
+        url = await self.start(sink, batch_size=100, batch_interval=0.3)
+        async with aiohttp.ClientSession() as session:
+            for _ in range(80):  # 每10ms左右一条,每个窗口应该攒到大约30条
+                await replay(url, [build_push(INFO, [DATA])], session)
+                await asyncio.sleep(0.01)
+        await asyncio.sleep(0.4)
+        self.assertEqual(sum(batches), 80)
+        # 以前sink处理期间到达的推送会被立刻拆成几条一批发出去
+        self.assertLessEqual(len(batches), 6, batches)
+        self.assertTrue(all(n >= 5 for n in batches[:-1]), batches)
+
+    async def test_not_started(self):
+        self.receiver = WebhookReceiver([].append)
+        app = web.Application()
+        app.router.add_post(self.receiver.path, self.receiver.handle)
+        self.server = TestServer(app)
+        await self.server.start_server()
+        url = str(self.server.make_url(self.receiver.path))
+        self.assertEqual(await replay(url, [build_push(INFO, [DATA])]), [503])
+        self.assertEqual(len(self.receiver), 0)
+
+
+if __name__ == "__main__":
+    import unittest
+
+    unittest.main()